@@ -0,0 +1,368 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A compact binary encoding of IR programs, designed to be memory-mapped.
+
+Reading a binary IR file only maps it into memory; rules are decoded one at a
+time when they are first accessed. Because the file is never copied into the
+process, several processes interpreting the same program share a single
+page-cached copy of it.
+
+All integers are little-endian. The layout of a file is:
+
+  header:      magic, version, number of keys, number of tables,
+               offset of the string table, offset of the table index
+  shape:       the width of each key, one u32 per key
+  rules:       the encoded rules of every table (see below)
+  strings:     number of strings, then each string as a u32 length followed by
+               its utf-8 bytes. Store and header names refer to strings by
+               their position in this table.
+  table index: for each table, a u32 rule count followed by the u64 offset of
+               each of its rules
+
+Each rule is encoded as its patterns, a u16 action count, and its actions. A
+pattern is its value followed by its mask, each as the bits of the key padded
+to a whole number of bytes. Actions and expressions are encoded as a tag byte
+followed by their arguments:
+
+  MoveCursor:     0, intexp
+  CopyData:       1, intexp, locexp
+  ExtractHeader:  2, u32 string id, locexp
+  constant:       0, u32 width, the value as ceil(width / 8) big-endian bytes
+  location:       1, locexp
+  arithmetic:     2, u8 operator, intexp, intexp
+  locexp:         u32 string id, intexp, intexp
+"""
+
+from collections.abc import Sequence
+import mmap
+import struct
+
+from interpreter import ir_parser
+import interpreter.datatypes as d
+
+ParseError = ir_parser.ParseError
+
+MAGIC = b"CAIRNBIR"
+VERSION = 1
+
+header_struct = struct.Struct("<8sHHIIQQ")
+u8 = struct.Struct("<B")
+u16 = struct.Struct("<H")
+u32 = struct.Struct("<I")
+u64 = struct.Struct("<Q")
+
+action_tags = {
+    d.ActionType.MOVECURSOR: 0,
+    d.ActionType.COPYDATA: 1,
+    d.ActionType.EXTRACTHEADER: 2,
+}
+action_types = {tag: ty for ty, tag in action_tags.items()}
+op_tags = {op: i for i, op in enumerate(d.ArithOp)}
+ops = list(d.ArithOp)
+
+CONST_TAG = 0
+LOCATION_TAG = 1
+ARITH_TAG = 2
+
+# The errors that decoding a truncated or corrupt file can raise
+DECODE_ERRORS = (struct.error, IndexError, KeyError, ValueError, AssertionError)
+
+
+class Encoder:
+  """Accumulates the encoding of a program, interning strings as it goes."""
+
+  def __init__(self):
+    self.strings: list[str] = []
+    self.string_ids: dict[str, int] = {}
+
+  def string(self, s: str) -> bytes:
+    if s not in self.string_ids:
+      self.string_ids[s] = len(self.strings)
+      self.strings.append(s)
+    return u32.pack(self.string_ids[s])
+
+  def intexp(self, e: d.IntExp) -> bytes:
+    exp = e.exp
+    if isinstance(exp, d.SizedInt):
+      value = exp.value.to_bytes((exp.width + 7) // 8, "big")
+      return u8.pack(CONST_TAG) + u32.pack(exp.width) + value
+    if isinstance(exp, d.LocationExp):
+      return u8.pack(LOCATION_TAG) + self.locexp(exp)
+    return (
+        u8.pack(ARITH_TAG)
+        + u8.pack(op_tags[exp.op])
+        + self.intexp(exp.left)
+        + self.intexp(exp.right)
+    )
+
+  def locexp(self, e: d.LocationExp) -> bytes:
+    return self.string(e.name) + self.intexp(e.start) + self.intexp(e.end)
+
+  def action(self, a: d.Action) -> bytes:
+    tag = u8.pack(action_tags[a.action_type])
+    if a.action_type == d.ActionType.MOVECURSOR:
+      return tag + self.intexp(a.action_args)
+    if a.action_type == d.ActionType.COPYDATA:
+      value, dst = a.action_args
+      return tag + self.intexp(value) + self.locexp(dst)
+    name, loc = a.action_args
+    return tag + self.string(name) + self.locexp(loc)
+
+  def rule(self, rule: d.Rule) -> bytes:
+    patterns, actions = rule
+    parts = [p.value.tobytes() + p.mask.tobytes() for p in patterns]
+    parts.append(u16.pack(len(actions)))
+    # Sort so that the encoding of a rule doesn't depend on set iteration order
+    parts.extend(sorted(self.action(a) for a in actions))
+    return b"".join(parts)
+
+
+def write_binary(tcam: d.TCAM, path: str) -> None:
+  """Write a TCAM to a file in the binary IR format."""
+  shape = [p.value.length for p in tcam[0][0][0]] if tcam and tcam[0] else []
+  encoder = Encoder()
+  table_offsets = []
+  with open(path, "wb") as f:
+    f.write(b"\0" * header_struct.size)
+    f.write(b"".join(u32.pack(width) for width in shape))
+    for table in tcam:
+      offsets = []
+      for rule in table:
+        if [p.value.length for p in rule[0]] != shape:
+          raise ParseError(
+              "All patterns must have the same 'shape'. The following pattern"
+              " has a different shape from the first pattern in the table: "
+              + str(rule[0])
+          )
+        offsets.append(f.tell())
+        f.write(encoder.rule(rule))
+      table_offsets.append(offsets)
+
+    strings_offset = f.tell()
+    f.write(u32.pack(len(encoder.strings)))
+    for s in encoder.strings:
+      encoded = s.encode("utf-8")
+      f.write(u32.pack(len(encoded)) + encoded)
+
+    index_offset = f.tell()
+    for offsets in table_offsets:
+      f.write(u32.pack(len(offsets)))
+      f.write(b"".join(u64.pack(offset) for offset in offsets))
+
+    f.seek(0)
+    f.write(
+        header_struct.pack(
+            MAGIC,
+            VERSION,
+            0,
+            len(shape),
+            len(tcam),
+            strings_offset,
+            index_offset,
+        )
+    )
+
+
+def convert(json_path: str, binary_path: str) -> None:
+  """Convert a json IR file to the binary IR format."""
+  with ir_parser.parse_ir_lazy(json_path) as tcam:
+    write_binary(tcam, binary_path)
+
+
+class Decoder:
+  """Decodes rules from a buffer holding a binary IR file."""
+
+  def __init__(
+      self, path: str, buf: mmap.mmap, shape: list[int], strings: list[str]
+  ):
+    self.path = path
+    self.buf = buf
+    self.shape = shape
+    self.strings = strings
+
+  def intexp(self, pos: int) -> tuple[d.IntExp, int]:
+    (tag,) = u8.unpack_from(self.buf, pos)
+    pos += 1
+    if tag == CONST_TAG:
+      (width,) = u32.unpack_from(self.buf, pos)
+      pos += 4
+      end = pos + (width + 7) // 8
+      value = int.from_bytes(self.buf[pos:end], "big")
+      return d.IntExp(d.SizedInt(value, width)), end
+    if tag == LOCATION_TAG:
+      loc, pos = self.locexp(pos)
+      return d.IntExp(loc), pos
+    (op,) = u8.unpack_from(self.buf, pos)
+    left, pos = self.intexp(pos + 1)
+    right, pos = self.intexp(pos)
+    return d.IntExp(d.ArithExp(ops[op], left, right)), pos
+
+  def locexp(self, pos: int) -> tuple[d.LocationExp, int]:
+    (name,) = u32.unpack_from(self.buf, pos)
+    start, pos = self.intexp(pos + 4)
+    end, pos = self.intexp(pos)
+    return d.LocationExp(self.strings[name], start, end), pos
+
+  def action(self, pos: int) -> tuple[d.Action, int]:
+    action_type = action_types[u8.unpack_from(self.buf, pos)[0]]
+    pos += 1
+    if action_type == d.ActionType.MOVECURSOR:
+      num_bits, pos = self.intexp(pos)
+      return d.Action(action_type, num_bits), pos
+    if action_type == d.ActionType.COPYDATA:
+      value, pos = self.intexp(pos)
+      dst, pos = self.locexp(pos)
+      return d.Action(action_type, (value, dst)), pos
+    (name,) = u32.unpack_from(self.buf, pos)
+    loc, pos = self.locexp(pos + 4)
+    return d.Action(action_type, (self.strings[name], loc)), pos
+
+  def rule(self, pos: int) -> d.Rule:
+    patterns = []
+    for width in self.shape:
+      num_bytes = (width + 7) // 8
+      value = d.Data(bytes=self.buf[pos : pos + num_bytes], length=width)
+      pos += num_bytes
+      mask = d.Data(bytes=self.buf[pos : pos + num_bytes], length=width)
+      pos += num_bytes
+      patterns.append(d.Pattern(value, mask))
+    (num_actions,) = u16.unpack_from(self.buf, pos)
+    pos += 2
+    actions = set()
+    for _ in range(num_actions):
+      action, pos = self.action(pos)
+      actions.add(action)
+    return (patterns, actions)
+
+
+class BinaryTable(Sequence[d.Rule]):
+  """A table of a BinaryTCAM. Each rule is decoded on first access."""
+
+  def __init__(self, decoder: Decoder, index_pos: int):
+    self._decoder = decoder
+    (self._num_rules,) = u32.unpack_from(decoder.buf, index_pos)
+    self._offsets_pos = index_pos + 4
+    self._rules: list[d.Rule | None] = [None] * self._num_rules
+
+  def __len__(self) -> int:
+    return self._num_rules
+
+  def __getitem__(self, idx):
+    if isinstance(idx, slice):
+      return [self[i] for i in range(*idx.indices(len(self)))]
+    if idx < 0:
+      idx += len(self)
+    if not 0 <= idx < len(self):
+      raise IndexError("Rule index %s out of range." % idx)
+    rule = self._rules[idx]
+    if rule is None:
+      try:
+        (pos,) = u64.unpack_from(
+            self._decoder.buf, self._offsets_pos + 8 * idx
+        )
+        rule = self._decoder.rule(pos)
+      except DECODE_ERRORS as e:
+        raise ParseError(
+            "%s is corrupt: can't decode rule %s." % (self._decoder.path, idx)
+        ) from e
+      self._rules[idx] = rule
+    return rule
+
+  def __eq__(self, other: object) -> bool:
+    return isinstance(other, Sequence) and list(self) == list(other)
+
+  @property
+  def num_decoded(self) -> int:
+    return sum(rule is not None for rule in self._rules)
+
+
+class BinaryTCAM(Sequence[BinaryTable]):
+  """A TCAM read from a memory-mapped binary IR file.
+
+  Can be used anywhere a d.TCAM is expected.
+  """
+
+  def __init__(self, path: str):
+    self._file = open(path, "rb")
+    try:
+      self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError as e:  # Raised when mapping an empty file
+      self._file.close()
+      raise ParseError("Binary IR file %s is empty." % path) from e
+    if len(self._buf) < header_struct.size:
+      self.close()
+      raise ParseError("%s is not a binary IR file." % path)
+    magic, version, _, num_keys, num_tables, strings_pos, index_pos = (
+        header_struct.unpack_from(self._buf, 0)
+    )
+    if magic != MAGIC:
+      self.close()
+      raise ParseError("%s is not a binary IR file." % path)
+    if version != VERSION:
+      self.close()
+      raise ParseError(
+          "%s has binary IR version %s, but only version %s is supported."
+          % (path, version, VERSION)
+      )
+
+    try:
+      shape = [
+          u32.unpack_from(self._buf, header_struct.size + 4 * i)[0]
+          for i in range(num_keys)
+      ]
+      (num_strings,) = u32.unpack_from(self._buf, strings_pos)
+      pos = strings_pos + 4
+      strings = []
+      for _ in range(num_strings):
+        (length,) = u32.unpack_from(self._buf, pos)
+        strings.append(self._buf[pos + 4 : pos + 4 + length].decode("utf-8"))
+        pos += 4 + length
+      decoder = Decoder(path, self._buf, shape, strings)
+
+      self.shape = shape
+      self._tables = []
+      for _ in range(num_tables):
+        table = BinaryTable(decoder, index_pos)
+        self._tables.append(table)
+        index_pos += 4 + 8 * len(table)
+    except DECODE_ERRORS as e:
+      self.close()
+      raise ParseError("%s is truncated or corrupt." % path) from e
+
+  def __len__(self) -> int:
+    return len(self._tables)
+
+  def __getitem__(self, idx):
+    return self._tables[idx]
+
+  def close(self) -> None:
+    self._buf.close()
+    self._file.close()
+
+  def __enter__(self) -> "BinaryTCAM":
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.close()
+
+
+def is_binary_ir(path: str) -> bool:
+  """Return true iff the file starts with the binary IR magic number."""
+  with open(path, "rb") as f:
+    return f.read(len(MAGIC)) == MAGIC
+
+
+def read_binary(path: str) -> BinaryTCAM:
+  return BinaryTCAM(path)
@@ -0,0 +1,121 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the binary IR format."""
+
+import os
+import tempfile
+import unittest
+from interpreter import binary_ir
+from interpreter import config_parser
+from interpreter import interp
+from interpreter import ir_parser
+import interpreter.datatypes as d
+
+
+def prefix_filename(filename: str) -> str:
+  return os.path.join("interpreter/test_files/", filename)
+
+
+class BinaryIrTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    fd, self.path = tempfile.mkstemp(suffix=".bin")
+    os.close(fd)
+    self.addCleanup(os.remove, self.path)
+
+  def test_round_trip(self):
+    for filename in ["simple_ip_parser.json", "small_ir.json"]:
+      json_path = prefix_filename(filename)
+      binary_ir.convert(json_path, self.path)
+      self.assertTrue(binary_ir.is_binary_ir(self.path))
+      self.assertFalse(binary_ir.is_binary_ir(json_path))
+      with binary_ir.read_binary(self.path) as tcam:
+        self.assertEqual(list(tcam), ir_parser.parse_ir(json_path, True))
+
+  def test_expressions(self):
+    # Exercise every kind of expression, including wide constants
+    actions = [
+        {"type": "MoveCursor", "numbits": "(w8) (packet[0:3] << 2) - 1w8"},
+        {"type": "CopyData", "src": "5w100", "dst": "meta[r1[0:3]:99]"},
+        {"type": "ExtractHeader", "id": "hdr.x", "loc": "packet[0:r1[4:7]]"},
+    ]
+    rule = (
+        [ir_parser.parse_pattern("0b1*0")],
+        {ir_parser.parse_action(a) for a in actions},
+    )
+    tcam = [[rule]]
+    binary_ir.write_binary(tcam, self.path)
+    with binary_ir.read_binary(self.path) as decoded:
+      self.assertEqual(list(decoded), tcam)
+
+  def test_lazy_decoding(self):
+    binary_ir.convert(prefix_filename("simple_ip_parser.json"), self.path)
+    config = prefix_filename("simple_ip_config.json")
+    packet = d.Data("0x123456654321abcdeffedcba86dd" + "00" * 40)
+    expected = config_parser.parse(config, True)
+    interp.interp_tcam(
+        ir_parser.parse_ir(prefix_filename("simple_ip_parser.json"), True),
+        expected,
+        packet,
+    )
+
+    with binary_ir.read_binary(self.path) as tcam:
+      self.assertEqual([t.num_decoded for t in tcam], [0, 0, 0])
+      state = config_parser.parse(config, True)
+      interp.interp_tcam(tcam, state, packet)
+      self.assertEqual(state, expected)
+      # Rules after the first match in each table are never decoded
+      self.assertEqual([t.num_decoded for t in tcam], [1, 2, 3])
+
+  def test_bad_files(self):
+    with open(self.path, "wb") as f:
+      f.write(b"[[]]" * 20)
+    self.assertRaises(ir_parser.ParseError, binary_ir.read_binary, self.path)
+
+    binary_ir.convert(prefix_filename("small_ir.json"), self.path)
+    with open(self.path, "r+b") as f:
+      f.seek(8)
+      f.write(b"\x63")
+    self.assertRaises(ir_parser.ParseError, binary_ir.read_binary, self.path)
+
+    # Truncated: the string table and table index are missing
+    binary_ir.convert(prefix_filename("small_ir.json"), self.path)
+    with open(self.path, "r+b") as f:
+      f.truncate(os.path.getsize(self.path) - 20)
+    with self.assertRaisesRegex(ir_parser.ParseError, "truncated or corrupt"):
+      binary_ir.read_binary(self.path)
+
+    # Corrupt rules are only detected when they are decoded
+    binary_ir.convert(prefix_filename("small_ir.json"), self.path)
+    with binary_ir.read_binary(self.path) as tcam:
+      rules_pos = binary_ir.header_struct.size + 4 * len(tcam.shape)
+    with open(self.path, "r+b") as f:
+      f.seek(rules_pos)
+      f.write(b"\xff" * 16)
+    with binary_ir.read_binary(self.path) as tcam:
+      with self.assertRaisesRegex(ir_parser.ParseError, "decode rule 0"):
+        tcam[0][0]
+
+    # Rules must all have the same shape
+    tcam = ir_parser.parse_ir(prefix_filename("small_ir.json"), True)
+    tcam[0][1][0].pop()
+    self.assertRaises(
+        ir_parser.ParseError, binary_ir.write_binary, tcam, self.path
+    )
+
+
+if __name__ == "__main__":
+  unittest.main()
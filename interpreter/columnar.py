@@ -0,0 +1,203 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Columnar results for batches of packets, as NumPy structured arrays.
+
+Rather than keeping a MachineState per packet, a ResultSink writes the outcome
+of each packet into one row of a preallocated structured array, backed by a
+.npy file that is memory-mapped (so it can be larger than memory, and loaded
+with numpy.load). The fields of each row are:
+
+  error:   1 if the interpreter raised an error for the packet, else 0
+  cursor:  the final cursor (for errors, the cursor when the error was raised)
+  stage:   the final stage (for errors, the stage that raised it)
+  store.<name>:  the final value of each persistent store, as an unsigned int
+                 of the smallest size that holds it. Stores wider than 64 bits
+                 are held as an array of big-endian uint8 bytes instead.
+  header.<name>.offset, header.<name>.length:  where each header lies in the
+                 packet, in bits. Both are -1 if the header wasn't extracted.
+
+This module requires numpy.
+"""
+
+from collections.abc import Iterable, Sequence
+
+import numpy
+
+from interpreter import interp
+import interpreter.datatypes as d
+
+
+def header_names(tcam: d.TCAM) -> list[str]:
+  """The names of the headers the first table of a program extracts.
+
+  Only the first table is read, so that a lazily loaded program (see
+  ir_parser.LazyTCAM and binary_ir.BinaryTCAM) isn't materialized just to
+  find its headers. Headers extracted by later tables must be listed by the
+  caller to get a column.
+  """
+  names = {}
+  if len(tcam):
+    for _, actions in tcam[0]:
+      for action in actions:
+        if action.action_type == d.ActionType.EXTRACTHEADER:
+          names.setdefault(action.action_args[0], None)
+  return list(names)
+
+
+def store_dtype(width: int) -> numpy.dtype:
+  for dtype in (numpy.uint8, numpy.uint16, numpy.uint32, numpy.uint64):
+    if width <= 8 * numpy.dtype(dtype).itemsize:
+      return numpy.dtype(dtype)
+  # Not a bytes ("S") field: numpy strips trailing NUL bytes from those
+  return numpy.dtype((numpy.uint8, (width + 7) // 8))
+
+
+def result_dtype(state: d.MachineState, headers: Sequence[str]) -> numpy.dtype:
+  """The dtype of a row of results for a configuration."""
+  fields = [
+      ("error", numpy.uint8),
+      ("cursor", numpy.uint32),
+      ("stage", numpy.uint32),
+  ]
+  for name, store in state.stores.items():
+    if store.persistent:
+      fields.append(("store.%s" % name, store_dtype(store.width)))
+  for name in headers:
+    fields.append(("header.%s.offset" % name, numpy.int64))
+    fields.append(("header.%s.length" % name, numpy.int64))
+  return numpy.dtype(fields)
+
+
+class ResultSink:
+  """Writes the final state of each packet of a batch into a .npy file."""
+
+  def __init__(
+      self,
+      path: str,
+      num_packets: int,
+      state: d.MachineState,
+      headers: Sequence[str],
+      resume: bool = False,
+  ):
+    """Create (or overwrite) the results file, with room for num_packets rows.
+
+    Args:
+      path: the .npy file to write
+      num_packets: the number of rows
+      state: a state of the configuration, used to find the persistent stores
+      headers: the names of the headers to record, e.g. from header_names
+      resume: if True, open an existing results file (with the same rows and
+        fields) rather than creating a new one, keeping its rows.
+    """
+    self._stores = [
+        (name, store.width)
+        for name, store in state.stores.items()
+        if store.persistent
+    ]
+    self._headers = {name: i for i, name in enumerate(headers)}
+    dtype = result_dtype(state, headers)
+    if resume:
+      self.results = numpy.lib.format.open_memmap(path, mode="r+")
+      if self.results.dtype != dtype or self.results.shape != (num_packets,):
+        raise ValueError(
+            "%s does not hold results of the expected shape and fields." % path
+        )
+      return
+    self.results = numpy.lib.format.open_memmap(
+        path, mode="w+", dtype=dtype, shape=(num_packets,)
+    )
+    for name in headers:
+      self.results["header.%s.offset" % name] = -1
+      self.results["header.%s.length" % name] = -1
+
+  def write(self, idx: int, state: d.MachineState, error: bool = False) -> None:
+    """Record the final state of the idx-th packet."""
+    self.write_values(
+        idx,
+        error,
+        state.cursor,
+        state.stage,
+        {name: store.value for name, store in state.stores.items()},
+        state.headers.refs(),
+    )
+
+  def write_values(
+      self,
+      idx: int,
+      error: bool,
+      cursor: int,
+      stage: int,
+      stores: dict[str, int],
+      headers: dict[str, tuple[int, int]],
+  ) -> None:
+    """Record the idx-th packet, given the parts of its final state.
+
+    stores must hold the value of each persistent store, and headers the
+    (offset, length) of each extracted header. Headers without a column are
+    not recorded.
+    """
+    row = [int(error), cursor, stage]
+    for name, width in self._stores:
+      value = stores[name]
+      if width > 64:
+        value = numpy.frombuffer(
+            value.to_bytes((width + 7) // 8, "big"), numpy.uint8
+        )
+      row.append(value)
+    columns = [-1, -1] * len(self._headers)
+    for name, (offset, length) in headers.items():
+      i = self._headers.get(name)
+      if i is None:
+        continue
+      columns[2 * i] = offset
+      columns[2 * i + 1] = length
+    self.results[idx] = tuple(row + columns)
+
+  def flush(self) -> None:
+    self.results.flush()
+
+
+def load(path: str) -> numpy.ndarray:
+  """Memory-map a results file for reading."""
+  return numpy.load(path, mmap_mode="r")
+
+
+def interp_batch(
+    tcam: d.TCAM,
+    state: d.MachineState,
+    packets: Iterable[d.Data],
+    num_packets: int,
+    path: str,
+    matchers: Sequence[interp.Matcher] | None = None,
+    headers: Sequence[str] | None = None,
+) -> numpy.ndarray:
+  """Interpret each packet from the initial state, writing results to path.
+
+  headers names the headers to record, by default those of header_names.
+  Returns the results array, which has one row per packet.
+  """
+  if headers is None:
+    headers = header_names(tcam)
+  sink = ResultSink(path, num_packets, state, headers)
+  for idx, packet in enumerate(packets):
+    final = interp.copy_state(state)
+    try:
+      interp.interp_tcam(tcam, final, packet, matchers)
+    except RuntimeError:
+      sink.write(idx, final, error=True)
+    else:
+      sink.write(idx, final)
+  sink.flush()
+  return sink.results
@@ -0,0 +1,115 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for columnar batch results."""
+
+import os
+import tempfile
+import unittest
+from interpreter import columnar
+from interpreter import config_parser
+from interpreter import interp
+from interpreter import ir_parser
+import interpreter.datatypes as d
+
+IR_FILE = "interpreter/test_files/simple_ip_parser.json"
+CONFIG_FILE = "interpreter/test_files/simple_ip_config.json"
+
+IPV4_PACKET = (
+    "0x" + "ff" * 12 + "0800" + "45000000" * 3 + "7f000001" + "0a000001"
+)
+IPV6_PACKET = "0x" + "ff" * 12 + "86dd" + "00" * 40
+PACKETS = [IPV4_PACKET, IPV6_PACKET, "0x" + "ff" * 12 + "0800"]
+HEADERS = ["hdr.ethernet", "hdr.ipv4", "hdr.ipv6"]
+
+
+class ColumnarTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tcam = ir_parser.parse_ir(IR_FILE, True)
+    self.state = config_parser.parse(CONFIG_FILE, True)
+    fd, self.path = tempfile.mkstemp(suffix=".npy")
+    os.close(fd)
+    self.addCleanup(os.remove, self.path)
+
+  def test_header_names(self):
+    # Only the first table is read
+    self.assertEqual(columnar.header_names(self.tcam), ["hdr.ethernet"])
+
+  def test_header_names_lazy(self):
+    with ir_parser.LazyTCAM(IR_FILE) as tcam:
+      self.assertEqual(columnar.header_names(tcam), ["hdr.ethernet"])
+      self.assertEqual(tcam.num_materialized, 1)
+
+  def test_store_dtype(self):
+    self.assertEqual(columnar.store_dtype(1).itemsize, 1)
+    self.assertEqual(columnar.store_dtype(32).itemsize, 4)
+    self.assertEqual(columnar.store_dtype(33).itemsize, 8)
+    self.assertEqual(columnar.store_dtype(65).shape, (9,))
+
+  def test_interp_batch(self):
+    packets = [d.Data(p) for p in PACKETS]
+    results = columnar.interp_batch(
+        self.tcam, self.state, packets, len(packets), self.path, headers=HEADERS
+    )
+    loaded = columnar.load(self.path)
+    self.assertEqual(loaded.dtype, results.dtype)
+    self.assertEqual(len(loaded), len(PACKETS))
+    for packet, row in zip(packets, loaded):
+      state = interp.copy_state(self.state)
+      try:
+        interp.interp_tcam(self.tcam, state, packet)
+      except RuntimeError:
+        self.assertEqual(row["error"], 1)
+        continue
+      self.assertEqual(row["error"], 0)
+      self.assertEqual(row["cursor"], state.cursor)
+      self.assertEqual(row["stage"], state.stage)
+      self.assertEqual(row["store.state"], state.stores["state"].value)
+      for name in HEADERS:
+        offset, length = state.headers.refs().get(name, (-1, -1))
+        self.assertEqual(row["header.%s.offset" % name], offset)
+        self.assertEqual(row["header.%s.length" % name], length)
+    # The truncated IPv4 packet can't be parsed
+    self.assertEqual(list(loaded["error"]), [0, 0, 1])
+    self.assertEqual(list(loaded["header.hdr.ipv4.length"]), [160, -1, -1])
+    # Only persistent stores get a column
+    self.assertNotIn("store.r1", loaded.dtype.names)
+
+  def test_wide_store(self):
+    self.state.stores["wide"] = d.DataStore(
+        value=0,
+        width=72,
+        read=True,
+        write=True,
+        persistent=True,
+        masked_writes=False,
+    )
+    sink = columnar.ResultSink(self.path, 1, self.state, [])
+    state = interp.copy_state(self.state)
+    state.stores["wide"].value = 0x010203040506070800
+    sink.write(0, state)
+    self.assertEqual(
+        bytes(sink.results[0]["store.wide"]),
+        bytes.fromhex("010203040506070800"),
+    )
+    # A header that wasn't listed has no column, and isn't recorded
+    state.headers.record("eth", d.Data("0xff"), 0, 8)
+    sink.write(0, state)
+    self.assertNotIn("header.eth.offset", sink.results.dtype.names)
+
+
+if __name__ == "__main__":
+  unittest.main()
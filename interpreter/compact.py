@@ -0,0 +1,192 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A struct-of-arrays representation of a TCAM, for programs with many rules.
+
+A parsed d.TCAM holds two Data objects per pattern and a set of Action objects
+per rule, which adds up to hundreds of bytes of Python objects per rule. A
+CompactTCAM instead holds, for each table:
+
+  values, masks:  the patterns of every rule, concatenated into a single int
+                  per rule (first key in the most significant bits) and split
+                  into 64-bit words, in two flat arrays
+  action_ids:     the index of each rule's action set in the action pool
+
+Real programs reuse a small number of action sets across many rules, so the
+action sets are deduplicated into a pool shared by every table of the TCAM.
+
+CompactTCAMs can be used anywhere a d.TCAM is read: each rule is rebuilt from
+the arrays when it is accessed, with its actions as a frozenset from the pool.
+Rebuilding rules is slow, so each table also implements interp.Matcher by
+scanning its arrays directly; pass the TCAM as its own matchers, e.g.
+  interp.interp_tcam(tcam, state, packet, matchers=tcam)
+"""
+
+import array
+from collections.abc import Sequence
+
+from interpreter import control_plane
+from interpreter import matchers
+import interpreter.datatypes as d
+
+WORD_BITS = 64
+WORD_MASK = (1 << WORD_BITS) - 1
+
+
+def split_words(value: int, num_words: int) -> list[int]:
+  """Split an int into num_words 64-bit words, most significant first."""
+  return [
+      (value >> (WORD_BITS * i)) & WORD_MASK
+      for i in reversed(range(num_words))
+  ]
+
+
+class ActionPool:
+  """A deduplicated collection of action sets, referred to by index."""
+
+  def __init__(self):
+    self.action_sets: list[frozenset[d.Action]] = []
+    self._ids: dict[frozenset[d.Action], int] = {}
+
+  def add(self, actions: set[d.Action]) -> int:
+    actions = frozenset(actions)
+    idx = self._ids.get(actions)
+    if idx is None:
+      idx = len(self.action_sets)
+      self._ids[actions] = idx
+      self.action_sets.append(actions)
+    return idx
+
+  def __len__(self) -> int:
+    return len(self.action_sets)
+
+
+class CompactTable(Sequence[d.Rule]):
+  """A table of a CompactTCAM. Implements interp.Matcher."""
+
+  def __init__(self, table: d.Table, shape: list[int], pool: ActionPool):
+    self.shape = shape
+    self._pool = pool
+    self._num_words = max(1, -(-sum(shape) // WORD_BITS))
+    self.values = array.array("Q")
+    self.masks = array.array("Q")
+    self.action_ids = array.array("I")
+    for rule in table:
+      patterns, actions = rule
+      if control_plane.rule_shape(rule) != shape:
+        raise ValueError(
+            "All patterns must have the same 'shape'. The following pattern"
+            " has a different shape from the first pattern in the table: "
+            + str(patterns)
+        )
+      # Values are kept whole (including bits outside the mask), so that the
+      # rule can be rebuilt exactly.
+      value = matchers.pack_keys([p.value.uint for p in patterns], shape)
+      mask = matchers.pack_keys([p.mask.uint for p in patterns], shape)
+      self.values.extend(split_words(value, self._num_words))
+      self.masks.extend(split_words(mask, self._num_words))
+      self.action_ids.append(pool.add(actions))
+
+  def __len__(self) -> int:
+    return len(self.action_ids)
+
+  def _word_int(self, words: array.array, idx: int) -> int:
+    start = idx * self._num_words
+    value = 0
+    for word in words[start : start + self._num_words]:
+      value = (value << WORD_BITS) | word
+    return value
+
+  def __getitem__(self, idx):
+    if isinstance(idx, slice):
+      return [self[i] for i in range(*idx.indices(len(self)))]
+    if idx < 0:
+      idx += len(self)
+    if not 0 <= idx < len(self):
+      raise IndexError("Rule index %s out of range." % idx)
+    value = self._word_int(self.values, idx)
+    mask = self._word_int(self.masks, idx)
+    patterns = []
+    for width in reversed(self.shape):
+      low = (1 << width) - 1
+      patterns.append(
+          d.Pattern(
+              d.Data(uint=value & low, length=width),
+              d.Data(uint=mask & low, length=width),
+          )
+      )
+      value >>= width
+      mask >>= width
+    patterns.reverse()
+    return (patterns, self._pool.action_sets[self.action_ids[idx]])
+
+  def __eq__(self, other: object) -> bool:
+    return isinstance(other, Sequence) and list(self) == list(other)
+
+  def lookup(self, keys: list[int]) -> int | None:
+    """Return the index of the first rule matching the keys (if any)."""
+    key = matchers.pack_keys(keys, self.shape)
+    values = self.values
+    masks = self.masks
+    if self._num_words == 1:
+      for i, value in enumerate(values):
+        if not (key ^ value) & masks[i]:
+          return i
+      return None
+    key_words = split_words(key, self._num_words)
+    for i in range(len(self)):
+      start = i * self._num_words
+      for j, key_word in enumerate(key_words):
+        if (key_word ^ values[start + j]) & masks[start + j]:
+          break
+      else:
+        return i
+    return None
+
+  @property
+  def nbytes(self) -> int:
+    """The size of the table's arrays, in bytes."""
+    return sum(
+        a.itemsize * len(a) for a in (self.values, self.masks, self.action_ids)
+    )
+
+
+class CompactTCAM(Sequence[CompactTable]):
+  """A TCAM stored as arrays. Can be used anywhere a d.TCAM is expected."""
+
+  def __init__(self, tcam: d.TCAM):
+    self.shape = next(
+        (control_plane.rule_shape(table[0]) for table in tcam if table), []
+    )
+    self.pool = ActionPool()
+    self._tables = [CompactTable(t, self.shape, self.pool) for t in tcam]
+
+  def __len__(self) -> int:
+    return len(self._tables)
+
+  def __getitem__(self, idx):
+    return self._tables[idx]
+
+  def __eq__(self, other: object) -> bool:
+    return isinstance(other, Sequence) and list(self) == list(other)
+
+  @property
+  def nbytes(self) -> int:
+    """The size of the rule arrays, in bytes (excluding the action pool)."""
+    return sum(t.nbytes for t in self._tables)
+
+
+def compact(tcam: d.TCAM) -> CompactTCAM:
+  """Convert a TCAM (e.g. a parsed, lazy or binary one) to arrays."""
+  return CompactTCAM(tcam)
@@ -0,0 +1,97 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for struct-of-arrays TCAMs."""
+
+import random
+import unittest
+from interpreter import compact
+from interpreter import config_parser
+from interpreter import interp
+from interpreter import ir_parser
+from interpreter import test_util
+import interpreter.datatypes as d
+
+IR_FILE = "interpreter/test_files/simple_ip_parser.json"
+CONFIG_FILE = "interpreter/test_files/simple_ip_config.json"
+
+IPV4_PACKET = (
+    "0x" + "ff" * 12 + "0800" + "45000000" * 3 + "7f000001" + "0a000001"
+)
+IPV6_PACKET = "0x" + "ff" * 12 + "86dd" + "00" * 40
+
+
+class CompactTest(unittest.TestCase):
+
+  def test_round_trip(self):
+    tcam = ir_parser.parse_ir(IR_FILE, True)
+    packed = compact.compact(tcam)
+    self.assertEqual(len(packed), len(tcam))
+    self.assertEqual(packed, tcam)
+    self.assertEqual(packed[1][-1], tcam[1][-1])
+    self.assertEqual(packed[0][0:1], tcam[0][0:1])
+    self.assertRaises(IndexError, packed[0].__getitem__, len(tcam[0]))
+
+  def test_interp(self):
+    tcam = ir_parser.parse_ir(IR_FILE, True)
+    packed = compact.compact(tcam)
+    initial = config_parser.parse(CONFIG_FILE, True)
+    for packet in (IPV4_PACKET, IPV6_PACKET):
+      expected = interp.copy_state(initial)
+      interp.interp_tcam(tcam, expected, d.Data(packet))
+      state = interp.copy_state(initial)
+      interp.interp_tcam(packed, state, d.Data(packet), packed)
+      self.assertEqual(state, expected)
+
+  def test_action_pool(self):
+    actions = {
+        ir_parser.parse_action({"type": "MoveCursor", "numbits": "8"})
+    }
+    pattern = ir_parser.parse_pattern("0x**")
+    tcam = [
+        [([pattern], set(actions)) for _ in range(100)],
+        [([pattern], set())],
+    ]
+    packed = compact.compact(tcam)
+    self.assertEqual(len(packed.pool), 2)
+    self.assertEqual(packed[0][99][1], actions)
+    # One 64-bit word each for the value and mask, and a 32-bit action index
+    self.assertEqual(packed.nbytes, 101 * 20)
+
+  def test_wide_keys(self):
+    # Keys wider than a word, which don't line up with the word boundaries
+    rng = random.Random(0)
+    shape = [40, 60, 3]
+    table = [
+        ([test_util.random_pattern(rng, width) for width in shape], set())
+        for _ in range(200)
+    ]
+    packed = compact.compact([table])
+    self.assertEqual(packed[0], table)
+    for _ in range(200):
+      keys = [rng.getrandbits(width) for width in shape]
+      self.assertEqual(
+          packed[0].lookup(keys), interp.scan_table(table, keys)
+      )
+
+  def test_shape_mismatch(self):
+    rules = [
+        ([ir_parser.parse_pattern("0x**")], set()),
+        ([ir_parser.parse_pattern("0x***")], set()),
+    ]
+    self.assertRaises(ValueError, compact.compact, [rules])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -15,6 +15,7 @@
 """Parser for configuration files, which generates the initial MachineState."""
 
 from collections.abc import Mapping, Sequence
+import dataclasses
 import json
 from typing import Type, TypeVar
 
@@ -42,6 +43,15 @@ def read_field(
   return val
 
 
+# Read an optional json field. If it exists, ensure it has the expected type.
+def read_optional_field(
+    error_prefix: str, obj: Mapping[str, object], name: str, ty: Type[T]
+) -> T | None:
+  if name not in obj:
+    return None
+  return read_field(error_prefix, obj, name, ty)
+
+
 def parse_data_store(store: object) -> tuple[str, d.DataStore]:
   """Parse a single data store entry."""
   if not isinstance(store, Mapping):
@@ -56,7 +66,8 @@ def parse_data_store(store: object) -> tuple[str, d.DataStore]:
   persistent = read_field(error_prefix, store, "persistent", bool)
   masked_writes = read_field(error_prefix, store, "masked-writes", bool)
   store = d.DataStore(
-      value=d.Data(length=width),  # Defaults to all bits 0
+      value=0,  # Defaults to all bits 0
+      width=width,
       read=read,
       write=write,
       persistent=persistent,
@@ -138,6 +149,36 @@ def parse_config(jsn: object) -> d.MachineState:
   return state
 
 
+def parse_hardware_config(jsn: object) -> d.HardwareConfig:
+  """Extract the hardware limits, which are all optional."""
+  if not isinstance(jsn, Mapping):
+    raise ParseError(
+        "Configuration files should have a dictionary object at top level."
+    )
+  error_prefix = "Error parsing hardware limits: "
+  limits = {}
+  for field in dataclasses.fields(d.HardwareConfig):
+    name = field.name.replace("_", "-")
+    value = read_optional_field(error_prefix, jsn, name, int)
+    # bool is a subclass of int, but "true" is never a sensible limit
+    if isinstance(value, bool) or (value is not None and value < 0):
+      raise ParseError(
+          error_prefix
+          + "Expected %s field to be a non-negative integer." % name
+      )
+    limits[field.name] = value
+  return d.HardwareConfig(**limits)
+
+
+def parse_hardware(jsn: str, from_file: bool) -> d.HardwareConfig:
+  if from_file:
+    with open(jsn) as f:
+      content = json.load(f)
+  else:
+    content = json.loads(jsn)
+  return parse_hardware_config(content)
+
+
 def parse(jsn: str, from_file: bool) -> d.MachineState:
   if from_file:
     with open(jsn) as f:
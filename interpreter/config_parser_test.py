@@ -36,7 +36,8 @@ class ConfigParserTest(unittest.TestCase):
         (
             "r1",
             d.DataStore(
-                value=d.Data("0x000000"),
+                value=0,
+                width=24,
                 read=True,
                 write=True,
                 persistent=False,
@@ -196,6 +197,37 @@ class ConfigParserTest(unittest.TestCase):
         {"keys": ["packet[44:r1[16:31]]"]},
     )
 
+  def test_hardware(self):
+    self.assertEqual(
+        config_parser.parse_hardware(
+            "interpreter/test_files/sample_config.json", True
+        ),
+        d.HardwareConfig(
+            max_stages=32,
+            max_rules_per_stage=16,
+            copy_range=127,
+            extract_range=127,
+            move_increment=8,
+            max_simultaneous_extracts=2,
+            max_simultaneous_copies=4,
+            max_simultaneous_actions=4,
+        ),
+    )
+
+    # All fields are optional
+    self.assertEqual(
+        config_parser.parse_hardware_config({"max-stages": 3}),
+        d.HardwareConfig(max_stages=3),
+    )
+
+    # But they must be non-negative integers
+    for bad_value in ["3", -1, True, 2.5]:
+      self.assertRaises(
+          config_parser.ParseError,
+          config_parser.parse_hardware_config,
+          {"max-stages": bad_value},
+      )
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,174 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A mutable TCAM, for simulating control-plane updates at runtime.
+
+A RuntimeTCAM can be used anywhere the interpreter expects a d.TCAM. Its tables
+support inserting, deleting and modifying individual rules, similar to a
+P4Runtime-style control plane. Anything built on top of a table (lookup indexes,
+compiled forms of its rules, caches) can register itself as a listener, and is
+told about each change so it can update itself incrementally instead of being
+rebuilt from scratch.
+
+Rule priority is position in the table: the rule at index 0 has the highest
+priority, and inserting a rule at index i shifts the rules at i and later down
+by one.
+"""
+
+from collections.abc import Iterable, Sequence
+from typing import Protocol
+
+import interpreter.datatypes as d
+
+
+class TableListener(Protocol):
+  """Interface for objects that need to track changes to a RuntimeTable.
+
+  Each method is called after the table has been updated.
+  """
+
+  def rule_inserted(self, index: int, rule: d.Rule) -> None:
+    ...
+
+  def rule_deleted(self, index: int, rule: d.Rule) -> None:
+    ...
+
+  def rule_modified(self, index: int, old: d.Rule, new: d.Rule) -> None:
+    ...
+
+
+def rule_shape(rule: d.Rule) -> list[int]:
+  return [p.value.length for p in rule[0]]
+
+
+class RuntimeTable(Sequence[d.Rule]):
+  """A single TCAM table that supports updates."""
+
+  def __init__(self, rules: Iterable[d.Rule], shape: list[int] | None = None):
+    self._rules = list(rules)
+    self._listeners: list[TableListener] = []
+    if shape is None and self._rules:
+      shape = rule_shape(self._rules[0])
+    self.shape = shape
+    for rule in self._rules:
+      self._check_shape(rule)
+
+  def __len__(self) -> int:
+    return len(self._rules)
+
+  def __getitem__(self, idx):
+    return self._rules[idx]
+
+  def __iter__(self):
+    return iter(self._rules)
+
+  def __eq__(self, other: object) -> bool:
+    if isinstance(other, RuntimeTable):
+      return self._rules == other._rules
+    return self._rules == other
+
+  def add_listener(self, listener: TableListener) -> None:
+    self._listeners.append(listener)
+
+  def remove_listener(self, listener: TableListener) -> None:
+    self._listeners.remove(listener)
+
+  def _check_shape(self, rule: d.Rule) -> None:
+    if self.shape is None:
+      self.shape = rule_shape(rule)
+    if rule_shape(rule) != self.shape:
+      raise RuntimeError(
+          "Rule %s has pattern widths %s, but this table's rules have widths"
+          " %s." % (rule[0], rule_shape(rule), self.shape)
+      )
+
+  def _check_index(self, index: int, allow_end: bool = False) -> None:
+    limit = len(self._rules) + 1 if allow_end else len(self._rules)
+    if not 0 <= index < limit:
+      raise RuntimeError(
+          "Rule index %s is out of range for a table with %s rules."
+          % (index, len(self._rules))
+      )
+
+  def insert(
+      self,
+      index: int,
+      patterns: list[d.Pattern],
+      actions: Iterable[d.Action],
+  ) -> d.Rule:
+    """Insert a rule so that it has the given priority (index)."""
+    self._check_index(index, allow_end=True)
+    rule = (list(patterns), set(actions))
+    self._check_shape(rule)
+    self._rules.insert(index, rule)
+    for listener in self._listeners:
+      listener.rule_inserted(index, rule)
+    return rule
+
+  def append(
+      self, patterns: list[d.Pattern], actions: Iterable[d.Action]
+  ) -> d.Rule:
+    """Insert a rule with lower priority than every existing rule."""
+    return self.insert(len(self._rules), patterns, actions)
+
+  def delete(self, index: int) -> d.Rule:
+    """Delete the rule at the given index, and return it."""
+    self._check_index(index)
+    rule = self._rules.pop(index)
+    for listener in self._listeners:
+      listener.rule_deleted(index, rule)
+    return rule
+
+  def modify_actions(self, index: int, actions: Iterable[d.Action]) -> d.Rule:
+    """Replace the action set of the rule at the given index."""
+    self._check_index(index)
+    old = self._rules[index]
+    new = (old[0], set(actions))
+    self._rules[index] = new
+    for listener in self._listeners:
+      listener.rule_modified(index, old, new)
+    return new
+
+  def find(self, patterns: list[d.Pattern]) -> int | None:
+    """Return the index of the first rule with exactly these patterns."""
+    for i, rule in enumerate(self._rules):
+      if rule[0] == patterns:
+        return i
+    return None
+
+  def to_table(self) -> d.Table:
+    """Return a snapshot of the table's rules as a plain d.Table."""
+    return [(list(patterns), set(actions)) for patterns, actions in self]
+
+
+class RuntimeTCAM(Sequence[RuntimeTable]):
+  """A TCAM made up of RuntimeTables."""
+
+  def __init__(self, tcam: d.TCAM):
+    shape = None
+    for table in tcam:
+      if table:
+        shape = rule_shape(table[0])
+        break
+    self._tables = [RuntimeTable(table, shape) for table in tcam]
+
+  def __len__(self) -> int:
+    return len(self._tables)
+
+  def __getitem__(self, idx):
+    return self._tables[idx]
+
+  def to_tcam(self) -> d.TCAM:
+    """Return a snapshot of the program as a plain d.TCAM."""
+    return [table.to_table() for table in self._tables]
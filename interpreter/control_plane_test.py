@@ -0,0 +1,136 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for runtime updates to TCAM programs."""
+
+import unittest
+from interpreter import config_parser
+from interpreter import control_plane
+from interpreter import interp
+from interpreter import ir_parser
+import interpreter.datatypes as d
+
+IR_FILE = "interpreter/test_files/simple_ip_parser.json"
+CONFIG_FILE = "interpreter/test_files/simple_ip_config.json"
+
+# Ethernet + IPv4 header with source address 127.0.0.1
+PACKET = d.Data(
+    "0x123456654321abcdeffedcba0800"
+    + "05112233445566778899aabb7f000001ccddeeff"
+)
+
+
+def state_after(tcam: d.TCAM) -> d.MachineState:
+  state = config_parser.parse(CONFIG_FILE, True)
+  interp.interp_tcam(tcam, state, PACKET)
+  return state
+
+
+def set_state(value: int) -> set[d.Action]:
+  action = {"type": "CopyData", "src": "%sw32" % value, "dst": "state[0:31]"}
+  return {ir_parser.parse_action(action)}
+
+
+class RecordingListener:
+
+  def __init__(self):
+    self.events = []
+
+  def rule_inserted(self, index, rule):
+    self.events.append(("insert", index, rule))
+
+  def rule_deleted(self, index, rule):
+    self.events.append(("delete", index, rule))
+
+  def rule_modified(self, index, old, new):
+    self.events.append(("modify", index, old, new))
+
+
+class ControlPlaneTest(unittest.TestCase):
+
+  def test_updates(self):
+    tcam = control_plane.RuntimeTCAM(ir_parser.parse_ir(IR_FILE, True))
+    self.assertEqual(tcam.to_tcam(), ir_parser.parse_ir(IR_FILE, True))
+    # 127.0.0.* is rejected by the second rule of the last table
+    self.assertEqual(
+        state_after(tcam).stores["state"].data(), d.Data("0x00000064")
+    )
+
+    listener = RecordingListener()
+    table = tcam[2]
+    table.add_listener(listener)
+
+    # Add a higher-priority rule accepting 127.0.0.1 specifically
+    patterns = [
+        ir_parser.parse_pattern("0x00000002"),
+        ir_parser.parse_pattern("0x7f000001"),
+    ]
+    rule = table.insert(0, patterns, set_state(77))
+    self.assertEqual(table.find(patterns), 0)
+    self.assertEqual(
+        state_after(tcam).stores["state"].data(), d.Data(uint=77, length=32)
+    )
+
+    table.modify_actions(0, set_state(78))
+    self.assertEqual(
+        state_after(tcam).stores["state"].data(), d.Data(uint=78, length=32)
+    )
+
+    deleted = table.delete(0)
+    self.assertIsNone(table.find(patterns))
+    self.assertEqual(
+        state_after(tcam).stores["state"].data(), d.Data("0x00000064")
+    )
+
+    self.assertEqual(
+        listener.events,
+        [
+            ("insert", 0, rule),
+            ("modify", 0, rule, (patterns, set_state(78))),
+            ("delete", 0, deleted),
+        ],
+    )
+
+  def test_updates_after_planning(self):
+    tcam = control_plane.RuntimeTCAM(ir_parser.parse_ir(IR_FILE, True))
+    interp.plan_rules(tcam)
+    state_after(tcam)
+    # The rule reads past the end of the packet. Its bounds must be checked,
+    # rather than those of the rule it displaces.
+    patterns = [
+        ir_parser.parse_pattern("0x00000002"),
+        ir_parser.parse_pattern("0x7f000001"),
+    ]
+    read = {"type": "CopyData", "src": "packet[400:431]", "dst": "r1[0:31]"}
+    tcam[2].insert(0, patterns, {ir_parser.parse_action(read)})
+    self.assertRaisesRegex(
+        RuntimeError, "goes beyond end of packet", state_after, tcam
+    )
+    tcam[2].delete(0)
+    self.assertEqual(
+        state_after(tcam).stores["state"].data(), d.Data("0x00000064")
+    )
+
+  def test_bad_updates(self):
+    tcam = control_plane.RuntimeTCAM(ir_parser.parse_ir(IR_FILE, True))
+    table = tcam[1]
+    narrow = [ir_parser.parse_pattern("0x00"), ir_parser.parse_pattern("0x00")]
+    self.assertRaises(RuntimeError, table.insert, 0, narrow, set())
+    self.assertRaises(RuntimeError, table.delete, len(table))
+    self.assertRaises(RuntimeError, table.modify_actions, -1, set())
+    self.assertRaises(RuntimeError, table.insert, len(table) + 1, [], set())
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,233 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An indexed on-disk container for packet corpora.
+
+A corpus file holds a sequence of packets, and is designed to be replayed many
+times: reading it only memory-maps the file, and each packet is handed out as a
+zero-copy view into the mapping. All integers are little-endian. The layout is:
+
+  header:  magic, version, number of packets, offset of the index
+  records: for each packet, its length in bits as a u32, followed by its bits
+           padded to a whole number of bytes
+  index:   the u64 offset of each record
+
+Packets don't need to be a whole number of bytes long, so that corpora can hold
+any packet the interpreter accepts (e.g. the "0b..." strings used in tests).
+"""
+
+from collections.abc import Iterable, Iterator
+import mmap
+import struct
+
+import interpreter.datatypes as d
+import interpreter.expression_parser as eparser
+
+ParseError = eparser.ParseError
+
+MAGIC = b"CAIRNPKT"
+VERSION = 1
+
+header_struct = struct.Struct("<8sHHQQ")
+length_struct = struct.Struct("<I")
+offset_struct = struct.Struct("<Q")
+
+
+class CorpusWriter:
+  """Writes packets to a new corpus file.
+
+  Must be closed (or used as a context manager) for the index to be written.
+  """
+
+  def __init__(self, path: str):
+    self._file = open(path, "wb")
+    self._file.write(b"\0" * header_struct.size)
+    self._offsets = []
+
+  def add(self, packet: d.Data | bytes, num_bits: int | None = None) -> None:
+    """Append a packet, given either as bits or as bytes.
+
+    Args:
+      packet: the packet's contents
+      num_bits: for packets given as bytes, the number of bits of the packet
+        that are used. Defaults to all of them.
+    """
+    if isinstance(packet, d.Data):
+      num_bits = packet.length
+      packet = packet.tobytes()
+    elif num_bits is None:
+      num_bits = 8 * len(packet)
+    if not 0 <= num_bits <= 8 * len(packet):
+      raise ValueError(
+          "Packet has %s bytes, which can't hold %s bits."
+          % (len(packet), num_bits)
+      )
+    self._offsets.append(self._file.tell())
+    self._file.write(length_struct.pack(num_bits))
+    self._file.write(packet[: (num_bits + 7) // 8])
+
+  def close(self) -> None:
+    if self._file.closed:
+      return
+    index_offset = self._file.tell()
+    for offset in self._offsets:
+      self._file.write(offset_struct.pack(offset))
+    self._file.seek(0)
+    self._file.write(
+        header_struct.pack(MAGIC, VERSION, 0, len(self._offsets), index_offset)
+    )
+    self._file.close()
+
+  def __enter__(self) -> "CorpusWriter":
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.close()
+
+
+def shard_range(num_packets: int, shard: int, num_shards: int) -> range:
+  """Split [0, num_packets) into num_shards contiguous, near-equal ranges."""
+  if not 0 <= shard < num_shards:
+    raise ValueError("Shard %s does not exist out of %s." % (shard, num_shards))
+  return range(
+      num_packets * shard // num_shards,
+      num_packets * (shard + 1) // num_shards,
+  )
+
+
+class Corpus:
+  """A memory-mapped corpus file, supporting random access to its packets."""
+
+  def __init__(self, path: str):
+    self._file = open(path, "rb")
+    try:
+      self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError as e:  # Raised when mapping an empty file
+      self._file.close()
+      raise ParseError("Corpus file %s is empty." % path) from e
+    if len(self._buf) < header_struct.size:
+      self.close()
+      raise ParseError("%s is not a corpus file." % path)
+    magic, version, _, self._num_packets, self._index_offset = (
+        header_struct.unpack_from(self._buf, 0)
+    )
+    if magic != MAGIC:
+      self.close()
+      raise ParseError("%s is not a corpus file." % path)
+    if version != VERSION:
+      self.close()
+      raise ParseError(
+          "%s has corpus version %s, but only version %s is supported."
+          % (path, version, VERSION)
+      )
+    self._view = memoryview(self._buf)
+
+  def __len__(self) -> int:
+    return self._num_packets
+
+  def _record_offset(self, idx: int) -> int:
+    if idx < 0:
+      idx += self._num_packets
+    if not 0 <= idx < self._num_packets:
+      raise IndexError("Packet index %s out of range." % idx)
+    return offset_struct.unpack_from(
+        self._buf, self._index_offset + offset_struct.size * idx
+    )[0]
+
+  def bit_length(self, idx: int) -> int:
+    """The length of a packet, in bits."""
+    return length_struct.unpack_from(self._buf, self._record_offset(idx))[0]
+
+  def __getitem__(self, idx: int) -> memoryview:
+    """Return the bytes of a packet, without copying them.
+
+    The returned view must be released before the corpus is closed.
+    """
+    offset = self._record_offset(idx)
+    (num_bits,) = length_struct.unpack_from(self._buf, offset)
+    start = offset + length_struct.size
+    return self._view[start : start + (num_bits + 7) // 8]
+
+  def packet(self, idx: int) -> d.Data:
+    """Return a packet in the form the interpreter expects."""
+    return d.Data(bytes=self[idx], length=self.bit_length(idx))
+
+  def packets(self, indices: Iterable[int] | None = None) -> Iterator[d.Data]:
+    """Iterate over the packets at the given indices (by default, all)."""
+    if indices is None:
+      indices = range(len(self))
+    for idx in indices:
+      yield self.packet(idx)
+
+  def shard(self, shard: int, num_shards: int) -> range:
+    """The indices of the packets in one of num_shards equal-sized shards."""
+    return shard_range(len(self), shard, num_shards)
+
+  def close(self) -> None:
+    if hasattr(self, "_view"):
+      self._view.release()
+    self._buf.close()
+    self._file.close()
+
+  def __enter__(self) -> "Corpus":
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.close()
+
+
+def from_hex(packets: Iterable[str], path: str) -> None:
+  """Write a corpus from "0x..." or "0b..." strings, as accepted by interp."""
+  with CorpusWriter(path) as writer:
+    for packet in packets:
+      writer.add(d.Data(packet))
+
+
+# Magic numbers of pcap files, mapped to the byte order of the file's headers.
+# The second pair indicate nanosecond-resolution timestamps, which we ignore.
+pcap_byte_orders = {
+    b"\xd4\xc3\xb2\xa1": "<",
+    b"\xa1\xb2\xc3\xd4": ">",
+    b"\x4d\x3c\xb2\xa1": "<",
+    b"\xa1\xb2\x3c\x4d": ">",
+}
+
+
+def read_pcap(path: str) -> Iterator[bytes]:
+  """Iterate over the captured bytes of each packet in a pcap file."""
+  with open(path, "rb") as f:
+    header = f.read(24)
+    if len(header) < 24 or header[:4] not in pcap_byte_orders:
+      raise ParseError(
+          "%s is not a pcap file (pcapng files are not supported)." % path
+      )
+    record_struct = struct.Struct(pcap_byte_orders[header[:4]] + "IIII")
+    while True:
+      record = f.read(record_struct.size)
+      if not record:
+        return
+      if len(record) < record_struct.size:
+        raise ParseError("%s ends with a truncated record header." % path)
+      _, _, captured_len, _ = record_struct.unpack(record)
+      data = f.read(captured_len)
+      if len(data) < captured_len:
+        raise ParseError("%s ends with a truncated packet." % path)
+      yield data
+
+
+def from_pcap(pcap_path: str, path: str) -> None:
+  """Write a corpus holding the captured bytes of each packet in a pcap file."""
+  with CorpusWriter(path) as writer:
+    for packet in read_pcap(pcap_path):
+      writer.add(packet)
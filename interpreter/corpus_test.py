@@ -0,0 +1,103 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for packet corpus files."""
+
+import os
+import struct
+import tempfile
+import unittest
+from interpreter import corpus
+import interpreter.datatypes as d
+
+HEX_PACKETS = ["0xff00aaaa", "0b101", "0x0123456789abcdef" + "0123" * 20]
+
+
+def write_pcap(path: str, packets: list[bytes], byte_order: str) -> None:
+  with open(path, "wb") as f:
+    magic = 0xA1B2C3D4
+    f.write(struct.pack(byte_order + "IHHiIII", magic, 2, 4, 0, 0, 1500, 1))
+    for i, packet in enumerate(packets):
+      f.write(struct.pack(byte_order + "IIII", i, 0, len(packet), 1500))
+      f.write(packet)
+
+
+class CorpusTest(unittest.TestCase):
+
+  def temp_path(self) -> str:
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    self.addCleanup(os.remove, path)
+    return path
+
+  def test_from_hex(self):
+    path = self.temp_path()
+    corpus.from_hex(HEX_PACKETS, path)
+    with corpus.Corpus(path) as packets:
+      self.assertEqual(len(packets), len(HEX_PACKETS))
+      self.assertEqual(
+          list(packets.packets()), [d.Data(p) for p in HEX_PACKETS]
+      )
+      # Random access, including from the end
+      self.assertEqual(packets.packet(-1), d.Data(HEX_PACKETS[-1]))
+      self.assertEqual(packets.bit_length(1), 3)
+      view = packets[0]
+      self.assertIsInstance(view, memoryview)
+      self.assertEqual(bytes(view), b"\xff\x00\xaa\xaa")
+      view.release()
+      self.assertRaises(IndexError, packets.packet, len(HEX_PACKETS))
+
+  def test_shards(self):
+    path = self.temp_path()
+    corpus.from_hex(["0x%02x" % i for i in range(10)], path)
+    with corpus.Corpus(path) as packets:
+      shards = [packets.shard(i, 3) for i in range(3)]
+      self.assertEqual([len(s) for s in shards], [3, 3, 4])
+      self.assertEqual([i for s in shards for i in s], list(range(10)))
+      self.assertEqual(
+          list(packets.packets(shards[1])),
+          [d.Data("0x03"), d.Data("0x04"), d.Data("0x05")],
+      )
+    self.assertRaises(ValueError, corpus.shard_range, 10, 3, 3)
+
+  def test_from_pcap(self):
+    raw = [b"\x01\x02\x03", b"", b"\xff" * 100]
+    for byte_order in ["<", ">"]:
+      pcap_path = self.temp_path()
+      path = self.temp_path()
+      write_pcap(pcap_path, raw, byte_order)
+      corpus.from_pcap(pcap_path, path)
+      with corpus.Corpus(path) as packets:
+        self.assertEqual(
+            list(packets.packets()), [d.Data(bytes=p) for p in raw]
+        )
+
+    # Truncated pcap file
+    with open(pcap_path, "r+b") as f:
+      f.truncate(os.path.getsize(pcap_path) - 1)
+    self.assertRaises(
+        corpus.ParseError, corpus.from_pcap, pcap_path, self.temp_path()
+    )
+
+  def test_bad_files(self):
+    path = self.temp_path()
+    self.assertRaises(corpus.ParseError, corpus.Corpus, path)
+    with open(path, "wb") as f:
+      f.write(b"0xff00aaaa\n" * 10)
+    self.assertRaises(corpus.ParseError, corpus.Corpus, path)
+    self.assertRaises(corpus.ParseError, corpus.from_pcap, path, path)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,345 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A model of the latency and throughput of a program on a hardware config.
+
+The model is deliberately simple, so that it can be used to compare hardware
+configurations rather than to predict exact numbers:
+
+- Every stage takes at least one cycle. A stage whose matched rule has more
+  actions than the hardware can execute at once (according to the
+  max-simultaneous-* limits) takes as many cycles as it needs to issue them all.
+- The latency of a packet is the total number of cycles of the stages it
+  passes through.
+- Stages are pipelined, so the throughput of a stream of packets is limited by
+  the slowest stage each packet passes through: a packet whose slowest stage
+  takes n cycles occupies the pipeline for n cycles.
+
+Limits missing from the config are treated as unbounded. Costs can be computed
+statically (the worst case over all rules) or by replaying a corpus of packets.
+"""
+
+from collections.abc import Iterable
+import dataclasses
+import math
+
+from interpreter import interp
+import interpreter.datatypes as d
+
+
+@dataclasses.dataclass(frozen=True)
+class RuleCost:
+  """The cost of executing a single rule."""
+
+  cycles: int
+  actions: int
+  extracts: int
+  copies: int
+
+
+def rule_cost(rule: d.Rule, hardware: d.HardwareConfig) -> RuleCost:
+  return actions_cost(rule[1], hardware)
+
+
+def actions_cost(
+    actions: set[d.Action], hardware: d.HardwareConfig
+) -> RuleCost:
+  extracts = sum(
+      a.action_type == d.ActionType.EXTRACTHEADER for a in actions
+  )
+  copies = sum(a.action_type == d.ActionType.COPYDATA for a in actions)
+  cycles = 1
+  for count, limit in [
+      (extracts, hardware.max_simultaneous_extracts),
+      (copies, hardware.max_simultaneous_copies),
+      (len(actions), hardware.max_simultaneous_actions),
+  ]:
+    if limit is not None and count > 0:
+      # A limit of 0 means the hardware can't execute the action at all; that
+      # is reported as a violation, and costs one cycle per action here.
+      cycles = max(cycles, math.ceil(count / max(limit, 1)))
+  return RuleCost(cycles, len(actions), extracts, copies)
+
+
+# The cost of a stage in which no rule matches
+NO_MATCH_COST = RuleCost(1, 0, 0, 0)
+
+
+@dataclasses.dataclass
+class StageReport:
+  """Static costs of a single stage."""
+
+  rules: int
+  tcam_bits: int  # rules * key width
+  cared_bits: int  # Bits of the tcam that aren't wildcards
+  max_cycles: int
+  max_actions: int
+
+
+@dataclasses.dataclass
+class StaticReport:
+  """Static costs of a whole program."""
+
+  stages: list[StageReport]
+  key_widths: list[int]
+  # For each key, the fraction of its pattern bits (across all rules) that
+  # aren't wildcards
+  key_utilization: list[float]
+  # Upper bounds on the latency of any packet, assuming it matches the most
+  # expensive rule in every stage.
+  worst_path_cycles: int
+  worst_path_actions: int
+  # Reasons the program doesn't fit the hardware config
+  violations: list[str]
+
+  @property
+  def tcam_bits(self) -> int:
+    return sum(s.tcam_bits for s in self.stages)
+
+  @property
+  def tcam_utilization(self) -> float:
+    if self.tcam_bits == 0:
+      return 0.0
+    return sum(s.cared_bits for s in self.stages) / self.tcam_bits
+
+  @property
+  def min_cycles_per_packet(self) -> int:
+    """The best-case pipeline occupancy of the slowest packet."""
+    return max((s.max_cycles for s in self.stages), default=0)
+
+
+def check_action(
+    action: d.Action, hardware: d.HardwareConfig
+) -> list[str]:
+  """Check the parts of an action that can be checked without a packet."""
+  problems = []
+  if action.action_type == d.ActionType.MOVECURSOR:
+    num_bits = constant_int(action.action_args)
+    if (
+        num_bits is not None
+        and hardware.move_increment
+        and num_bits % hardware.move_increment != 0
+    ):
+      problems.append(
+          "moves %s bits, which is not a multiple of the move increment %s"
+          % (num_bits, hardware.move_increment)
+      )
+    return problems
+  if action.action_type == d.ActionType.EXTRACTHEADER:
+    _, locexp = action.action_args
+    loc = interp.constant_location(locexp)
+    reads = [] if loc is None else [(loc, hardware.extract_range, "extract")]
+  else:
+    src, _ = action.action_args
+    reads = [
+        (loc, hardware.copy_range, "copy") for loc in interp.packet_reads(src)
+    ]
+  for loc, limit, kind in reads:
+    if limit is not None and loc.end > limit:
+      problems.append(
+          "%s reads %s[%s:%s], beyond the %s range of %s bits"
+          % (kind, loc.name, loc.start, loc.end, kind, limit)
+      )
+  return problems
+
+
+def constant_int(exp: d.IntExp) -> int | None:
+  if isinstance(exp.exp, d.SizedInt):
+    return exp.exp.value
+  return None
+
+
+def analyze(tcam: d.TCAM, hardware: d.HardwareConfig) -> StaticReport:
+  """Statically compute the costs of a program on a hardware config."""
+  shape = [p.value.length for p in tcam[0][0][0]] if tcam and tcam[0] else []
+  key_width = sum(shape)
+  key_cared = [0] * len(shape)
+  total_rules = 0
+  stages = []
+  violations = []
+  if hardware.max_stages is not None and len(tcam) > hardware.max_stages:
+    violations.append(
+        "Program has %s stages, but the hardware only has %s."
+        % (len(tcam), hardware.max_stages)
+    )
+  for stage, table in enumerate(tcam):
+    if (
+        hardware.max_rules_per_stage is not None
+        and len(table) > hardware.max_rules_per_stage
+    ):
+      violations.append(
+          "Stage %s has %s rules, but the hardware only allows %s."
+          % (stage, len(table), hardware.max_rules_per_stage)
+      )
+    costs = []
+    cared = 0
+    for rule_idx, rule in enumerate(table):
+      costs.append(rule_cost(rule, hardware))
+      for i, pat in enumerate(rule[0]):
+        key_cared[i] += pat.mask.count(1)
+        cared += pat.mask.count(1)
+      for action in rule[1]:
+        for problem in check_action(action, hardware):
+          violations.append(
+              "Rule %s in stage %s %s." % (rule_idx, stage, problem)
+          )
+    if hardware.max_simultaneous_extracts == 0 and any(
+        c.extracts for c in costs
+    ):
+      violations.append(
+          "Stage %s extracts headers, but the hardware can't." % stage
+      )
+    if hardware.max_simultaneous_copies == 0 and any(c.copies for c in costs):
+      violations.append("Stage %s copies data, but the hardware can't." % stage)
+    total_rules += len(table)
+    # Packets that match no rule still spend a cycle in the stage
+    cycles = [c.cycles for c in costs] + [NO_MATCH_COST.cycles]
+    stages.append(
+        StageReport(
+            rules=len(table),
+            tcam_bits=len(table) * key_width,
+            cared_bits=cared,
+            max_cycles=max(cycles),
+            max_actions=max((c.actions for c in costs), default=0),
+        )
+    )
+  return StaticReport(
+      stages=stages,
+      key_widths=shape,
+      key_utilization=[
+          cared / (width * total_rules) if width and total_rules else 0.0
+          for cared, width in zip(key_cared, shape)
+      ],
+      worst_path_cycles=sum(s.max_cycles for s in stages),
+      worst_path_actions=sum(s.max_actions for s in stages),
+      violations=violations,
+  )
+
+
+@dataclasses.dataclass
+class PacketCost:
+  """The modelled cost of parsing one packet."""
+
+  cycles: int  # Latency, in cycles
+  actions: int
+  bottleneck: int  # Cycles spent in the packet's slowest stage
+  stages: int  # The number of stages the packet went through
+
+
+class CostTracer:
+  """Adds up the cost of the stages a packet goes through.
+
+  Implements interp.Tracer.
+  """
+
+  def __init__(self, hardware: d.HardwareConfig):
+    self.hardware = hardware
+    self.cost = PacketCost(0, 0, 0, 0)
+
+  def start_packet(self) -> bool:
+    self.cost = PacketCost(0, 0, 0, 0)
+    return True
+
+  def record(
+      self,
+      stage: int,
+      rule: int | None,
+      actions: set[d.Action],
+      cursor_before: int,
+      cursor_after: int,
+      failed: bool = False,
+  ) -> None:
+    del stage, cursor_before, cursor_after, failed  # Unused
+    if rule is None:
+      stage_cost = NO_MATCH_COST
+    else:
+      stage_cost = actions_cost(actions, self.hardware)
+    self.cost.cycles += stage_cost.cycles
+    self.cost.actions += stage_cost.actions
+    self.cost.bottleneck = max(self.cost.bottleneck, stage_cost.cycles)
+    self.cost.stages += 1
+
+
+def packet_cost(
+    tcam: d.TCAM,
+    state: d.MachineState,
+    packet: d.Data,
+    hardware: d.HardwareConfig,
+) -> PacketCost:
+  """Interpret a packet, and return its modelled cost.
+
+  Raises the interpreter's RuntimeError if the packet can't be parsed.
+  """
+  tracer = CostTracer(hardware)
+  interp.interp_tcam(tcam, state, packet, tracer=tracer)
+  return tracer.cost
+
+
+def percentile(values: list[int], p: float) -> int:
+  """The nearest-rank percentile of a sorted, non-empty list."""
+  rank = max(1, math.ceil(p / 100 * len(values)))
+  return values[rank - 1]
+
+
+@dataclasses.dataclass
+class ReplayReport:
+  """Costs of a program over a corpus of packets."""
+
+  packets: int
+  errors: int
+  # Percentiles (50, 90, 99, 100) over the packets that parsed successfully
+  cycles: dict[int, int]
+  actions: dict[int, int]
+  # Average packets per cycle, for a stream of the parsed packets
+  throughput: float
+  # The number of packets whose slowest stage takes each number of cycles
+  bottlenecks: dict[int, int]
+
+  def packets_per_second(self, clock_hz: float) -> float:
+    return self.throughput * clock_hz
+
+
+PERCENTILES = (50, 90, 99, 100)
+
+
+def replay(
+    tcam: d.TCAM,
+    state: d.MachineState,
+    packets: Iterable[d.Data],
+    hardware: d.HardwareConfig,
+) -> ReplayReport:
+  """Compute the distribution of costs over a sequence of packets."""
+  costs = []
+  errors = 0
+  for packet in packets:
+    try:
+      cost = packet_cost(tcam, interp.copy_state(state), packet, hardware)
+    except RuntimeError:
+      errors += 1
+    else:
+      costs.append(cost)
+  cycles = sorted(c.cycles for c in costs)
+  actions = sorted(c.actions for c in costs)
+  bottlenecks = {}
+  for c in costs:
+    bottlenecks[c.bottleneck] = bottlenecks.get(c.bottleneck, 0) + 1
+  occupancy = sum(c.bottleneck for c in costs)
+  return ReplayReport(
+      packets=len(costs) + errors,
+      errors=errors,
+      cycles={p: percentile(cycles, p) for p in PERCENTILES} if costs else {},
+      actions={p: percentile(actions, p) for p in PERCENTILES} if costs else {},
+      throughput=len(costs) / occupancy if occupancy else 0.0,
+      bottlenecks=dict(sorted(bottlenecks.items())),
+  )
@@ -0,0 +1,157 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the hardware cost model."""
+
+import dataclasses
+import unittest
+from interpreter import config_parser
+from interpreter import cost_model
+from interpreter import ir_parser
+import interpreter.datatypes as d
+
+IR_FILE = "interpreter/test_files/simple_ip_parser.json"
+CONFIG_FILE = "interpreter/test_files/simple_ip_config.json"
+
+IPV4_PACKET = (
+    "0x" + "ff" * 12 + "0800" + "45000000" * 3 + "7f000001" + "0a000001"
+)
+IPV6_PACKET = "0x" + "ff" * 12 + "86dd" + "00" * 40
+
+
+def parse_actions(actions: list[dict[str, str]]) -> set[d.Action]:
+  return {ir_parser.parse_action(a) for a in actions}
+
+
+class CostModelTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tcam = ir_parser.parse_ir(IR_FILE, True)
+    self.state = config_parser.parse(CONFIG_FILE, True)
+    self.hardware = config_parser.parse_hardware(CONFIG_FILE, True)
+
+  def test_rule_cost(self):
+    rule = (
+        [],
+        parse_actions([
+            {"type": "ExtractHeader", "id": "a", "loc": "packet[0:7]"},
+            {"type": "ExtractHeader", "id": "b", "loc": "packet[8:15]"},
+            {"type": "ExtractHeader", "id": "c", "loc": "packet[16:23]"},
+            {"type": "CopyData", "src": "1w8", "dst": "r1[0:7]"},
+            {"type": "MoveCursor", "numbits": "24"},
+        ]),
+    )
+    # 3 extracts, at most 2 at a time
+    self.assertEqual(
+        cost_model.rule_cost(rule, self.hardware),
+        cost_model.RuleCost(cycles=2, actions=5, extracts=3, copies=1),
+    )
+    # 5 actions, at most 1 at a time
+    self.assertEqual(
+        cost_model.rule_cost(
+            rule, d.HardwareConfig(max_simultaneous_actions=1)
+        ).cycles,
+        5,
+    )
+    # No limits
+    self.assertEqual(
+        cost_model.rule_cost(rule, d.HardwareConfig()).cycles, 1
+    )
+
+  def test_analyze(self):
+    report = cost_model.analyze(self.tcam, self.hardware)
+    # The sample config's extract range is smaller than an IP header
+    self.assertEqual(
+        report.violations,
+        [
+            "Rule 0 in stage 1 extract reads packet[0:159], beyond the"
+            " extract range of 127 bits.",
+            "Rule 1 in stage 1 extract reads packet[0:319], beyond the"
+            " extract range of 127 bits.",
+        ],
+    )
+    self.assertEqual(report.key_widths, [32, 32])
+    self.assertEqual(len(report.stages), len(self.tcam))
+    self.assertEqual(
+        [s.rules for s in report.stages], [len(t) for t in self.tcam]
+    )
+    self.assertEqual(report.stages[0].tcam_bits, 64)
+    # The first stage's only rule is all wildcards
+    self.assertEqual(report.stages[0].cared_bits, 0)
+    self.assertEqual(report.stages[1].cared_bits, 2 * (32 + 16))
+    self.assertEqual(report.worst_path_cycles, len(self.tcam))
+    self.assertEqual(report.worst_path_actions, 4 + 4 + 1)
+    self.assertTrue(0 < report.tcam_utilization < 1)
+    self.assertTrue(all(0 < u < 1 for u in report.key_utilization))
+
+    # A smaller config, on which the program doesn't fit
+    small = dataclasses.replace(
+        self.hardware,
+        max_stages=2,
+        max_rules_per_stage=1,
+        move_increment=64,
+        extract_range=200,
+        max_simultaneous_actions=2,
+    )
+    report = cost_model.analyze(self.tcam, small)
+    self.assertIn(
+        "Program has 3 stages, but the hardware only has 2.", report.violations
+    )
+    self.assertIn(
+        "Stage 1 has 2 rules, but the hardware only allows 1.",
+        report.violations,
+    )
+    self.assertIn(
+        "Rule 0 in stage 0 moves 112 bits, which is not a multiple of the move"
+        " increment 64.",
+        report.violations,
+    )
+    self.assertIn(
+        "Rule 1 in stage 1 extract reads packet[0:319], beyond the extract"
+        " range of 200 bits.",
+        report.violations,
+    )
+    self.assertEqual(report.stages[0].max_cycles, 2)
+    self.assertEqual(report.worst_path_cycles, 2 + 2 + 1)
+
+  def test_replay(self):
+    hardware = d.HardwareConfig(max_simultaneous_actions=3)
+    report = cost_model.replay(
+        self.tcam,
+        self.state,
+        [d.Data(IPV4_PACKET), d.Data(IPV6_PACKET), d.Data("0x00")],
+        hardware,
+    )
+    self.assertEqual(report.packets, 3)
+    self.assertEqual(report.errors, 1)  # The last packet is too short
+    # IPv6 packets have fewer actions in stage 1
+    self.assertEqual(report.cycles, {50: 4, 90: 5, 99: 5, 100: 5})
+    self.assertEqual(report.actions, {50: 8, 90: 9, 99: 9, 100: 9})
+    self.assertEqual(report.bottlenecks, {2: 2})
+    self.assertEqual(report.throughput, 0.5)
+    self.assertEqual(report.packets_per_second(1e9), 5e8)
+
+    # The packets are interpreted as usual
+    state = config_parser.parse(CONFIG_FILE, True)
+    cost = cost_model.packet_cost(
+        self.tcam, state, d.Data(IPV4_PACKET), hardware
+    )
+    self.assertEqual(cost.stages, 3)
+    self.assertEqual(state.stores["state"].value, 100)
+    self.assertIn("hdr.ipv4", state.headers)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -19,6 +19,7 @@ the state of our abstract TCAM machines. This file focuses on defining the types
 themselves; functions for manipulating them are defined in the main file.
 """
 
+from collections.abc import Iterator, Mapping, MutableMapping
 import dataclasses
 import enum
 from typing import Union
@@ -144,11 +145,15 @@ class LocationExp:
   end: IntExp  # Last bit of the location (exclusive)
 
 
-@dataclasses.dataclass(frozen=True)
+@dataclasses.dataclass
 class DataStore:
   """DataStores generalize registers, storing a mutable array of bits.
 
+  The bits are held as an int, with bit 0 of the store as its most significant
+  bit (i.e. in the same order as a Data of the store's width).
+
   In addition to its stored value, each DataStore has several attributes:
+  - width: the number of bits in the store
   - read/write: indicate if the DataStore can be read/written, respectively
   - persistent: If True, the data store's value is visible after parsing.
   - masked_writes: If false, then writing to a subset of the data store's bits
@@ -156,12 +161,117 @@ class DataStore:
     unchanged.
   """
 
-  value: Data
+  value: int
+  width: int
   read: bool
   write: bool
   persistent: bool
   masked_writes: bool
 
+  def data(self) -> Data:
+    """The store's value as an array of bits."""
+    return Data(uint=self.value, length=self.width)
+
+
+@dataclasses.dataclass(frozen=True)
+class HardwareConfig:
+  """The limits of a hardware configuration, beyond its stores and keys.
+
+  Each field is None if the configuration file doesn't specify it.
+  - max_stages: the number of TCAM tables
+  - max_rules_per_stage: the number of rules each table can hold
+  - copy_range/extract_range: how far past the cursor (in bits) copies and
+    extracts can read
+  - move_increment: the granularity (in bits) of cursor moves
+  - max_simultaneous_*: how many actions (of each kind) a stage can execute in
+    one clock cycle
+  """
+
+  max_stages: int | None = None
+  max_rules_per_stage: int | None = None
+  copy_range: int | None = None
+  extract_range: int | None = None
+  move_increment: int | None = None
+  max_simultaneous_extracts: int | None = None
+  max_simultaneous_copies: int | None = None
+  max_simultaneous_actions: int | None = None
+
+
+class Headers(MutableMapping[str, Data]):
+  """The set of headers extracted from a packet, indexed by name.
+
+  Most consumers only look at a few of the extracted headers, so rather than
+  copying each header's bits out of the packet, the interpreter records where
+  in the packet the header lies (see record). A header's bits are only sliced
+  out of the packet the first time it is accessed. Headers can also be assigned
+  directly, like in a dict.
+  """
+
+  def __init__(self, headers: Mapping[str, Data] | None = None):
+    # Each entry is either the header's value, or an (offset, length) reference
+    # into self.packet that hasn't been materialized yet.
+    self._entries: dict[str, Data | tuple[int, int]] = dict(headers or {})
+    # References of every recorded header, kept after materialization.
+    self._refs: dict[str, tuple[int, int]] = {}
+    self.packet: Data | None = None
+
+  def record(self, name: str, packet: Data, offset: int, length: int) -> None:
+    """Record that the header occupies packet[offset : offset + length]."""
+    if self.packet is not packet:
+      if self.packet is not None:
+        # Materialize references into the old packet before switching.
+        for key in list(self._entries):
+          self[key]  # pylint: disable=pointless-statement
+      self.packet = packet
+    self._entries[name] = (offset, length)
+    self._refs[name] = (offset, length)
+
+  def ref(self, name: str) -> tuple[int, int] | None:
+    """The (offset, length) of a recorded header, or None if not recorded."""
+    if name not in self._entries:
+      raise KeyError(name)
+    return self._refs.get(name)
+
+  def refs(self) -> dict[str, tuple[int, int]]:
+    """The (offset, length) of every recorded header."""
+    return {name: ref for name, ref in self._refs.items() if name in self}
+
+  def copy(self) -> "Headers":
+    """A shallow copy, which keeps unmaterialized headers as references."""
+    headers = Headers()
+    headers._entries = dict(self._entries)
+    headers._refs = dict(self._refs)
+    headers.packet = self.packet
+    return headers
+
+  def __getitem__(self, name: str) -> Data:
+    value = self._entries[name]
+    if isinstance(value, tuple):
+      offset, length = value
+      value = self.packet[offset : offset + length]
+      self._entries[name] = value
+    return value
+
+  def __setitem__(self, name: str, value: Data) -> None:
+    self._entries[name] = value
+    self._refs.pop(name, None)
+
+  def __delitem__(self, name: str) -> None:
+    del self._entries[name]
+    self._refs.pop(name, None)
+
+  def __contains__(self, name: object) -> bool:
+    return name in self._entries
+
+  def __iter__(self) -> Iterator[str]:
+    return iter(self._entries)
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  def __repr__(self) -> str:
+    return "Headers(%s)" % self._entries
+
 
 # Mutable since we don't pass the frozen=True flag. This allows us to modify
 # it easily during interpretation.
@@ -181,7 +291,41 @@ class MachineState:
   stage: int
   stores: dict[str, DataStore]
   keys: list[Location]
-  headers: dict[str, Data]
+  headers: Headers
+  # The value of each key packed into an int, or None if the key has been
+  # written to since it was last read. Code that modifies store values other
+  # than through the interpreter must call invalidate_keys afterwards.
+  key_values: list[int | None] = dataclasses.field(
+      init=False, repr=False, compare=False
+  )
+  # Map from store name to the indices of the keys that lie in that store
+  key_overlaps: dict[str, list[int]] = dataclasses.field(
+      init=False, repr=False, compare=False
+  )
+
+  def __post_init__(self) -> None:
+    # Allow the headers to be given as a plain dict
+    if not isinstance(self.headers, Headers):
+      self.headers = Headers(self.headers)
+    self.key_values = [None] * len(self.keys)
+    self.key_overlaps = {}
+    for i, loc in enumerate(self.keys):
+      self.key_overlaps.setdefault(loc.name, []).append(i)
+
+  def invalidate_keys(
+      self, name: str | None = None, start: int = 0, end: int | None = None
+  ) -> None:
+    """Mark the keys overlapping bits start to end of a store as stale.
+
+    With no arguments, marks every key as stale.
+    """
+    if name is None:
+      self.key_values = [None] * len(self.keys)
+      return
+    for i in self.key_overlaps.get(name, []):
+      loc = self.keys[i]
+      if loc.start <= (loc.end if end is None else end) and start <= loc.end:
+        self.key_values[i] = None
 
 
 class ActionType(enum.Enum):
@@ -234,9 +378,15 @@ class Pattern:
 
   value: Data
   mask: Data
+  # The value and mask as ints, for fast matching against packed keys. Bits of
+  # value_int outside the mask are always 0.
+  value_int: int = dataclasses.field(init=False, repr=False, compare=False)
+  mask_int: int = dataclasses.field(init=False, repr=False, compare=False)
 
   def __post_init__(self) -> None:
     assert self.value.length == self.mask.length
+    object.__setattr__(self, "mask_int", self.mask.uint)
+    object.__setattr__(self, "value_int", self.value.uint & self.mask_int)
 
 
 Rule = tuple[list[Pattern], set[Action]]
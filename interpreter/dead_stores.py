@@ -0,0 +1,237 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Remove CopyData actions whose results are never observed.
+
+Every packet goes through every stage in order, so liveness is computed with a
+single backward pass over the stages. A bit of a store is live at the start of
+a stage if it is read by a key, or if some rule of the stage (or the fall
+through when no rule matches) reads it or leaves it live for the next stage.
+The bits of persistent stores are live after the last stage. Since stages are
+atomic, the reads of a rule see the state before any of its writes.
+
+Liveness is tracked per store as an int, with the same bit order as
+DataStore.value. A copy is dead if none of the bits it changes are live after
+its stage; for stores without masked writes, that means the whole store, since
+the write also zeroes the rest of it.
+
+Removing a copy also removes the errors it might raise at runtime (e.g. reading
+past the end of the packet). Copies whose destination is statically invalid
+are kept, and so are copies into a store without masked writes that the same
+rule writes more than once, since the outcome of those depends on the order the
+writes happen in.
+"""
+
+from interpreter import config_parser
+from interpreter import interp
+from interpreter import ir_parser
+from interpreter import ir_writer
+import interpreter.datatypes as d
+
+# Map from store name to a bitmask of its bits
+Bits = dict[str, int]
+
+
+def full_mask(store: d.DataStore) -> int:
+  return (1 << store.width) - 1
+
+
+def location_bits(loc: d.Location, store: d.DataStore) -> int:
+  if loc.end >= store.width:
+    return full_mask(store)
+  return interp.location_mask(store.width, loc)[1]
+
+
+def add_bits(bits: Bits, name: str, mask: int) -> None:
+  bits[name] = bits.get(name, 0) | mask
+
+
+def union(a: Bits, b: Bits) -> Bits:
+  result = dict(a)
+  for name, mask in b.items():
+    add_bits(result, name, mask)
+  return result
+
+
+def exp_uses(exp: d.IntExp, stores: dict[str, d.DataStore], uses: Bits) -> None:
+  """Add the store bits read by an expression to uses."""
+  e = exp.exp
+  if isinstance(e, d.SizedInt):
+    return
+  if isinstance(e, d.LocationExp):
+    locexp_uses(e, stores, uses, read=True)
+    return
+  exp_uses(e.left, stores, uses)
+  exp_uses(e.right, stores, uses)
+
+
+def locexp_uses(
+    locexp: d.LocationExp,
+    stores: dict[str, d.DataStore],
+    uses: Bits,
+    read: bool,
+) -> None:
+  """Add the bits read by a location expression (and its bounds) to uses."""
+  exp_uses(locexp.start, stores, uses)
+  exp_uses(locexp.end, stores, uses)
+  if not read or locexp.name not in stores:
+    return
+  store = stores[locexp.name]
+  loc = interp.constant_location(locexp)
+  if loc is None:
+    add_bits(uses, locexp.name, full_mask(store))
+  else:
+    add_bits(uses, locexp.name, location_bits(loc, store))
+
+
+def rule_uses(actions: set[d.Action], stores: dict[str, d.DataStore]) -> Bits:
+  uses = {}
+  for action in actions:
+    if action.action_type == d.ActionType.MOVECURSOR:
+      exp_uses(action.action_args, stores, uses)
+    elif action.action_type == d.ActionType.EXTRACTHEADER:
+      locexp_uses(action.action_args[1], stores, uses, read=False)
+    else:
+      src, dst = action.action_args
+      exp_uses(src, stores, uses)
+      locexp_uses(dst, stores, uses, read=False)
+  return uses
+
+
+def value_width(exp: d.IntExp) -> int | None:
+  """The width of an expression's value, or None if it isn't known."""
+  e = exp.exp
+  if isinstance(e, d.SizedInt):
+    return e.width
+  if isinstance(e, d.LocationExp):
+    loc = interp.constant_location(e)
+    return None if loc is None else loc.length
+  if e.op == d.ArithOp.CAST:
+    return e.left.exp.value if isinstance(e.left.exp, d.SizedInt) else None
+  # The other operations have the width of their left operand
+  return value_width(e.left)
+
+
+def copy_effect(
+    action: d.Action, stores: dict[str, d.DataStore]
+) -> tuple[str, int, int] | None:
+  """The store a copy writes, the bits it changes, and the bits it kills.
+
+  Returns None for copies whose destination isn't a valid, writeable store, or
+  whose value doesn't have the destination's width: they always fail.
+  """
+  src, dst = action.action_args
+  store = stores.get(dst.name)
+  if store is None or not store.write:
+    return None
+  loc = interp.constant_location(dst)
+  if loc is not None and loc.end >= store.width:
+    return None
+  width = value_width(src)
+  if loc is not None and width is not None and width != loc.length:
+    return None
+  if not store.masked_writes:
+    return (dst.name, full_mask(store), full_mask(store))
+  if loc is None:
+    # We don't know which bits are written, so we can't kill any of them
+    return (dst.name, full_mask(store), 0)
+  bits = location_bits(loc, store)
+  return (dst.name, bits, bits)
+
+
+def rule_kills(actions: set[d.Action], stores: dict[str, d.DataStore]) -> Bits:
+  kills = {}
+  for action in actions:
+    if action.action_type == d.ActionType.COPYDATA:
+      effect = copy_effect(action, stores)
+      if effect is not None:
+        add_bits(kills, effect[0], effect[2])
+  return kills
+
+
+def stage_live_in(
+    table: d.Table, state: d.MachineState, live_out: Bits
+) -> Bits:
+  live = dict(live_out)  # When no rule matches
+  for loc in state.keys:
+    add_bits(live, loc.name, location_bits(loc, state.stores[loc.name]))
+  for _, actions in table:
+    live = union(live, rule_uses(actions, state.stores))
+    kills = rule_kills(actions, state.stores)
+    for name, mask in live_out.items():
+      add_bits(live, name, mask & ~kills.get(name, 0))
+  return live
+
+
+def liveness(tcam: d.TCAM, state: d.MachineState) -> list[Bits]:
+  """Return the live bits after each stage."""
+  live = {}
+  for name, store in state.stores.items():
+    if store.persistent:
+      live[name] = full_mask(store)
+  live_after = [{}] * len(tcam)
+  for stage in reversed(range(len(tcam))):
+    live_after[stage] = live
+    live = stage_live_in(tcam[stage], state, live)
+  return live_after
+
+
+def dead_copies(
+    actions: set[d.Action], stores: dict[str, d.DataStore], live_out: Bits
+) -> set[d.Action]:
+  copies = [a for a in actions if a.action_type == d.ActionType.COPYDATA]
+  targets = [a.action_args[1].name for a in copies]
+  dead = set()
+  for action in copies:
+    effect = copy_effect(action, stores)
+    if effect is None:
+      continue
+    if not stores[effect[0]].masked_writes and targets.count(effect[0]) > 1:
+      continue
+    name, changed, _ = effect
+    if not live_out.get(name, 0) & changed:
+      dead.add(action)
+  return dead
+
+
+def eliminate_dead_stores(
+    tcam: d.TCAM, state: d.MachineState
+) -> tuple[d.TCAM, int]:
+  """Remove dead copies, returning the new TCAM and the number removed."""
+  tcam = [[(patterns, set(actions)) for patterns, actions in t] for t in tcam]
+  removed = 0
+  while True:
+    live_after = liveness(tcam, state)
+    removed_now = 0
+    for stage, table in enumerate(tcam):
+      for _, actions in table:
+        dead = dead_copies(actions, state.stores, live_after[stage])
+        actions -= dead
+        removed_now += len(dead)
+    if not removed_now:
+      return tcam, removed
+    # Removing a copy removes its reads, which can make earlier copies dead
+    removed += removed_now
+
+
+def eliminate_ir(in_path: str, config_path: str, out_path: str) -> int:
+  """Remove dead copies from a json IR file, writing the result to out_path.
+
+  Returns the number of copies removed.
+  """
+  state = config_parser.parse(config_path, True)
+  tcam = ir_parser.parse_ir(in_path, True)
+  tcam, removed = eliminate_dead_stores(tcam, state)
+  ir_writer.write_ir(tcam, out_path)
+  return removed
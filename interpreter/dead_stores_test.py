@@ -0,0 +1,146 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for dead-store elimination."""
+
+import os
+import tempfile
+import unittest
+from interpreter import config_parser
+from interpreter import dead_stores
+from interpreter import interp
+from interpreter import ir_parser
+from interpreter import test_util
+import interpreter.datatypes as d
+
+IR_FILE = "interpreter/test_files/simple_ip_parser.json"
+CONFIG_FILE = "interpreter/test_files/simple_ip_config.json"
+
+CONFIG = {
+    "data stores": [
+        test_util.store("state", 8),
+        test_util.store("tmp", 8),
+        test_util.store("tmp2", 8),
+        test_util.store("flags", 8, masked=True),
+        test_util.store("out", 8, persistent=True),
+    ],
+    "keys": ["state[0:7]"],
+}
+
+ANY = [ir_parser.parse_pattern("0x**")]
+
+
+class DeadStoresTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.state = config_parser.parse_config(CONFIG)
+
+  def assert_same_results(self, tcam: d.TCAM, optimized: d.TCAM) -> None:
+    for value in range(0, 1 << 16, 257):
+      packet = d.Data(uint=value, length=16)
+      expected = interp.copy_state(self.state)
+      interp.interp_tcam(tcam, expected, packet)
+      state = interp.copy_state(self.state)
+      interp.interp_tcam(optimized, state, packet)
+      self.assertEqual(state.stores["out"], expected.stores["out"])
+      self.assertEqual(state.cursor, expected.cursor)
+
+  def test_eliminate(self):
+    tcam = [
+        [(
+            ANY,
+            {
+                test_util.copy("packet[0:7]", "state[0:7]"),
+                # Read by the next stage
+                test_util.copy("packet[8:15]", "tmp[0:7]"),
+                # Only read by a dead copy
+                test_util.copy("packet[0:7]", "tmp2[0:7]"),
+                # Only the first half is read later
+                test_util.copy("packet[0:3]", "flags[0:3]"),
+                test_util.copy("packet[4:7]", "flags[4:7]"),
+            },
+        )],
+        [(
+            ANY,
+            {
+                test_util.copy("((w8) tmp[0:3])", "out[0:7]"),
+                test_util.copy("tmp2[0:7]", "tmp[0:7]"),
+                test_util.move("((w8) flags[0:3])"),
+            },
+        )],
+    ]
+    optimized, removed = dead_stores.eliminate_dead_stores(tcam, self.state)
+    self.assertEqual(removed, 3)
+    self.assertEqual(
+        optimized[0][0][1],
+        {
+            test_util.copy("packet[0:7]", "state[0:7]"),
+            test_util.copy("packet[8:15]", "tmp[0:7]"),
+            test_util.copy("packet[0:3]", "flags[0:3]"),
+        },
+    )
+    self.assertEqual(
+        optimized[1][0][1],
+        {
+            test_util.copy("((w8) tmp[0:3])", "out[0:7]"),
+            test_util.move("((w8) flags[0:3])"),
+        },
+    )
+    # The input isn't modified
+    self.assertEqual(len(tcam[0][0][1]), 5)
+    self.assert_same_results(tcam, optimized)
+
+  def test_keys_and_persistent_stores_are_live(self):
+    tcam = ir_parser.parse_ir(IR_FILE, True)
+    state = config_parser.parse(CONFIG_FILE, True)
+    optimized, removed = dead_stores.eliminate_dead_stores(tcam, state)
+    self.assertEqual(removed, 0)
+    self.assertEqual(optimized, tcam)
+
+  def test_multiple_writes_are_kept(self):
+    # Without masked writes, the outcome depends on the order of the writes
+    tcam = [[(
+        ANY,
+        {
+            test_util.copy("packet[0:3]", "out[0:3]"),
+            test_util.copy("packet[4:7]", "out[4:7]"),
+        },
+    )]]
+    _, removed = dead_stores.eliminate_dead_stores(tcam, self.state)
+    self.assertEqual(removed, 0)
+
+  def test_failing_copies_are_kept(self):
+    # tmp is never read, but the copy always fails: removing it would hide the
+    # error.
+    tcam = [[(ANY, {test_util.copy("packet[0:3]", "tmp[0:7]")})]]
+    _, removed = dead_stores.eliminate_dead_stores(tcam, self.state)
+    self.assertEqual(removed, 0)
+    # A cast gives the value the right width
+    tcam = [[(ANY, {test_util.copy("((w8) packet[0:3])", "tmp[0:7]")})]]
+    _, removed = dead_stores.eliminate_dead_stores(tcam, self.state)
+    self.assertEqual(removed, 1)
+
+  def test_eliminate_ir(self):
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    self.addCleanup(os.remove, path)
+    self.assertEqual(dead_stores.eliminate_ir(IR_FILE, CONFIG_FILE, path), 0)
+    self.assertEqual(
+        ir_parser.parse_ir(path, True), ir_parser.parse_ir(IR_FILE, True)
+    )
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -157,21 +157,26 @@ class EndToEndTest(unittest.TestCase):
     basic_checks(state, ETH_LEN + IPV4_BASE_LEN, ETHERTY_IPV4)
     self.assertIn("hdr.ipv4", state.headers)
     self.assertEqual(state.headers["hdr.ipv4"], mk_packet(ipv4_hdr_good))
-    self.assertEqual(state.stores["state"].value, d.Data(STATE_ACCEPT))
+    self.assertEqual(state.stores["state"].data(), d.Data(STATE_ACCEPT))
 
     # Should go through the sequence of states 1, 2, 100
     state = interp.interp(ir_file, config_file, ipv4_packet_reject)
     basic_checks(state, ETH_LEN + IPV4_BASE_LEN, ETHERTY_IPV4)
     self.assertIn("hdr.ipv4", state.headers)
     self.assertEqual(state.headers["hdr.ipv4"], mk_packet(ipv4_hdr_bad))
-    self.assertEqual(state.stores["state"].value, d.Data(STATE_REJECT))
+    self.assertEqual(state.stores["state"].data(), d.Data(STATE_REJECT))
 
     # Should go through the sequence of states 1, 3, 99
     state = interp.interp(ir_file, config_file, ipv6_packet)
     basic_checks(state, ETH_LEN + IPV6_LEN, ETHERTY_IPV6)
     self.assertIn("hdr.ipv6", state.headers)
     self.assertEqual(state.headers["hdr.ipv6"], mk_packet(ipv6_hdr))
-    self.assertEqual(state.stores["state"].value, d.Data(STATE_ACCEPT))
+    self.assertEqual(state.stores["state"].data(), d.Data(STATE_ACCEPT))
+
+    # Loading the IR lazily gives the same result
+    self.assertEqual(
+        interp.interp(ir_file, config_file, ipv6_packet, lazy_ir=True), state
+    )
 
     # Should only hit state 1
     state = interp.interp(ir_file, config_file, nonsense_packet)
@@ -180,7 +185,7 @@ class EndToEndTest(unittest.TestCase):
     self.assertEqual(len(state.headers), 1)
     self.assertIn("hdr.ethernet", state.headers)  # Value isn't really important
     # Make sure we end in state 1
-    self.assertEqual(state.stores["state"].value, d.Data("0x00000001"))
+    self.assertEqual(state.stores["state"].data(), d.Data("0x00000001"))
 
 
 if __name__ == "__main__":
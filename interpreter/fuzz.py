@@ -0,0 +1,291 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A coverage-guided fuzzer for TCAM programs.
+
+The program is loaded once, and packets are run through the interpreter in
+this process. Coverage is the set of (stage, rule) pairs the interpreter
+reports to a Tracer, where rule is None when no rule matches; a packet whose
+actions fail covers (stage, rule, error type) instead, so that each way a rule
+can fail counts as new coverage. Each iteration mutates a packet from the corpus
+(flipping, setting, inserting and deleting bits and bytes, truncating, and
+splicing two packets together), and packets that reach new coverage are added
+to the corpus.
+
+Packets that make the interpreter raise an exception are findings. They are
+grouped by where they fail: the exception type, the stage, and the rule that
+matched. The first packet found for each is minimized, by shortening it and
+clearing its bits for as long as it still fails in the same place.
+
+By default the corpus is seeded with the packets from packet_gen, which fire
+every rule it can reach. Run with e.g.
+  python -m interpreter.fuzz --ir prog.json --config config.json \\
+      --iterations 100000
+"""
+
+import argparse
+import dataclasses
+import random
+import sys
+
+from interpreter import config_parser
+from interpreter import corpus
+from interpreter import interp
+from interpreter import ir_parser
+from interpreter import packet_gen
+import interpreter.datatypes as d
+
+DEFAULT_ITERATIONS = 10000
+# The longest packet the mutations will produce, in bits
+DEFAULT_MAX_BITS = 8 * 1518
+# Bytes that tend to reach edge cases
+INTERESTING_BYTES = (0x00, 0x01, 0x7F, 0x80, 0xFF)
+
+# A covered point: (stage, rule) or (stage, rule, error type)
+Point = tuple
+# Where a packet fails: (exception type, stage, rule)
+Signature = tuple[str, int, int | None]
+
+
+class CoverageTracer:
+  """Collects the (stage, rule) pairs of a packet. Implements interp.Tracer."""
+
+  def __init__(self):
+    self.points: list[Point] = []
+    # The (stage, rule) pair whose actions failed, if any
+    self.failure: tuple[int, int | None] | None = None
+
+  def start_packet(self) -> bool:
+    self.points = []
+    self.failure = None
+    return True
+
+  def record(
+      self,
+      stage: int,
+      rule: int | None,
+      actions: set[d.Action],
+      cursor_before: int,
+      cursor_after: int,
+      failed: bool = False,
+  ) -> None:
+    del actions, cursor_before, cursor_after  # Unused
+    if failed:
+      self.failure = (stage, rule)
+    else:
+      self.points.append((stage, rule))
+
+
+@dataclasses.dataclass
+class Outcome:
+  """The result of running one packet."""
+
+  points: list[Point]
+  error: Exception | None = None
+  signature: Signature | None = None
+
+
+@dataclasses.dataclass
+class Finding:
+  """A packet that makes the interpreter raise an exception."""
+
+  signature: Signature
+  message: str
+  packet: d.Data
+  minimized: d.Data
+  count: int = 1  # The number of packets found with this signature
+
+
+def format_packet(packet: d.Data) -> str:
+  """Format a packet as a string accepted by interp."""
+  if packet.length % 4 == 0 and packet.length:
+    return "0x" + packet.hex
+  return "0b" + packet.bin
+
+
+class Fuzzer:
+  """Mutates packets to find new coverage and exceptions."""
+
+  def __init__(
+      self,
+      tcam: d.TCAM,
+      state: d.MachineState,
+      seeds: list[d.Data],
+      seed: int = 0,
+      max_bits: int = DEFAULT_MAX_BITS,
+  ):
+    self.tcam = tcam
+    self.state = state
+    self.max_bits = max_bits
+    self.rng = random.Random(seed)
+    self.coverage: set[Point] = set()
+    self.corpus: list[d.Data] = []
+    self.findings: dict[Signature, Finding] = {}
+    self.executions = 0
+    self._tracer = CoverageTracer()
+    seeds = seeds or [d.Data(length=8)]
+    for packet in seeds:
+      self.add(packet)
+    if not self.corpus:
+      # Keep a seed to mutate, even if it covers nothing
+      self.corpus.append(seeds[0])
+
+  def run_packet(self, packet: d.Data) -> Outcome:
+    self.executions += 1
+    state = interp.copy_state(self.state)
+    try:
+      interp.interp_tcam(self.tcam, state, packet, tracer=self._tracer)
+    except Exception as e:  # pylint: disable=broad-except
+      error = type(e).__name__
+      stage, rule = self._tracer.failure or (state.stage, None)
+      points = self._tracer.points + [(stage, rule, error)]
+      return Outcome(points, e, (error, stage, rule))
+    return Outcome(self._tracer.points)
+
+  def add(self, packet: d.Data) -> bool:
+    """Run a packet, keeping it if it reaches new coverage."""
+    outcome = self.run_packet(packet)
+    new = set(outcome.points) - self.coverage
+    if new:
+      self.coverage |= new
+      self.corpus.append(packet)
+    if outcome.error is not None:
+      finding = self.findings.get(outcome.signature)
+      if finding is None:
+        self.findings[outcome.signature] = Finding(
+            outcome.signature,
+            str(outcome.error),
+            packet,
+            self.minimize(packet, outcome.signature),
+        )
+      else:
+        finding.count += 1
+    return bool(new)
+
+  def mutate(self, packet: d.Data) -> d.Data:
+    """Apply between one and four random mutations to a copy of a packet."""
+    bits = d.Data(packet)
+    for _ in range(self.rng.randint(1, 4)):
+      choice = self.rng.randrange(8)
+      pos = self.rng.randrange(bits.length) if bits.length else 0
+      if choice == 0 and bits.length:
+        bits.invert(pos)
+      elif choice == 1 and bits.length >= 8:
+        start = self.rng.randrange(bits.length - 7)
+        bits.overwrite(d.Data(uint=self.rng.getrandbits(8), length=8), start)
+      elif choice == 2 and bits.length >= 8:
+        start = self.rng.randrange(bits.length // 8) * 8
+        value = self.rng.choice(INTERESTING_BYTES)
+        bits.overwrite(d.Data(uint=value, length=8), start)
+      elif choice == 3:
+        bits = bits[: self.rng.randrange(bits.length + 1)]
+      elif choice == 4:
+        num_bits = self.rng.choice((1, 8, 8 * self.rng.randint(1, 16)))
+        extra = d.Data(uint=self.rng.getrandbits(num_bits), length=num_bits)
+        bits.insert(extra, pos)
+      elif choice == 5 and bits.length:
+        end = min(bits.length, pos + self.rng.choice((1, 8, 32)))
+        del bits[pos:end]
+      elif choice == 6:
+        other = self.rng.choice(self.corpus)
+        cut = self.rng.randrange(other.length + 1)
+        bits = bits[:pos] + other[cut:]
+      else:
+        bits.append(d.Data(length=self.rng.choice((8, 32))))
+    return bits[: self.max_bits]
+
+  def run(self, iterations: int) -> None:
+    for _ in range(iterations):
+      self.add(self.mutate(self.rng.choice(self.corpus)))
+
+  def fails_with(self, packet: d.Data, signature: Signature) -> bool:
+    return self.run_packet(packet).signature == signature
+
+  def minimize(self, packet: d.Data, signature: Signature) -> d.Data:
+    """Shorten and clear a failing packet while it fails in the same place."""
+    # Drop as many bits from the end as possible, halving the step each time
+    step = max(1, packet.length // 2)
+    while step:
+      if packet.length >= step and self.fails_with(
+          packet[: packet.length - step], signature
+      ):
+        packet = packet[: packet.length - step]
+      else:
+        step //= 2
+    # Clear each set bit, a byte at a time and then a bit at a time
+    for width in (8, 1):
+      for start in range(0, packet.length, width):
+        end = min(start + width, packet.length)
+        if not packet[start:end].any(True):
+          continue
+        cleared = d.Data(packet)
+        cleared.set(False, range(start, end))
+        if self.fails_with(cleared, signature):
+          packet = cleared
+    return packet
+
+
+def main(argv: list[str] | None = None) -> None:
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument("--ir", required=True, help="IR program")
+  parser.add_argument("--config", required=True, help="Configuration file")
+  parser.add_argument(
+      "--seeds", help="Corpus file of seed packets (default: from packet_gen)"
+  )
+  parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+  parser.add_argument("--seed", type=int, default=0, help="Random seed")
+  parser.add_argument("--max-bits", type=int, default=DEFAULT_MAX_BITS)
+  parser.add_argument("--corpus", help="Write the final corpus to a file")
+  args = parser.parse_args(argv)
+  tcam = ir_parser.parse_ir(args.ir, True)
+  state = config_parser.parse(args.config, True)
+  interp.validate_keys_patterns(tcam, state)
+  if args.seeds:
+    with corpus.Corpus(args.seeds) as packets:
+      seeds = [d.Data(p) for p in packets.packets()]
+  else:
+    seeds, _ = packet_gen.generate(tcam, state)
+  fuzzer = Fuzzer(tcam, state, seeds, args.seed, args.max_bits)
+  fuzzer.run(args.iterations)
+  if args.corpus:
+    with corpus.CorpusWriter(args.corpus) as writer:
+      for packet in fuzzer.corpus:
+        writer.add(packet)
+  for finding in fuzzer.findings.values():
+    error_type, stage, rule = finding.signature
+    print(
+        "%s in stage %s (rule %s), found %s times: %s\n  reproducer: %s"
+        % (
+            error_type,
+            stage,
+            "none" if rule is None else rule,
+            finding.count,
+            finding.message,
+            format_packet(finding.minimized),
+        )
+    )
+  print(
+      "%s executions, %s corpus packets, %s points covered, %s findings."
+      % (
+          fuzzer.executions,
+          len(fuzzer.corpus),
+          len(fuzzer.coverage),
+          len(fuzzer.findings),
+      ),
+      file=sys.stderr,
+  )
+
+
+if __name__ == "__main__":
+  main()
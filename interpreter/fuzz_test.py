@@ -0,0 +1,106 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the coverage-guided fuzzer."""
+
+import contextlib
+import io
+import unittest
+from interpreter import config_parser
+from interpreter import fuzz
+from interpreter import ir_parser
+from interpreter import packet_gen
+from interpreter import test_util
+import interpreter.datatypes as d
+
+IR_FILE = "interpreter/test_files/simple_ip_parser.json"
+CONFIG_FILE = "interpreter/test_files/simple_ip_config.json"
+
+CONFIG = {
+    "data stores": [test_util.store("state", 8)],
+    "keys": ["state[0:7]"],
+}
+
+
+class FuzzTest(unittest.TestCase):
+
+  def test_simple_ip(self):
+    tcam = ir_parser.parse_ir(IR_FILE, True)
+    state = config_parser.parse(CONFIG_FILE, True)
+    seeds, covered = packet_gen.generate(tcam, state)
+    fuzzer = fuzz.Fuzzer(tcam, state, seeds, seed=1)
+    self.assertTrue(covered <= fuzzer.coverage)
+    fuzzer.run(300)
+    # Truncated headers make reads go beyond the end of the packet
+    self.assertTrue(fuzzer.findings)
+    for signature, finding in fuzzer.findings.items():
+      self.assertEqual(signature[0], "RuntimeError")
+      self.assertIn(signature[1:] + ("RuntimeError",), fuzzer.coverage)
+      self.assertIn("beyond end of packet", finding.message)
+      self.assertLessEqual(finding.minimized.length, finding.packet.length)
+      self.assertEqual(
+          fuzzer.run_packet(finding.minimized).signature, signature
+      )
+    self.assertGreater(len(fuzzer.corpus), len(seeds))
+
+  def test_crash(self):
+    state = config_parser.parse_config(CONFIG)
+    tcam = [
+        [test_util.rule("0x**", {test_util.copy("packet[0:7]", "state[0:7]")})],
+        [
+            # There is no such store, which makes the interpreter raise a
+            # KeyError rather than a RuntimeError
+            test_util.rule(
+                "0xa*", {test_util.copy("packet[8:15]", "missing[0:7]")}
+            ),
+            test_util.rule("0x**", set()),
+        ],
+    ]
+    fuzzer = fuzz.Fuzzer(tcam, state, [d.Data("0x0000")], seed=0)
+    fuzzer.run(2000)
+    # The signature and the coverage name the rule that failed
+    self.assertIn(("KeyError", 1, 0), fuzzer.findings)
+    self.assertIn((1, 0, "KeyError"), fuzzer.coverage)
+    finding = fuzzer.findings[("KeyError", 1, 0)]
+    # Only the top bits of the first byte matter, but the packet has to be
+    # long enough to hold both bytes read
+    self.assertEqual(finding.minimized, d.Data("0xa000"))
+    self.assertEqual(fuzz.format_packet(finding.minimized), "0xa000")
+    self.assertEqual(fuzz.format_packet(d.Data("0b101")), "0b101")
+
+  def test_deterministic(self):
+    tcam = ir_parser.parse_ir(IR_FILE, True)
+    state = config_parser.parse(CONFIG_FILE, True)
+    corpora = []
+    for _ in range(2):
+      fuzzer = fuzz.Fuzzer(tcam, state, [], seed=3)
+      fuzzer.run(100)
+      corpora.append(fuzzer.corpus)
+    self.assertEqual(corpora[0], corpora[1])
+
+  def test_main(self):
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(
+        stderr
+    ):
+      fuzz.main(
+          ["--ir", IR_FILE, "--config", CONFIG_FILE, "--iterations", "100"]
+      )
+    self.assertIn("reproducer: 0x", stdout.getvalue())
+    self.assertIn("executions", stderr.getvalue())
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -19,48 +19,264 @@ TCAM state machine, and simulate its behavior according to the state machine's
 semantics.
 """
 
-from typing import cast
+import array
+from collections.abc import Sequence
+import dataclasses
+import functools
+import weakref
+from typing import Protocol, cast
 from interpreter import config_parser
 from interpreter import ir_parser
 import interpreter.datatypes as d
 
 
-def read_location(
+def check_packet_read(
     loc: d.Location, state: d.MachineState, packet: d.Data
-) -> d.Data:
-  """Read a designated range of bits from the packet or state."""
-  if loc.name == "packet":
-    if (state.cursor + loc.end + 1) > packet.length:
-      raise RuntimeError(
-          "Attempt to read %s in stage %s goes beyond end of packet. Current"
-          " cursor value is %s, packet length is %s."
-          % (loc, state.stage, state.cursor, packet.length)
-      )
-    src = cast(d.Data, packet[state.cursor :])
-  else:
-    store = state.stores[loc.name]
-    if not store.read:
-      raise RuntimeError(
-          "Attempt to read %s failed: %s is not readable." % (loc, loc.name)
+) -> None:
+  """Ensure a location in the packet lies before the end of the packet."""
+  if (state.cursor + loc.end + 1) > packet.length:
+    raise RuntimeError(
+        "Attempt to read %s in stage %s goes beyond end of packet. Current"
+        " cursor value is %s, packet length is %s."
+        % (loc, state.stage, state.cursor, packet.length)
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def location_mask(width: int, loc: d.Location) -> tuple[int, int]:
+  """Return the shift and mask that select a location in a store's value.
+
+  The bits of the location are (value & mask) >> shift.
+  """
+  shift = width - 1 - loc.end
+  return shift, ((1 << loc.length) - 1) << shift
+
+
+def packet_reads(exp: d.IntExp) -> list[d.Location]:
+  """The packet locations with constant bounds read by an expression."""
+  e = exp.exp
+  if isinstance(e, d.SizedInt):
+    return []
+  if isinstance(e, d.LocationExp):
+    reads = packet_reads(e.start) + packet_reads(e.end)
+    loc = constant_location(e)
+    if loc is not None and loc.name == "packet":
+      reads.append(loc)
+    return reads
+  return packet_reads(e.left) + packet_reads(e.right)
+
+
+def store_reads(exp: d.IntExp | d.LocationExp) -> set[str]:
+  """The names of the stores an expression reads."""
+  if isinstance(exp, d.LocationExp):
+    names = store_reads(exp.start) | store_reads(exp.end)
+    if exp.name != "packet":
+      names.add(exp.name)
+    return names
+  e = exp.exp
+  if isinstance(e, d.SizedInt):
+    return set()
+  if isinstance(e, d.LocationExp):
+    return store_reads(e)
+  return store_reads(e.left) | store_reads(e.right)
+
+
+@dataclasses.dataclass(frozen=True)
+class RulePlan:
+  """What the interpreter precomputes about a rule's actions."""
+
+  others: tuple[d.Action, ...]  # The actions other than moves
+  moves: tuple[d.Action, ...]  # Applied after the others
+  # The constant packet locations the actions read, merged into spans
+  spans: tuple[tuple[int, int], ...]
+  # The stores that one action reads and another one writes
+  snapshot: frozenset[str]
+  # Whether the actions need a StageReads (to snapshot stores, or because a
+  # span covers several reads)
+  shared: bool
+  # The rule_lookahead of the actions
+  lookahead: int | None
+
+
+def make_plan(actions: set[d.Action]) -> RulePlan:
+  others = []
+  moves = []
+  locs = []
+  reads = []
+  writes = []
+  for action in actions:
+    if action.action_type == d.ActionType.MOVECURSOR:
+      moves.append(action)
+      locs += packet_reads(action.action_args)
+      reads.append(store_reads(action.action_args))
+      writes.append(None)
+    elif action.action_type == d.ActionType.EXTRACTHEADER:
+      others.append(action)
+      loc = action.action_args[1]
+      reads.append(store_reads(loc.start) | store_reads(loc.end))
+      writes.append(None)
+    else:
+      others.append(action)
+      src, dst = action.action_args
+      locs += packet_reads(src)
+      reads.append(
+          store_reads(src) | store_reads(dst.start) | store_reads(dst.end)
       )
-    src = store.value
+      writes.append(dst.name)
+  snapshot = frozenset(
+      name
+      for i, names in enumerate(reads)
+      for name in names
+      if any(w == name for j, w in enumerate(writes) if j != i)
+  )
+  # Merge overlapping locations into spans
+  spans = []
+  for loc in sorted(locs, key=lambda loc: loc.start):
+    if spans and loc.start <= spans[-1][1]:
+      spans[-1] = (spans[-1][0], max(spans[-1][1], loc.end))
+    else:
+      spans.append((loc.start, loc.end))
+  return RulePlan(
+      tuple(others),
+      tuple(moves),
+      tuple(spans),
+      snapshot,
+      bool(snapshot) or len(spans) < len(locs),
+      rule_lookahead(actions),
+  )
+
+
+# Map from the id of a rule's action set to a weak reference to the set and its
+# plan. Entries are removed when their action set is garbage collected, so ids
+# are never reused while an entry exists.
+_plans: dict[int, tuple[weakref.ref, RulePlan]] = {}
+
+
+def _forget_plan(key: int, ref: weakref.ref) -> None:
+  entry = _plans.get(key)
+  if entry is not None and entry[0] is ref:
+    del _plans[key]
+
+
+def rule_plan(actions: set[d.Action]) -> RulePlan:
+  """Return the plan of a rule's actions, computing it on first use.
+
+  Plans are cached per action set, so a rule's action set must not be changed
+  once it has been run (RuntimeTable replaces action sets rather than changing
+  them).
+  """
+  key = id(actions)
+  entry = _plans.get(key)
+  if entry is not None and entry[0]() is actions:
+    return entry[1]
+  plan = make_plan(actions)
+  ref = weakref.ref(actions, lambda ref: _forget_plan(key, ref))
+  _plans[key] = (ref, plan)
+  return plan
+
+
+def plan_rules(tcam: d.TCAM) -> None:
+  """Compute the plan of every rule of a TCAM, e.g. when it's loaded."""
+  for table in tcam:
+    for _, actions in table:
+      rule_plan(actions)
+
+
+class StageReads:
+  """The reads made by the actions of a single stage.
+
+  The stages of the machine are atomic, so every read in a stage sees the
+  state from before the stage. We snapshot the stores that the stage both
+  reads and writes when it starts, and read each part of the packet at most
+  once: each read inside one of the rule's spans is served from the span's
+  value.
+  """
 
-  if loc.length > src.length:
+  def __init__(self, plan: RulePlan, state: d.MachineState):
+    self.cursor = state.cursor
+    self.stores = {name: state.stores[name].value for name in plan.snapshot}
+    self.spans = plan.spans
+    # Map from span (or uncovered location) to its value
+    self.values: dict[tuple[int, int], int] = {}
+
+  def read_packet(self, loc: d.Location, packet: d.Data) -> int:
+    """Read a location of the packet, which is known to be in bounds."""
+    span = (loc.start, loc.end)
+    for start, end in self.spans:
+      if start <= loc.start and loc.end <= end:
+        # Spans that run past the end of the packet can't be read whole.
+        if self.cursor + end < packet.length:
+          span = (start, end)
+        break
+    value = self.values.get(span)
+    if value is None:
+      start = self.cursor + span[0]
+      value = packet[start : self.cursor + span[1] + 1].uint
+      self.values[span] = value
+    return (value >> (span[1] - loc.end)) & ((1 << loc.length) - 1)
+
+
+def read_uint(
+    loc: d.Location,
+    state: d.MachineState,
+    packet: d.Data,
+    reads: StageReads | None = None,
+    checked: bool = True,
+) -> int:
+  """Read a designated range of bits from the packet or state, as an int.
+
+  If reads is given, the read sees the state from the start of the stage. If
+  checked is False, packet reads are known to lie within the packet.
+  """
+  if loc.name == "packet":
+    if checked:
+      check_packet_read(loc, state, packet)
+    if reads is not None and reads.cursor == state.cursor:
+      return reads.read_packet(loc, packet)
+    # Slice directly rather than copying the rest of the packet first
+    start = state.cursor + loc.start
+    return packet[start : start + loc.length].uint
+
+  store = state.stores[loc.name]
+  if not store.read:
+    raise RuntimeError(
+        "Attempt to read %s failed: %s is not readable." % (loc, loc.name)
+    )
+  if loc.end >= store.width:
     raise RuntimeError(
         "Attempt to read %s failed: %s only has %s bits!"
-        % (loc, loc.name, src.length)
+        % (loc, loc.name, store.width)
     )
+  shift, mask = location_mask(store.width, loc)
+  value = store.value
+  if reads is not None:
+    value = reads.stores.get(loc.name, value)
+  return (value & mask) >> shift
 
-  # Cast to satisfy the type system; this will always return a d.Data
-  return cast(d.Data, src[loc.start : loc.end + 1])
+
+def read_location(
+    loc: d.Location,
+    state: d.MachineState,
+    packet: d.Data,
+    reads: StageReads | None = None,
+    checked: bool = True,
+) -> d.Data:
+  """Read a designated range of bits from the packet or state."""
+  return d.Data(
+      uint=read_uint(loc, state, packet, reads, checked), length=loc.length
+  )
 
 
 def evaluate_op(
-    e: d.ArithExp, state: d.MachineState, packet: d.Data
+    e: d.ArithExp,
+    state: d.MachineState,
+    packet: d.Data,
+    reads: StageReads | None = None,
+    checked: bool = True,
 ) -> d.SizedInt:
   """Evaluate an arithmetic operation."""
-  left = evaluate_intexp(e.left, state, packet)
-  right = evaluate_intexp(e.right, state, packet)
+  left = evaluate_intexp(e.left, state, packet, reads, checked)
+  right = evaluate_intexp(e.right, state, packet, reads, checked)
   if e.op == d.ArithOp.CAST:
     return d.SizedInt(value=right.value, width=left.value)
   elif e.op == d.ArithOp.PLUS:
@@ -77,11 +293,15 @@ def evaluate_op(
 
 
 def evaluate_locexp(
-    locexp: d.LocationExp, state: d.MachineState, packet: d.Data
+    locexp: d.LocationExp,
+    state: d.MachineState,
+    packet: d.Data,
+    reads: StageReads | None = None,
+    checked: bool = True,
 ) -> d.Location:
   """Evaluate a location expression, returning a location value."""
-  start = evaluate_intexp(locexp.start, state, packet).value
-  end = evaluate_intexp(locexp.end, state, packet).value
+  start = evaluate_intexp(locexp.start, state, packet, reads, checked).value
+  end = evaluate_intexp(locexp.end, state, packet, reads, checked).value
   if start < 0:
     raise RuntimeError(
         "Location expression %s has negative start position %s! How did you do"
@@ -95,20 +315,36 @@ def evaluate_locexp(
   return d.Location(locexp.name, start, end)
 
 
+def constant_location(locexp: d.LocationExp) -> d.Location | None:
+  """Return the location a location expression always evaluates to, if any."""
+  start = locexp.start.exp
+  end = locexp.end.exp
+  if not isinstance(start, d.SizedInt) or not isinstance(end, d.SizedInt):
+    return None
+  if start.value > end.value:
+    return None  # Evaluating it raises an error
+  return d.Location(locexp.name, start.value, end.value)
+
+
 def evaluate_intexp(
-    intexp: d.IntExp, state: d.MachineState, packet: d.Data
+    intexp: d.IntExp,
+    state: d.MachineState,
+    packet: d.Data,
+    reads: StageReads | None = None,
+    checked: bool = True,
 ) -> d.SizedInt:
   """Evaluate an d.IntExp in the current state, returning an int."""
   if isinstance(intexp.exp, d.SizedInt):
     return intexp.exp
 
   elif isinstance(intexp.exp, d.LocationExp):
-    loc = evaluate_locexp(intexp.exp, state, packet)
-    value = read_location(loc, state, packet).uint
-    return d.SizedInt(value, loc.length)
+    loc = evaluate_locexp(intexp.exp, state, packet, reads, checked)
+    return d.SizedInt(
+        read_uint(loc, state, packet, reads, checked), loc.length
+    )
 
   else:  # isinstance(intexp.exp, d.ArithExp)
-    return evaluate_op(intexp.exp, state, packet)
+    return evaluate_op(intexp.exp, state, packet, reads, checked)
 
 
 def match_pattern(pat: d.Pattern, key: d.Data) -> bool:
@@ -118,10 +354,14 @@ def match_pattern(pat: d.Pattern, key: d.Data) -> bool:
 
 
 def apply_move(
-    num_bits: d.IntExp, state: d.MachineState, packet: d.Data
+    num_bits: d.IntExp,
+    state: d.MachineState,
+    packet: d.Data,
+    reads: StageReads | None = None,
+    checked: bool = True,
 ) -> None:
-  num_bits = evaluate_intexp(num_bits, state, packet)
-  if (state.cursor + num_bits.value) > packet.length:
+  num_bits = evaluate_intexp(num_bits, state, packet, reads, checked)
+  if checked and (state.cursor + num_bits.value) > packet.length:
     raise RuntimeError(
         "Attempt to move cursor %s bits in stage %s goes beyond end of packet."
         " Current cursor value is %s, packet length is %s."
@@ -131,7 +371,12 @@ def apply_move(
 
 
 def apply_extract(
-    name: str, loc: d.LocationExp, state: d.MachineState, packet: d.Data
+    name: str,
+    loc: d.LocationExp,
+    state: d.MachineState,
+    packet: d.Data,
+    reads: StageReads | None = None,
+    checked: bool = True,
 ) -> None:
   """Extract a header from the packet."""
   error_prefix = "Error while attempting to extract header %s: " % name
@@ -143,8 +388,11 @@ def apply_extract(
     raise RuntimeError(
         error_prefix + "a header with this name was already extracted."
     )
-  loc = evaluate_locexp(loc, state, packet)
-  state.headers[name] = read_location(loc, state, packet)
+  loc = evaluate_locexp(loc, state, packet, reads, checked)
+  if checked:
+    check_packet_read(loc, state, packet)
+  # Rather than copying the header's bits, record where they are.
+  state.headers.record(name, packet, state.cursor + loc.start, loc.length)
 
 
 def apply_copy(
@@ -152,11 +400,12 @@ def apply_copy(
     dstloc: d.LocationExp,
     state: d.MachineState,
     packet: d.Data,
+    reads: StageReads | None = None,
+    checked: bool = True,
 ) -> None:
   """Copy data from the value from the destination location."""
-  value = evaluate_intexp(value_exp, state, packet)
-  value_as_data = d.Data(uint=value.value, length=value.width)
-  dstloc = evaluate_locexp(dstloc, state, packet)
+  value = evaluate_intexp(value_exp, state, packet, reads, checked)
+  dstloc = evaluate_locexp(dstloc, state, packet, reads, checked)
 
   error_prefix = "Error copying %s to %s: " % (value_exp, dstloc)
 
@@ -165,11 +414,11 @@ def apply_copy(
     raise RuntimeError(error_prefix + "cannot write to packet.")
 
   # Ensure the destination location has the same length as the value
-  if value_as_data.length != dstloc.length:
+  if value.width != dstloc.length:
     raise RuntimeError(
         error_prefix
         + "value has length %s, while destination has length %s."
-        % (value_as_data.length, dstloc.length)
+        % (value.width, dstloc.length)
     )
 
   # Get the appropriate data store, if it exists
@@ -182,78 +431,252 @@ def apply_copy(
   if not dst.write:
     raise RuntimeError(error_prefix + "destination is not writeable.")
   # Check that the specified location actually fits in the store
-  if dstloc.end >= dst.value.length:
+  if dstloc.end >= dst.width:
     raise RuntimeError(
         error_prefix
         + "write ends at bit %s, but store %s only has %s bits!"
-        % (dstloc.end, dstloc.name, dst.value.length)
+        % (dstloc.end, dstloc.name, dst.width)
     )
 
+  shift, mask = location_mask(dst.width, dstloc)
   if not dst.masked_writes:
-    dst.value[:] = [0] * len(dst.value)
-  dst.value[dstloc.start : dstloc.end + 1] = value_as_data
+    dst.value = value.value << shift
+    state.invalidate_keys(dstloc.name)
+  else:
+    dst.value = (dst.value & ~mask) | (value.value << shift)
+    state.invalidate_keys(dstloc.name, dstloc.start, dstloc.end)
 
 
 def apply_action(
-    action: d.Action, state: d.MachineState, packet: d.Data
+    action: d.Action,
+    state: d.MachineState,
+    packet: d.Data,
+    reads: StageReads | None = None,
+    checked: bool = True,
 ) -> None:
   """Modify the machine state by applying a single action."""
   if action.action_type == d.ActionType.MOVECURSOR:
     num_bits = cast(d.IntExp, action.action_args)
-    apply_move(num_bits, state, packet)
+    apply_move(num_bits, state, packet, reads, checked)
 
   if action.action_type == d.ActionType.EXTRACTHEADER:
     name, loc = cast(tuple[str, d.LocationExp], action.action_args)
-    apply_extract(name, loc, state, packet)
+    apply_extract(name, loc, state, packet, reads, checked)
 
   if action.action_type == d.ActionType.COPYDATA:
     value_exp, dstloc = cast(tuple[d.IntExp, d.LocationExp], action.action_args)
-    apply_copy(value_exp, dstloc, state, packet)
+    apply_copy(value_exp, dstloc, state, packet, reads, checked)
 
 
-def table_match(table: d.Table, state: d.MachineState) -> set[d.Action]:
-  """Perform a TCAM match using the current key values."""
-  keys = [
-      cast(d.Data, state.stores[loc.name].value[loc.start : loc.end + 1])
-      for loc in state.keys
-  ]
+class DynamicRead(Exception):
+  """Raised by packet_lookahead for packet reads without constant bounds."""
+
+
+def packet_lookahead(exp: d.IntExp | d.LocationExp, read: bool = True) -> int:
+  """The number of packet bits past the cursor that an expression reads.
+
+  If read is False, a location expression is written rather than read (so
+  only its bounds are evaluated).
+
+  Raises:
+    DynamicRead: if it reads the packet at an offset that isn't constant.
+  """
+  if isinstance(exp, d.LocationExp):
+    ahead = max(packet_lookahead(exp.start), packet_lookahead(exp.end))
+    if read and exp.name == "packet":
+      loc = constant_location(exp)
+      if loc is None:
+        raise DynamicRead()
+      ahead = max(ahead, loc.end + 1)
+    return ahead
+  e = exp.exp
+  if isinstance(e, d.SizedInt):
+    return 0
+  if isinstance(e, d.LocationExp):
+    return packet_lookahead(e)
+  return max(packet_lookahead(e.left), packet_lookahead(e.right))
+
+
+def rule_lookahead(actions: set[d.Action]) -> int | None:
+  """The number of packet bits past the cursor that a rule's actions need.
+
+  If the packet holds this many bits past the cursor when the rule fires, none
+  of its packet reads, extractions or constant moves can go beyond the end of
+  the packet. Returns None if that can't be known before the rule fires: when
+  it reads the packet at a dynamic offset, or moves the cursor more than once
+  (so later reads are relative to a cursor that has already moved).
+  """
+  moves = 0
+  ahead = 0
+  try:
+    for action in actions:
+      if action.action_type == d.ActionType.MOVECURSOR:
+        moves += 1
+        num_bits = cast(d.IntExp, action.action_args)
+        ahead = max(ahead, packet_lookahead(num_bits))
+        if isinstance(num_bits.exp, d.SizedInt):
+          ahead = max(ahead, num_bits.exp.value)
+      elif action.action_type == d.ActionType.EXTRACTHEADER:
+        ahead = max(ahead, packet_lookahead(action.action_args[1]))
+      elif action.action_type == d.ActionType.COPYDATA:
+        value_exp, dstloc = action.action_args
+        ahead = max(
+            ahead,
+            packet_lookahead(value_exp),
+            packet_lookahead(dstloc, read=False),
+        )
+  except DynamicRead:
+    return None
+  if moves > 1:
+    return None
+  return ahead
+
+
+def key_values(state: d.MachineState) -> list[int]:
+  """Return the current value of each key, re-reading only the stale ones."""
+  values = state.key_values
+  for i, value in enumerate(values):
+    if value is None:
+      loc = state.keys[i]
+      store = state.stores[loc.name]
+      shift, mask = location_mask(store.width, loc)
+      values[i] = (store.value & mask) >> shift
+  return cast(list[int], values)
+
+
+def scan_table(table: d.Table, keys: list[int]) -> int | None:
+  """Return the index of the first rule in the table matching the keys."""
   # Note that we're matching rules left-to-right in the list, and we return
   # the first match we find.
-  for rule in table:
-    # Extract list of patterns, one pattern per key
-    patterns = rule[0]
-    # Match each pattern against the associated key
-    match = [match_pattern(pat, keys[i]) for i, pat in enumerate(patterns)]
-    # If all patterns match, the rule as a whole matches. Return its action set.
-    if all(match):
-      return rule[1]
-  return set()
-
-
-def interp_step(tcam: d.TCAM, state: d.MachineState, packet: d.Data) -> None:
-  """Run the interpreter for one "step"; in this case, that means one TCAM stage."""
-  if state.stage >= len(tcam):
+  for idx, rule in enumerate(table):
+    # Match each pattern against the associated key. If all patterns match, the
+    # rule as a whole matches.
+    for pat, key in zip(rule[0], keys):
+      if (key ^ pat.value_int) & pat.mask_int:
+        break
+    else:
+      return idx
+  return None
+
+
+class Matcher(Protocol):
+  """A precomputed index over a table, replacing the linear scan."""
+
+  def lookup(self, keys: list[int]) -> int | None:
+    """Return the index of the first rule matching the keys (if any)."""
+    ...
+
+
+class Tracer(Protocol):
+  """Receives a record of each stage the interpreter executes."""
+
+  def start_packet(self) -> bool:
+    """Called before each packet. Returns whether to trace the packet."""
+    ...
+
+  def record(
+      self,
+      stage: int,
+      rule: int | None,
+      actions: set[d.Action],
+      cursor_before: int,
+      cursor_after: int,
+      failed: bool = False,
+  ) -> None:
+    """Record the execution of a stage, including ones that raised errors."""
+    ...
+
+
+def table_lookup(
+    table: d.Table, state: d.MachineState, matcher: Matcher | None = None
+) -> int | None:
+  """Perform a TCAM match, returning the index of the matching rule (if any)."""
+  if matcher is not None:
+    return matcher.lookup(key_values(state))
+  return scan_table(table, key_values(state))
+
+
+def table_match(table: d.Table, state: d.MachineState) -> set[d.Action]:
+  """Perform a TCAM match using the current key values."""
+  idx = table_lookup(table, state)
+  if idx is None:
+    return set()
+  return table[idx][1]
+
+
+def apply_actions(
+    actions: set[d.Action],
+    state: d.MachineState,
+    packet: d.Data,
+) -> None:
+  """Apply the actions of the rule matched in the current stage.
+
+  When the packet holds the rule's lookahead, a single check replaces the
+  bounds check of each packet read. Otherwise, every read is checked, so that
+  the error names the read at fault.
+  """
+  if not actions:
     return
-  table = tcam[state.stage]
-  actions = table_match(table, state)
+  plan = rule_plan(actions)
+  # All the actions read the state from before the stage. Only the stores that
+  # another action of the stage writes need to be snapshot.
+  reads = StageReads(plan, state) if plan.shared else None
+  checked = (
+      plan.lookahead is None or state.cursor + plan.lookahead > packet.length
+  )
   # Make sure that we process move actions last, since they're the only ones
   # whose side effects affect other actions.
-  move_actions = filter(
-      lambda action: action.action_type == d.ActionType.MOVECURSOR, actions
-  )
-  other_actions = filter(
-      lambda action: action.action_type != d.ActionType.MOVECURSOR, actions
-  )
-  for action in other_actions:
-    apply_action(action, state, packet)
-  for action in move_actions:
-    apply_action(action, state, packet)
+  for action in plan.others:
+    apply_action(action, state, packet, reads, checked)
+  for action in plan.moves:
+    # The lookahead doesn't cover moves by a dynamic number of bits
+    constant = isinstance(action.action_args.exp, d.SizedInt)
+    apply_action(action, state, packet, reads, checked or not constant)
+
+
+def interp_step(
+    tcam: d.TCAM,
+    state: d.MachineState,
+    packet: d.Data,
+    matchers: Sequence[Matcher] | None = None,
+    tracer: Tracer | None = None,
+) -> None:
+  """Run the interpreter for one "step", i.e. one TCAM stage.
+
+  If matchers is given, it holds a matcher for each table, which is used
+  instead of scanning the table's rules. If tracer is given, the step is
+  recorded with it.
+  """
+  if state.stage >= len(tcam):
+    return
+  table = tcam[state.stage]
+  matcher = None if matchers is None else matchers[state.stage]
+  idx = table_lookup(table, state, matcher)
+  actions = set() if idx is None else table[idx][1]
+  if tracer is None:
+    apply_actions(actions, state, packet)
+  else:
+    cursor = state.cursor
+    try:
+      apply_actions(actions, state, packet)
+    except Exception:
+      tracer.record(state.stage, idx, actions, cursor, state.cursor, True)
+      raise
+    tracer.record(state.stage, idx, actions, cursor, state.cursor)
   state.stage += 1
 
 
-def interp_tcam(tcam: d.TCAM, state: d.MachineState, packet: d.Data) -> None:
+def interp_tcam(
+    tcam: d.TCAM,
+    state: d.MachineState,
+    packet: d.Data,
+    matchers: Sequence[Matcher] | None = None,
+    tracer: Tracer | None = None,
+) -> None:
+  if tracer is not None and not tracer.start_packet():
+    tracer = None
   while state.stage < len(tcam):
-    interp_step(tcam, state, packet)
+    interp_step(tcam, state, packet, matchers, tracer)
 
 
 # Ensure that the keys specified in the machine state match the patterns of the
@@ -274,13 +697,57 @@ def validate_keys_patterns(tcam: d.TCAM, state: d.MachineState) -> None:
       )
 
 
-def interp(ir_file: str, config_file: str, packet_value: str) -> d.MachineState:
+def copy_state(state: d.MachineState) -> d.MachineState:
+  """Return a copy of a state that shares nothing mutable with the original.
+
+  Useful for running many packets from a single parsed configuration.
+  """
+  copy = d.MachineState(
+      cursor=state.cursor,
+      stage=state.stage,
+      stores={
+          name: dataclasses.replace(store)
+          for name, store in state.stores.items()
+      },
+      keys=state.keys,
+      headers=state.headers.copy(),
+  )
+  copy.key_values = list(state.key_values)
+  return copy
+
+
+def header_offsets(
+    states: Sequence[d.MachineState],
+) -> dict[str, tuple[array.array, array.array]]:
+  """Export where each header lies in each packet of a batch, without copying.
+
+  Returns a map from header name to two columns: the offset (in bits) of the
+  header in each packet, and its length. Both are -1 for packets in which the
+  header was not extracted.
+  """
+  columns = {}
+  for i, state in enumerate(states):
+    for name, (offset, length) in state.headers.refs().items():
+      if name not in columns:
+        columns[name] = (
+            array.array("q", [-1]) * len(states),
+            array.array("q", [-1]) * len(states),
+        )
+      columns[name][0][i] = offset
+      columns[name][1][i] = length
+  return columns
+
+
+def interp(
+    ir_file: str, config_file: str, packet_value: str, lazy_ir: bool = False
+) -> d.MachineState:
   """Parse commandline arguments and start the interpreter.
 
   Args:
     ir_file: path to a json file holding the ir program
     config_file: path to a json file holding the hardware configuration
     packet_value: binary or hex string representing an integer.
+    lazy_ir: if True, only parse the tables the packet actually reaches.
 
   Returns:
     The final machine state of the interpreter.
@@ -288,7 +755,13 @@ def interp(ir_file: str, config_file: str, packet_value: str) -> d.MachineState:
   # Cast inexplicably necessary to satisfy type system
   packet = cast(d.Data, d.Data(packet_value))
   state = config_parser.parse(config_file, True)
+  if lazy_ir:
+    with ir_parser.parse_ir_lazy(ir_file) as tcam:
+      validate_keys_patterns(tcam, state)
+      interp_tcam(tcam, state, packet)
+    return state
   tcam = ir_parser.parse_ir(ir_file, True)
   validate_keys_patterns(tcam, state)
+  plan_rules(tcam)
   interp_tcam(tcam, state, packet)
   return state
@@ -25,14 +25,12 @@ def fresh_state():
       cursor=0,
       stage=0,
       stores={
-          "r0": d.DataStore(d.Data("0x0000"), True, True, False, False),
-          "r1": d.DataStore(d.Data("0x0000"), True, True, False, False),
-          "r2": d.DataStore(d.Data("0x0000"), True, True, False, False),
-          "flags": d.DataStore(d.Data("0x000faaaa"), True, True, False, True),
-          "state": d.DataStore(d.Data("0x000f0000"), False, True, False, False),
-          "metadata": d.DataStore(
-              d.Data("0x0f0faaaa"), True, False, False, False
-          ),
+          "r0": d.DataStore(0x0000, 16, True, True, False, False),
+          "r1": d.DataStore(0x0000, 16, True, True, False, False),
+          "r2": d.DataStore(0x0000, 16, True, True, False, False),
+          "flags": d.DataStore(0x000FAAAA, 32, True, True, False, True),
+          "state": d.DataStore(0x000F0000, 32, False, True, False, False),
+          "metadata": d.DataStore(0x0F0FAAAA, 32, True, False, False, False),
       },
       keys=[
           d.Location("r0", 0, 15),
@@ -263,6 +261,9 @@ class ActionTest(unittest.TestCase):
     extract(packet, state, name="h3", source="packet", start=1, end=4)
 
     self.assertEqual(state.headers["h3"], d.Data("0b0011"))
+    # Headers are recorded as references into the packet
+    self.assertEqual(state.headers.ref("h3"), (6, 4))
+    self.assertIs(state.headers.packet, packet)
 
     self.assertRaises(  # Extract from non-packet source
         RuntimeError,
@@ -286,6 +287,28 @@ class ActionTest(unittest.TestCase):
         end=1,
     )
 
+  def test_header_offsets(self):
+    states = [fresh_state() for _ in range(3)]
+    extract(packet, states[0], name="h1", source="packet", start=0, end=7)
+    move(packet, states[2], 8)
+    extract(packet, states[2], name="h1", source="packet", start=4, end=7)
+    extract(packet, states[2], name="h2", source="packet", start=0, end=15)
+    states[2].headers["h3"] = d.Data("0x12")  # Not a reference
+    offsets = interp.header_offsets(states)
+    self.assertEqual(
+        {name: (list(o), list(l)) for name, (o, l) in offsets.items()},
+        {
+            "h1": ([0, -1, 12], [8, -1, 4]),
+            "h2": ([-1, -1, 8], [-1, -1, 16]),
+        },
+    )
+
+    # Copies keep references, and materialize the same values
+    copied = interp.copy_state(states[2])
+    self.assertEqual(copied.headers.refs(), states[2].headers.refs())
+    self.assertEqual(copied.headers, states[2].headers)
+    self.assertEqual(copied.headers["h1"], d.Data("0x0"))
+
   def test_copy(self):
     state = fresh_state()
     copy(
@@ -310,9 +333,9 @@ class ActionTest(unittest.TestCase):
         const_locexp("r2", 0, 7),
     )
 
-    self.assertEqual(state.stores["r0"].value, d.Data("0xF0F0"))
-    self.assertEqual(state.stores["r1"].value, d.Data("0x0F0F"))
-    self.assertEqual(state.stores["r2"].value, d.Data("0xFF00"))
+    self.assertEqual(state.stores["r0"].data(), d.Data("0xF0F0"))
+    self.assertEqual(state.stores["r1"].data(), d.Data("0x0F0F"))
+    self.assertEqual(state.stores["r2"].data(), d.Data("0xFF00"))
     copy(
         packet,
         state,
@@ -320,7 +343,7 @@ class ActionTest(unittest.TestCase):
         const_locexp("state", 16, 23),
     )
 
-    self.assertEqual(state.stores["state"].value, d.Data("0x00000F00"))
+    self.assertEqual(state.stores["state"].data(), d.Data("0x00000F00"))
 
   def test_copy_bad(self):
     state = fresh_state()
@@ -428,31 +451,181 @@ class InterpTest(unittest.TestCase):
     """Test matching against the dummy table defined above."""
 
     state = fresh_state()
-    state.stores["r0"].value[:] = 1
+    state.stores["r0"].value = 1
     # Should match the first rule
     interp.interp_step([stage1], state, packet)
     self.assertEqual(state.headers["h1"], d.Data("0x0"))
     self.assertEqual(state.headers["h2"], d.Data("0xf0"))
-    self.assertEqual(state.stores["state"].value, d.Data("0x00f00000"))
+    self.assertEqual(state.stores["state"].data(), d.Data("0x00f00000"))
     self.assertEqual(state.cursor, 16)
 
     state = fresh_state()
-    state.stores["r1"].value[:] = 2
+    state.stores["r1"].value = 2
     # Should match the second rule
     interp.interp_step([stage1], state, packet)
     self.assertEqual(state.headers["h1"], d.Data("0xf"))
     self.assertNotIn("h2", state.headers)
-    self.assertEqual(state.stores["flags"].value, d.Data("0xf00faaaa"))
+    self.assertEqual(state.stores["flags"].data(), d.Data("0xf00faaaa"))
     self.assertEqual(state.cursor, 4)
 
     state = fresh_state()
     # Should match neither rule
     interp.interp_step([stage1], state, packet)
     self.assertEqual(len(state.headers), 0)
-    self.assertEqual(state.stores["state"].value, d.Data("0x000f0000"))
-    self.assertEqual(state.stores["flags"].value, d.Data("0x000faaaa"))
+    self.assertEqual(state.stores["state"].data(), d.Data("0x000f0000"))
+    self.assertEqual(state.stores["flags"].data(), d.Data("0x000faaaa"))
     self.assertEqual(state.cursor, 0)
 
+  def test_key_cache(self):
+    state = fresh_state()
+    self.assertEqual(interp.key_values(state), [0, 0, 0x000F00])
+
+    # Writes to a store only invalidate the keys that lie in it
+    def copy(src, dst):
+      interp.apply_copy(
+          d.IntExp(const_locexp("packet", *src)),
+          const_locexp(*dst),
+          state,
+          packet,
+      )
+
+    copy((0, 15), ("r1", 0, 15))
+    self.assertEqual(state.key_values, [0, None, 0x000F00])
+    copy((0, 15), ("r2", 0, 15))
+    self.assertEqual(state.key_values, [0, None, 0x000F00])
+    self.assertEqual(interp.key_values(state), [0, 0xF0F0, 0x000F00])
+
+    # Masked writes only invalidate the keys they overlap
+    state = d.MachineState(
+        cursor=0,
+        stage=0,
+        stores={
+            "flags": d.DataStore(0x0000, 16, True, True, False, True),
+        },
+        keys=[d.Location("flags", 0, 7), d.Location("flags", 8, 15)],
+        headers={},
+    )
+    self.assertEqual(interp.key_values(state), [0, 0])
+    copy((0, 3), ("flags", 4, 7))
+    self.assertEqual(state.key_values, [None, 0])
+    self.assertEqual(interp.key_values(state), [0x0F, 0])
+
+    # Direct modifications must invalidate the keys themselves
+    state.stores["flags"].value = 1
+    self.assertEqual(interp.key_values(state), [0x0F, 0])
+    state.invalidate_keys()
+    self.assertEqual(interp.key_values(state), [0, 1])
+
+  def test_stage_reads(self):
+    def copy(src, dst):
+      args = (d.IntExp(const_locexp(*src)), const_locexp(*dst))
+      return d.Action(d.ActionType.COPYDATA, args)
+
+    actions = {
+        copy(("packet", 0, 15), ("r0", 0, 15)),
+        copy(("packet", 8, 23), ("r1", 0, 15)),
+        copy(("packet", 72, 79), ("flags", 0, 7)),
+        # Past the end of the packet, so never read whole
+        copy(("packet", 76, 95), ("r2", 0, 19)),
+    }
+    plan = interp.rule_plan(actions)
+    self.assertIs(interp.rule_plan(actions), plan)
+    self.assertEqual(plan.spans, ((0, 23), (72, 95)))
+    # No action reads a store
+    self.assertEqual(plan.snapshot, frozenset())
+    state = fresh_state()
+    reads = interp.StageReads(plan, state)
+    for start, end in [(0, 15), (8, 23), (72, 79), (4, 11)]:
+      loc = d.Location("packet", start, end)
+      self.assertEqual(
+          interp.read_uint(loc, state, packet, reads),
+          interp.read_uint(loc, state, packet),
+      )
+
+    # Every action sees the stores as they were before the stage
+    actions = {
+        copy(("packet", 0, 15), ("r0", 0, 15)),
+        copy(("r0", 0, 15), ("r1", 0, 15)),
+    }
+    self.assertEqual(interp.rule_plan(actions).snapshot, {"r0"})
+    state = fresh_state()
+    interp.apply_actions(actions, state, packet)
+    self.assertEqual(state.stores["r0"].value, 0xF0F0)
+    self.assertEqual(state.stores["r1"].value, 0)
+
+  def test_rule_lookahead(self):
+    def copy(src, dst):
+      return d.Action(d.ActionType.COPYDATA, (d.IntExp(src), dst))
+
+    def move_by(num_bits):
+      return d.Action(d.ActionType.MOVECURSOR, num_bits)
+
+    read_16 = copy(const_locexp("packet", 8, 15), const_locexp("r0", 0, 7))
+    extract_32 = d.Action(
+        d.ActionType.EXTRACTHEADER, ("h1", const_locexp("packet", 0, 31))
+    )
+    move_48 = move_by(d.IntExp(d.SizedInt(48, 32)))
+    move_r0 = move_by(d.IntExp(const_locexp("r0", 0, 7)))
+    dynamic = d.LocationExp(
+        "packet",
+        d.IntExp(const_locexp("r0", 0, 3)),
+        d.IntExp(d.SizedInt(15, 32)),
+    )
+    self.assertEqual(interp.rule_lookahead(set()), 0)
+    self.assertEqual(interp.rule_lookahead({read_16}), 16)
+    self.assertEqual(interp.rule_lookahead({read_16, extract_32}), 32)
+    self.assertEqual(interp.rule_lookahead({read_16, move_48}), 48)
+    # Moves by a dynamic number of bits are checked when they happen
+    self.assertEqual(interp.rule_lookahead({read_16, move_r0}), 16)
+    # Dynamic packet offsets, and more than one move, can't be bounded
+    self.assertIsNone(
+        interp.rule_lookahead({copy(dynamic, const_locexp("r1", 0, 11))})
+    )
+    self.assertIsNone(interp.rule_lookahead({move_48, move_r0}))
+
+  def test_lookahead_errors(self):
+    """Rules applied with a lookahead behave exactly like checked ones."""
+    actions = {
+        d.Action(
+            d.ActionType.COPYDATA,
+            (
+                d.IntExp(const_locexp("packet", 8, 23)),
+                const_locexp("r0", 0, 15),
+            ),
+        ),
+        d.Action(
+            d.ActionType.EXTRACTHEADER, ("h1", const_locexp("packet", 0, 7))
+        ),
+        d.Action(d.ActionType.MOVECURSOR, d.IntExp(d.SizedInt(16, 32))),
+    }
+    plan = interp.rule_plan(actions)
+    self.assertEqual(plan.lookahead, 24)
+
+    def apply_checked(state):
+      reads = interp.StageReads(plan, state)
+      for action in plan.others + plan.moves:
+        interp.apply_action(action, state, packet, reads)
+
+    def apply_guarded(state):
+      interp.apply_actions(actions, state, packet)
+
+    for cursor in range(0, packet.length + 1, 4):
+      checked = fresh_state()
+      guarded = fresh_state()
+      checked.cursor = guarded.cursor = cursor
+      errors = []
+      for state, apply in ((checked, apply_checked), (guarded, apply_guarded)):
+        try:
+          apply(state)
+          errors.append(None)
+        except RuntimeError as e:
+          errors.append(str(e))
+      self.assertEqual(errors[0], errors[1])
+      self.assertEqual(checked.cursor, guarded.cursor)
+      self.assertEqual(checked.stores, guarded.stores)
+      self.assertEqual(checked.headers, guarded.headers)
+    self.assertIsNotNone(errors[0])
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -20,8 +20,11 @@ dedicated to validating the json; the parsing is relatively straightforward.
 
 
 from collections.abc import Mapping, Sequence
+import concurrent.futures
 import json
+import mmap
 import re
+import threading
 from typing import cast
 
 import interpreter.datatypes as d
@@ -37,6 +40,9 @@ hex_char_exp = re.compile(r"[0-9a-fA-F]")
 # Either '0b' followed by a string of bits, some of which may be '*', or
 # '0x' followed by a string of hex digits, some of which may be '*'
 pattern_exp = re.compile(r"^(0b[01*]+|0x[0-9a-fA-F*]+)$")
+# Either a complete json string (so that brackets inside strings are skipped),
+# or one of the structural characters that change the nesting depth.
+json_token_exp = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}]')
 
 
 # Check if an object is a sequence of strings, since
@@ -258,3 +264,289 @@ def parse_ir(jsn: str, from_file: bool) -> d.TCAM:
   tcam = parse_tcam(content)
   validate_tcam(tcam)
   return tcam
+
+
+# Parallel loading: rules are parsed independently of each other, so we split
+# the tables into chunks of rules and parse the chunks in worker processes.
+
+
+def parse_rule_chunk(
+    table_idx: int, first_rule_idx: int, rules: Sequence[object]
+) -> list[d.Rule]:
+  """Parse a contiguous run of rules from one table.
+
+  Not all errors raised by parse_rule say which rule they come from, which is
+  hard to work out once the error has crossed a process boundary, so we add
+  the coordinates here when they are missing.
+  """
+  parsed = []
+  for i, rule in enumerate(rules):
+    error_prefix = "Error parsing rule %s in table %s: " % (
+        first_rule_idx + i,
+        table_idx,
+    )
+    try:
+      parsed.append(parse_rule(table_idx, first_rule_idx + i, rule))
+    except ParseError as e:
+      if str(e).startswith(error_prefix):
+        raise
+      raise ParseError(error_prefix + str(e)) from e
+  return parsed
+
+
+def parse_tcam_parallel(
+    tcam: object, jobs: int | None = None, chunk_size: int = 1024
+) -> d.TCAM:
+  """Like parse_tcam, but spreads the work across jobs worker processes.
+
+  The result is identical to parse_tcam's. If several rules are malformed, the
+  error reported is the one parse_tcam would report, i.e. the first in file
+  order.
+  """
+  if not isinstance(tcam, Sequence):
+    raise ParseError("Each TCAM is expected to be a list of tables.")
+  tcam = cast(Sequence[object], tcam)
+  for table in tcam:
+    if not isinstance(table, Sequence):
+      raise ParseError(
+          "Error parsing table %s: Each table is expected to be a list of"
+          " rules." % table
+      )
+  chunks = [
+      (table_idx, start, table[start : start + chunk_size])
+      for table_idx, table in enumerate(cast(Sequence[Sequence[object]], tcam))
+      for start in range(0, len(table), chunk_size)
+  ]
+  if jobs == 1 or len(chunks) <= 1:
+    results = [parse_rule_chunk(*chunk) for chunk in chunks]
+  else:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+      # map yields results (and raises errors) in submission order, which
+      # keeps the merge below deterministic.
+      results = list(pool.map(parse_rule_chunk, *zip(*chunks)))
+
+  tables: d.TCAM = [[] for _ in tcam]
+  for (table_idx, _, _), rules in zip(chunks, results):
+    tables[table_idx].extend(rules)
+  return tables
+
+
+def parse_ir_parallel(
+    jsn: str, from_file: bool, jobs: int | None = None, chunk_size: int = 1024
+) -> d.TCAM:
+  """Like parse_ir, but parses rules in jobs worker processes.
+
+  Args:
+    jsn: path to a json file holding the ir program, or the program itself
+    from_file: whether jsn is a path or the program itself
+    jobs: number of worker processes. Defaults to the number of cores.
+    chunk_size: number of rules handed to a worker at a time.
+
+  Returns:
+    The parsed TCAM.
+  """
+  if from_file:
+    with open(jsn) as f:
+      content = json.load(f)
+  else:
+    content = json.loads(jsn)
+  tcam = parse_tcam_parallel(content, jobs, chunk_size)
+  validate_tcam(tcam)
+  return tcam
+
+
+# Lazy loading: rather than decoding the whole file up front, we scan it once to
+# find the byte range of each table, and only decode and parse a table when it
+# is first accessed.
+
+
+def index_tables(buf: bytes | mmap.mmap) -> list[tuple[int, int]]:
+  """Return the [start, end) byte range of each table in a json IR file.
+
+  Only the nesting structure of the file is examined here; the contents of
+  each table are validated when it is parsed.
+  """
+  spans = []
+  depth = 0
+  table_start = 0
+  top_level_end = None
+  for token in json_token_exp.finditer(buf):
+    char = token.group()
+    if top_level_end is not None:
+      raise ParseError("Unexpected data after the end of the TCAM.")
+    if depth == 0 and char != b"[":
+      raise ParseError("Each TCAM is expected to be a list of tables.")
+    if depth == 1 and char != b"[" and char != b"]":
+      raise ParseError(
+          "Error parsing table %s: Each table is expected to be a list of"
+          " rules." % len(spans)
+      )
+    if char in (b"[", b"{"):
+      depth += 1
+      if depth == 2:
+        table_start = token.start()
+    elif char.startswith(b'"'):
+      continue
+    else:
+      depth -= 1
+      if depth == 1:
+        spans.append((table_start, token.end()))
+      elif depth == 0:
+        top_level_end = token.end()
+  if top_level_end is None:
+    raise ParseError("Each TCAM is expected to be a list of tables.")
+
+  # Anything between the tables other than commas (e.g. a bare number) would
+  # be silently dropped above, so check the gaps explicitly.
+  boundaries = [buf.find(b"[")] + [b for span in spans for b in span]
+  boundaries.append(top_level_end - 1)
+  for i in range(0, len(boundaries), 2):
+    gap = bytes(buf[boundaries[i] + (i == 0) : boundaries[i + 1]]).strip()
+    expected = b"" if i in (0, len(boundaries) - 2) else b","
+    if gap != expected:
+      raise ParseError(
+          "Error parsing table %s: Each table is expected to be a list of"
+          " rules." % (i // 2)
+      )
+  if bytes(buf[:boundaries[0]]).strip() or bytes(buf[top_level_end:]).strip():
+    raise ParseError("Unexpected data outside of the TCAM.")
+  return spans
+
+
+class LazyTCAM(Sequence[d.Table]):
+  """A TCAM whose tables are parsed on first access.
+
+  The file is memory-mapped and indexed when the object is created, so opening
+  a large IR file costs one pass over its bytes rather than a full json decode.
+  Each table is decoded, parsed and shape-checked the first time it is
+  accessed, which for the interpreter means the first time a packet reaches
+  that stage. The first table is always parsed eagerly, since its first rule
+  defines the shape that every other rule must have (see validate_tcam).
+  """
+
+  def __init__(self, path: str):
+    self._file = open(path, "rb")
+    try:
+      self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError as e:  # Raised when mapping an empty file
+      self._file.close()
+      raise ParseError("IR file %s is empty." % path) from e
+    self._lock = threading.RLock()
+    self._validator = None
+    self._validation_error = None
+    try:
+      self._spans = index_tables(self._buf)
+      self._tables: list[d.Table | None] = [None] * len(self._spans)
+      self._shape = None
+      if self._spans:
+        self._materialize(0)
+    except Exception:
+      self.close()
+      raise
+
+  def __len__(self) -> int:
+    return len(self._spans)
+
+  def __getitem__(self, idx):
+    if isinstance(idx, slice):
+      return [self[i] for i in range(*idx.indices(len(self)))]
+    if idx < 0:
+      idx += len(self)
+    if not 0 <= idx < len(self):
+      raise IndexError("TCAM index %s out of range." % idx)
+    if self._validation_error is not None:
+      raise self._validation_error
+    table = self._tables[idx]
+    if table is None:
+      table = self._materialize(idx)
+    return table
+
+  @property
+  def num_materialized(self) -> int:
+    """The number of tables that have been parsed so far."""
+    return sum(table is not None for table in self._tables)
+
+  def _materialize(self, idx: int) -> d.Table:
+    with self._lock:
+      table = self._tables[idx]
+      if table is not None:  # Parsed by another thread while we waited
+        return table
+      start, end = self._spans[idx]
+      try:
+        content = json.loads(self._buf[start:end])
+      except json.JSONDecodeError as e:
+        raise ParseError(
+            "Error parsing table %s: invalid json (%s)." % (idx, e)
+        ) from e
+      table = parse_table(idx, content)
+      if self._shape is None:
+        if not table:
+          raise ParseError("The first table must contain at least one rule.")
+        self._shape = [p.value.length for p in table[0][0]]
+      self._validate_table(table)
+      self._tables[idx] = table
+      return table
+
+  def _validate_table(self, table: d.Table) -> None:
+    # Same check as validate_tcam, applied to one table at a time.
+    for rule in table:
+      shape = [p.value.length for p in rule[0]]
+      if shape != self._shape:
+        raise ParseError(
+            "All patterns must have the same 'shape'. The following pattern has"
+            " a different shape from the first pattern in the table: "
+            + str(rule[0])
+        )
+
+  def start_background_validation(self) -> None:
+    """Parse and validate all remaining tables in a background thread.
+
+    Any error found (including unexpected ones) is re-raised by the next table
+    access, or by wait_for_validation.
+    """
+
+    def validate_all():
+      try:
+        for i in range(len(self)):
+          self[i]
+      except Exception as e:  # pylint: disable=broad-except
+        self._validation_error = e
+
+    if self._validator is None:
+      self._validator = threading.Thread(target=validate_all, daemon=True)
+      self._validator.start()
+
+  def wait_for_validation(self) -> None:
+    """Block until every table has been parsed and validated."""
+    if self._validator is None:
+      self.start_background_validation()
+    self._validator.join()
+    if self._validation_error is not None:
+      raise self._validation_error
+
+  def close(self) -> None:
+    self._buf.close()
+    self._file.close()
+
+  def __enter__(self) -> "LazyTCAM":
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.close()
+
+
+def parse_ir_lazy(path: str, background_validation: bool = False) -> LazyTCAM:
+  """Open an IR file without parsing its tables up front.
+
+  Args:
+    path: path to a json file holding the ir program
+    background_validation: if True, parse and validate the remaining tables in
+      a background thread rather than only when they are accessed.
+
+  Returns:
+    A LazyTCAM, which can be used anywhere a d.TCAM is expected.
+  """
+  tcam = LazyTCAM(path)
+  if background_validation:
+    tcam.start_background_validation()
+  return tcam
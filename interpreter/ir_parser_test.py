@@ -14,11 +14,33 @@
 
 """Tests for the IR Parser."""
 
+import json
+import os
+import tempfile
 import unittest
+from unittest import mock
 from interpreter import ir_parser
 import interpreter.datatypes as d
 
 
+def write_temp_file(test: unittest.TestCase, content: str) -> str:
+  """Write content to a temporary file that is removed after the test."""
+  fd, path = tempfile.mkstemp(suffix=".json")
+  with os.fdopen(fd, "w") as f:
+    f.write(content)
+  test.addCleanup(os.remove, path)
+  return path
+
+
+def mk_rule(table: int, rule: int, patterns: list[str]) -> dict[str, object]:
+  return {
+      "table": table,
+      "rule": rule,
+      "patterns": patterns,
+      "actions": [{"type": "MoveCursor", "numbits": "8"}],
+  }
+
+
 class IrParserTest(unittest.TestCase):
 
   def test_pattern(self):
@@ -454,6 +476,99 @@ class IrParserTest(unittest.TestCase):
         },
     )
 
+  def test_lazy(self):
+    ir_file = "interpreter/test_files/simple_ip_parser.json"
+    expected = ir_parser.parse_ir(ir_file, True)
+    with ir_parser.parse_ir_lazy(ir_file) as tcam:
+      self.assertEqual(len(tcam), len(expected))
+      # Only the first table is parsed up front
+      self.assertEqual(tcam.num_materialized, 1)
+      self.assertEqual(tcam[2], expected[2])
+      self.assertEqual(tcam.num_materialized, 2)
+      self.assertEqual(tcam[-1], expected[-1])
+      self.assertEqual(list(tcam), expected)
+
+    # Brackets inside strings don't confuse the index
+    tricky = [[{**mk_rule(0, 0, ["0x**"]), "comment": "[{\"]}"}], []]
+    path = write_temp_file(self, json.dumps(tricky))
+    with ir_parser.parse_ir_lazy(path) as tcam:
+      self.assertEqual(len(tcam), 2)
+      self.assertEqual(tcam[1], [])
+
+  def test_lazy_errors(self):
+    # Rule with the wrong shape is only detected once its table is reached
+    mismatch = [[mk_rule(0, 0, ["0x**"])], [mk_rule(1, 0, ["0x***"])]]
+    path = write_temp_file(self, json.dumps(mismatch))
+    with ir_parser.parse_ir_lazy(path) as tcam:
+      self.assertRaises(ir_parser.ParseError, tcam.__getitem__, 1)
+    with ir_parser.parse_ir_lazy(path) as tcam:
+      self.assertRaises(ir_parser.ParseError, tcam.wait_for_validation)
+
+    # Rule annotations are still checked
+    misnumbered = [[mk_rule(0, 0, ["0x**"])], [mk_rule(1, 1, ["0x**"])]]
+    path = write_temp_file(self, json.dumps(misnumbered))
+    with ir_parser.parse_ir_lazy(path) as tcam:
+      with self.assertRaisesRegex(ir_parser.ParseError, "rule 0 in table 1"):
+        tcam[1]
+
+    # Malformed json inside a later table
+    table = json.dumps([mk_rule(0, 0, ["0x**"])])
+    path = write_temp_file(self, "[%s, [1,,2]]" % table)
+    with ir_parser.parse_ir_lazy(path) as tcam:
+      with self.assertRaisesRegex(ir_parser.ParseError, "table 1"):
+        tcam[1]
+    with ir_parser.parse_ir_lazy(path, background_validation=True) as tcam:
+      with self.assertRaisesRegex(ir_parser.ParseError, "table 1"):
+        tcam.wait_for_validation()
+      self.assertRaises(ir_parser.ParseError, tcam.__getitem__, 0)
+
+    # Malformed top-level structure
+    table = json.dumps([mk_rule(0, 0, ["0x**"])])
+    malformed = ["{}", "[%s, 7]", "[%s, {}]", "[%s] []", '[%s, "a"]', "[]]", ""]
+    close = ir_parser.LazyTCAM.close
+    for content in malformed + ["[[1,,2]]"]:
+      path = write_temp_file(self, content.replace("%s", table))
+      # The file is closed when opening it fails
+      with mock.patch.object(
+          ir_parser.LazyTCAM, "close", autospec=True, side_effect=close
+      ) as mock_close:
+        self.assertRaises(ir_parser.ParseError, ir_parser.parse_ir_lazy, path)
+      self.assertEqual(mock_close.call_count, 1 if content else 0)
+
+  def test_parallel(self):
+    ir_file = "interpreter/test_files/simple_ip_parser.json"
+    self.assertEqual(
+        ir_parser.parse_ir_parallel(ir_file, True, jobs=2, chunk_size=1),
+        ir_parser.parse_ir(ir_file, True),
+    )
+
+    tcam = [[mk_rule(t, r, ["0x**"]) for r in range(10)] for t in range(3)]
+    self.assertEqual(
+        ir_parser.parse_ir_parallel(json.dumps(tcam), False, chunk_size=3),
+        ir_parser.parse_ir(json.dumps(tcam), False),
+    )
+
+    # Errors keep their coordinates, and the first error in file order wins
+    tcam[1][7]["patterns"] = ["0xkj"]
+    tcam[2][4]["rule"] = 5
+    with self.assertRaisesRegex(
+        ir_parser.ParseError, "rule 7 in table 1.*0xkj"
+    ):
+      ir_parser.parse_ir_parallel(json.dumps(tcam), False, chunk_size=3)
+    tcam[1][7]["patterns"] = ["0x**"]
+    with self.assertRaisesRegex(ir_parser.ParseError, "rule 4 in table 2"):
+      ir_parser.parse_ir_parallel(json.dumps(tcam), False, chunk_size=3)
+
+    # Shape validation still runs on the merged result
+    tcam[2][4]["rule"] = 4
+    tcam[2][9]["patterns"] = ["0x***"]
+    self.assertRaises(
+        ir_parser.ParseError,
+        ir_parser.parse_ir_parallel,
+        json.dumps(tcam),
+        False,
+    )
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,116 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Write a TCAM datatype back out as a json IR file.
+
+This is the inverse of ir_parser: parsing the output of write_ir produces the
+same TCAM that was written.
+"""
+
+import json
+
+import interpreter.datatypes as d
+
+op_symbols = {
+    d.ArithOp.PLUS: "+",
+    d.ArithOp.MINUS: "-",
+    d.ArithOp.LSHIFT: "<<",
+    d.ArithOp.RSHIFT: ">>",
+}
+
+
+def format_pattern(pat: d.Pattern) -> str:
+  """Format a pattern in hex if possible, and in binary otherwise."""
+  value = pat.value.bin
+  mask = pat.mask.bin
+  if len(value) % 4 == 0:
+    digits = []
+    for i in range(0, len(value), 4):
+      nibble_mask = mask[i : i + 4]
+      if nibble_mask == "1111":
+        digits.append("%x" % int(value[i : i + 4], 2))
+      elif nibble_mask == "0000":
+        digits.append("*")
+      else:
+        break
+    else:
+      return "0x" + "".join(digits)
+  return "0b" + "".join(v if m == "1" else "*" for v, m in zip(value, mask))
+
+
+def format_intexp(exp: d.IntExp) -> str:
+  e = exp.exp
+  if isinstance(e, d.SizedInt):
+    return "%sw%s" % (e.value, e.width)
+  if isinstance(e, d.LocationExp):
+    return format_locexp(e)
+  if e.op == d.ArithOp.CAST:
+    width = e.left.exp
+    assert isinstance(width, d.SizedInt)
+    return "((w%s) %s)" % (width.value, format_intexp(e.right))
+  return "(%s %s %s)" % (
+      format_intexp(e.left),
+      op_symbols[e.op],
+      format_intexp(e.right),
+  )
+
+
+def format_locexp(exp: d.LocationExp) -> str:
+  return "%s[%s:%s]" % (
+      exp.name,
+      format_intexp(exp.start),
+      format_intexp(exp.end),
+  )
+
+
+def format_action(action: d.Action) -> dict[str, str]:
+  if action.action_type == d.ActionType.MOVECURSOR:
+    return {"type": "MoveCursor", "numbits": format_intexp(action.action_args)}
+  if action.action_type == d.ActionType.COPYDATA:
+    src, dst = action.action_args
+    return {
+        "type": "CopyData",
+        "src": format_intexp(src),
+        "dst": format_locexp(dst),
+    }
+  name, loc = action.action_args
+  return {"type": "ExtractHeader", "id": name, "loc": format_locexp(loc)}
+
+
+def format_rule(
+    table_idx: int, rule_idx: int, rule: d.Rule
+) -> dict[str, object]:
+  patterns, actions = rule
+  formatted_actions = [format_action(a) for a in actions]
+  # Sort so that the output doesn't depend on set iteration order
+  formatted_actions.sort(key=lambda a: json.dumps(a, sort_keys=True))
+  return {
+      "table": table_idx,
+      "rule": rule_idx,
+      "patterns": [format_pattern(p) for p in patterns],
+      "actions": formatted_actions,
+  }
+
+
+def format_tcam(tcam: d.TCAM) -> list[list[dict[str, object]]]:
+  return [
+      [format_rule(i, j, rule) for j, rule in enumerate(table)]
+      for i, table in enumerate(tcam)
+  ]
+
+
+def write_ir(tcam: d.TCAM, path: str) -> None:
+  with open(path, "w") as f:
+    json.dump(format_tcam(tcam), f, indent=2)
+    f.write("\n")
@@ -0,0 +1,63 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the IR writer."""
+
+import os
+import tempfile
+import unittest
+from interpreter import ir_parser
+from interpreter import ir_writer
+import interpreter.datatypes as d
+
+
+class IrWriterTest(unittest.TestCase):
+
+  def test_pattern(self):
+    for pat in ["0x0a9f", "0x*a*f", "0b0*1*", "0b101", "0x**", "0b1"]:
+      self.assertEqual(
+          ir_writer.format_pattern(ir_parser.parse_pattern(pat)), pat
+      )
+    # Partially masked nibbles fall back to binary
+    self.assertEqual(
+        ir_writer.format_pattern(d.Pattern(d.Data("0xa5"), d.Data("0xf3"))),
+        "0b1010**01",
+    )
+
+  def test_expressions(self):
+    for exp in [
+        "7w16",
+        "packet[13:22]",
+        "r1[packet[0:3]:(r1[0:3] + 4w4)]",
+        "(w8) (packet[0:3] << 2) - 1w8",
+        "(1 + 2) >> ((w4) r1[0:7])",
+        "1 - (2 - 3)",
+    ]:
+      parsed = ir_parser.parse_intexp(exp)
+      self.assertEqual(
+          ir_parser.parse_intexp(ir_writer.format_intexp(parsed)), parsed
+      )
+
+  def test_round_trip(self):
+    fd, path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    self.addCleanup(os.remove, path)
+    for filename in ["simple_ip_parser.json", "small_ir.json"]:
+      tcam = ir_parser.parse_ir("interpreter/test_files/" + filename, True)
+      ir_writer.write_ir(tcam, path)
+      self.assertEqual(ir_parser.parse_ir(path, True), tcam)
+
+
+if __name__ == "__main__":
+  unittest.main()
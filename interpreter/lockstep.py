@@ -0,0 +1,411 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A batch interpreter that runs many packets through each stage together.
+
+The state of every packet in the batch is held in NumPy arrays: a cursor and
+stage per packet, a column per store, and an offset and length column per
+extracted header. The batch then advances one stage at a time:
+
+1. The keys of every packet are read from the store columns at once. Packets
+   with the same keys match the same rule, so the table is only searched once
+   per distinct set of keys.
+2. The packets are grouped by the rule they matched, and each rule's actions
+   are applied to its whole group with array operations.
+
+Actions are only vectorized when that is known to give the same result as
+interp.apply_actions: their packet and store locations must have constant
+bounds and fit in 64 bits, and they must not raise errors that can be detected
+without a packet (e.g. writing to a read-only store). Packets for which an
+action would raise an error, and groups whose rule can't be vectorized, are
+instead materialized as MachineStates and run through interp.apply_actions, so
+that errors (and their messages) are exactly those of the interpreter.
+Configurations with stores wider than 64 bits are interpreted one packet at a
+time.
+
+This module requires numpy.
+"""
+
+from collections.abc import Sequence
+import dataclasses
+import time
+
+import numpy
+
+from interpreter import interp
+import interpreter.datatypes as d
+
+# Values of up to 64 bits are held as uint64s
+MAX_WIDTH = 64
+
+
+class Unsupported(Exception):
+  """Raised when an action can't be vectorized."""
+
+
+def low_mask(width: int) -> numpy.uint64:
+  return numpy.uint64((1 << width) - 1)
+
+
+@dataclasses.dataclass
+class Batch:
+  """The state of each packet of a batch, as columns.
+
+  Packets that raised an error keep the state they had when the error was
+  raised (as interp_tcam leaves it), and have their error message in errors.
+  """
+
+  packets: list[d.Data]
+  cursor: numpy.ndarray
+  stage: numpy.ndarray
+  stores: dict[str, numpy.ndarray]
+  # Map from header name to the offset and length columns of the header, which
+  # are -1 for packets that haven't extracted it.
+  headers: dict[str, tuple[numpy.ndarray, numpy.ndarray]]
+  errors: list[str | None]
+
+  def __len__(self) -> int:
+    return len(self.packets)
+
+  def header_columns(self, name: str) -> tuple[numpy.ndarray, numpy.ndarray]:
+    if name not in self.headers:
+      self.headers[name] = (
+          numpy.full(len(self), -1, dtype=numpy.int64),
+          numpy.full(len(self), -1, dtype=numpy.int64),
+      )
+    return self.headers[name]
+
+  def state(self, idx: int, initial: d.MachineState) -> d.MachineState:
+    """The state of a packet, as a MachineState of initial's configuration."""
+    state = interp.copy_state(initial)
+    state.cursor = int(self.cursor[idx])
+    state.stage = int(self.stage[idx])
+    for name, column in self.stores.items():
+      state.stores[name].value = int(column[idx])
+    state.invalidate_keys()
+    for name, (offsets, lengths) in self.headers.items():
+      if offsets[idx] >= 0:
+        state.headers.record(
+            name, self.packets[idx], int(offsets[idx]), int(lengths[idx])
+        )
+    return state
+
+  def set_state(self, idx: int, state: d.MachineState) -> None:
+    """Write a packet's MachineState back into the columns."""
+    self.cursor[idx] = state.cursor
+    self.stage[idx] = state.stage
+    for name, column in self.stores.items():
+      column[idx] = state.stores[name].value
+    for name, (offset, length) in state.headers.refs().items():
+      offsets, lengths = self.header_columns(name)
+      offsets[idx] = offset
+      lengths[idx] = length
+
+
+def packet_matrix(packets: Sequence[d.Data]) -> numpy.ndarray:
+  """The bytes of each packet as a row, zero-padded so any 64-bit read fits."""
+  num_bytes = max((p.length for p in packets), default=0) // 8 + 1
+  matrix = numpy.zeros((len(packets), num_bytes + 9), dtype=numpy.uint8)
+  for i, packet in enumerate(packets):
+    row = numpy.frombuffer(packet.tobytes(), dtype=numpy.uint8)
+    matrix[i, : len(row)] = row
+  return matrix
+
+
+class StageContext:
+  """The pre-stage state of the group of packets matching one rule."""
+
+  def __init__(
+      self,
+      batch: Batch,
+      matrix: numpy.ndarray,
+      lengths: numpy.ndarray,
+      rows: numpy.ndarray,
+      state: d.MachineState,
+  ):
+    self.matrix = matrix
+    self.rows = rows
+    self.lengths = lengths[rows]
+    self.cursor = batch.cursor[rows]
+    self.stores = {name: column[rows] for name, column in batch.stores.items()}
+    self.config = state.stores
+    # Packets for which some action raises an error
+    self.failed = numpy.zeros(len(rows), dtype=bool)
+
+  def read_packet(self, loc: d.Location) -> numpy.ndarray:
+    """Read a location relative to each packet's cursor."""
+    self.failed |= self.cursor + loc.end + 1 > self.lengths
+    # Clip reads of failed packets, whose values are never used
+    pos = numpy.minimum(self.cursor + loc.start, self.lengths)
+    first = pos // 8
+    window = self.matrix[
+        self.rows[:, None], first[:, None] + numpy.arange(9)
+    ]
+    word = window[:, :8].copy().view(">u8").reshape(-1).astype(numpy.uint64)
+    offset = (pos % 8).astype(numpy.uint64)
+    # The 64 bits starting at pos
+    bits = (word << offset) | (
+        window[:, 8].astype(numpy.uint64) >> (numpy.uint64(8) - offset)
+    )
+    return bits >> numpy.uint64(MAX_WIDTH - loc.length)
+
+  def read(self, loc: d.Location) -> numpy.ndarray:
+    if loc.length > MAX_WIDTH:
+      raise Unsupported()
+    if loc.name == "packet":
+      return self.read_packet(loc)
+    store = self.config.get(loc.name)
+    if store is None or not store.read or loc.end >= store.width:
+      raise Unsupported()  # Always an error
+    shift, mask = interp.location_mask(store.width, loc)
+    return (self.stores[loc.name] & numpy.uint64(mask)) >> numpy.uint64(shift)
+
+  def evaluate(self, exp: d.IntExp) -> tuple[numpy.ndarray, int]:
+    """Evaluate an expression for every packet, returning values and width."""
+    e = exp.exp
+    if isinstance(e, d.SizedInt):
+      if e.width > MAX_WIDTH:
+        raise Unsupported()
+      return numpy.full(len(self.cursor), e.value, dtype=numpy.uint64), e.width
+    if isinstance(e, d.LocationExp):
+      loc = interp.constant_location(e)
+      if loc is None:
+        raise Unsupported()
+      return self.read(loc), loc.length
+    left, left_width = self.evaluate(e.left)
+    right, right_width = self.evaluate(e.right)
+    if e.op == d.ArithOp.CAST:
+      if not isinstance(e.left.exp, d.SizedInt):
+        raise Unsupported()
+      width = e.left.exp.value
+      if not 0 < width <= MAX_WIDTH:
+        raise Unsupported()
+      return right & low_mask(width), width
+    if e.op in (d.ArithOp.PLUS, d.ArithOp.MINUS):
+      if left_width != right_width:
+        raise Unsupported()  # Always an error
+      if e.op == d.ArithOp.PLUS:
+        result = left + right
+      else:
+        result = left - right
+      return result & low_mask(left_width), left_width
+    # Shifts by at least the width leave no bits
+    in_range = right < numpy.uint64(left_width)
+    amount = numpy.minimum(right, numpy.uint64(MAX_WIDTH - 1))
+    if e.op == d.ArithOp.LSHIFT:
+      result = (left << amount) & low_mask(left_width)
+    else:
+      result = left >> amount
+    return numpy.where(in_range, result, numpy.uint64(0)), left_width
+
+
+def check_rule(actions: set[d.Action], state: d.MachineState) -> None:
+  """Raise Unsupported unless the actions can be vectorized.
+
+  Expressions are checked as they are evaluated; this checks the parts of the
+  actions that aren't expressions.
+  """
+  moves = [a for a in actions if a.action_type == d.ActionType.MOVECURSOR]
+  if len(moves) > 1 and any(
+      not isinstance(a.action_args.exp, d.SizedInt) for a in moves
+  ):
+    # Reads by later moves see the cursor moved by earlier ones
+    raise Unsupported()
+  extracted = set()
+  for action in actions:
+    if action.action_type == d.ActionType.EXTRACTHEADER:
+      name, locexp = action.action_args
+      if name in extracted or locexp.name != "packet":
+        raise Unsupported()
+      extracted.add(name)
+      if interp.constant_location(locexp) is None:
+        raise Unsupported()
+    elif action.action_type == d.ActionType.COPYDATA:
+      dst = interp.constant_location(action.action_args[1])
+      if dst is None:
+        raise Unsupported()
+      store = state.stores.get(dst.name)
+      if store is None or not store.write or dst.end >= store.width:
+        raise Unsupported()
+
+
+def apply_group(
+    batch: Batch,
+    ctx: StageContext,
+    rows: numpy.ndarray,
+    actions: set[d.Action],
+    state: d.MachineState,
+) -> numpy.ndarray:
+  """Apply a rule's actions to the packets in rows.
+
+  Returns the rows for which the actions raise an error, which are left
+  unchanged.
+  """
+  check_rule(actions, state)
+  copies = []
+  extracts = []
+  moved = numpy.zeros(len(rows), dtype=numpy.int64)
+  # All the reads of a stage see the state from before the stage, so evaluate
+  # everything before writing anything.
+  for action in actions:
+    if action.action_type == d.ActionType.COPYDATA:
+      src, dst = action.action_args
+      value, width = ctx.evaluate(src)
+      loc = interp.constant_location(dst)
+      if width != loc.length:
+        raise Unsupported()  # Always an error
+      copies.append((loc, value))
+    elif action.action_type == d.ActionType.EXTRACTHEADER:
+      name, locexp = action.action_args
+      loc = interp.constant_location(locexp)
+      ctx.failed |= ctx.cursor + loc.end + 1 > ctx.lengths
+      ctx.failed |= batch.header_columns(name)[0][rows] >= 0
+      extracts.append((name, loc))
+    else:
+      value, _ = ctx.evaluate(action.action_args)
+      # Moves longer than the packet always fail, and may not fit an int64
+      too_long = value > ctx.lengths.astype(numpy.uint64)
+      ctx.failed |= too_long
+      moved += numpy.where(too_long, 0, value).astype(numpy.int64)
+  ctx.failed |= ctx.cursor + moved > ctx.lengths
+  ok = ~ctx.failed
+  ok_rows = rows[ok]
+  for loc, value in copies:
+    store = state.stores[loc.name]
+    shift, mask = interp.location_mask(store.width, loc)
+    column = batch.stores[loc.name]
+    value = value[ok] << numpy.uint64(shift)
+    if store.masked_writes:
+      keep = numpy.uint64(((1 << store.width) - 1) ^ mask)
+      value |= column[ok_rows] & keep
+    column[ok_rows] = value
+  for name, loc in extracts:
+    offsets, lengths = batch.header_columns(name)
+    offsets[ok_rows] = ctx.cursor[ok] + loc.start
+    lengths[ok_rows] = loc.length
+  batch.cursor[ok_rows] += moved[ok]
+  return rows[ctx.failed]
+
+
+def apply_scalar(
+    batch: Batch,
+    rows: numpy.ndarray,
+    actions: set[d.Action],
+    state: d.MachineState,
+) -> None:
+  """Apply a rule's actions to each packet with the interpreter."""
+  for idx in rows:
+    packet_state = batch.state(idx, state)
+    try:
+      interp.apply_actions(actions, packet_state, batch.packets[idx])
+    except RuntimeError as e:
+      batch.errors[idx] = str(e)
+    batch.set_state(idx, packet_state)
+
+
+def lookup(
+    table: d.Table,
+    batch: Batch,
+    rows: numpy.ndarray,
+    state: d.MachineState,
+    matcher: interp.Matcher | None,
+) -> numpy.ndarray:
+  """The index of the rule each packet matches, or -1 for no match."""
+  columns = []
+  for loc in state.keys:
+    shift, mask = interp.location_mask(state.stores[loc.name].width, loc)
+    column = batch.stores[loc.name][rows]
+    columns.append((column & numpy.uint64(mask)) >> numpy.uint64(shift))
+  if not columns:
+    idx = interp.scan_table(table, [])
+    return numpy.full(len(rows), -1 if idx is None else idx)
+  keys = numpy.stack(columns, axis=1)
+  distinct, inverse = numpy.unique(keys, axis=0, return_inverse=True)
+  matches = numpy.empty(len(distinct), dtype=numpy.int64)
+  for i, row in enumerate(distinct):
+    key = [int(k) for k in row]
+    if matcher is not None:
+      idx = matcher.lookup(key)
+    else:
+      idx = interp.scan_table(table, key)
+    matches[i] = -1 if idx is None else idx
+  return matches[inverse.reshape(-1)]
+
+
+def interp_batch(
+    tcam: d.TCAM,
+    state: d.MachineState,
+    packets: Sequence[d.Data],
+    matchers: Sequence[interp.Matcher] | None = None,
+    stage_times: list[float] | None = None,
+) -> Batch:
+  """Interpret every packet from the initial state, one stage at a time.
+
+  The results are the same as running interp.interp_tcam on a copy of state
+  for each packet. If stage_times is given, the time (in seconds) spent on
+  each stage is added to its entry, which must exist.
+  """
+  vectorize = len(state.headers) == 0 and all(
+      store.width <= MAX_WIDTH for store in state.stores.values()
+  )
+  n = len(packets)
+  dtype = numpy.uint64 if vectorize else object
+  batch = Batch(
+      packets=list(packets),
+      cursor=numpy.full(n, state.cursor, dtype=numpy.int64),
+      stage=numpy.full(n, state.stage, dtype=numpy.int64),
+      stores={
+          name: numpy.full(n, store.value, dtype=dtype)
+          for name, store in state.stores.items()
+      },
+      headers={},
+      errors=[None] * n,
+  )
+  if not vectorize:
+    for idx, packet in enumerate(packets):
+      packet_state = interp.copy_state(state)
+      try:
+        interp.interp_tcam(tcam, packet_state, packet, matchers)
+      except RuntimeError as e:
+        batch.errors[idx] = str(e)
+      batch.set_state(idx, packet_state)
+    return batch
+
+  matrix = packet_matrix(packets)
+  lengths = numpy.array([p.length for p in packets], dtype=numpy.int64)
+  active = numpy.arange(n)
+  for stage in range(state.stage, len(tcam)):
+    if not len(active):
+      break
+    start = time.perf_counter()
+    table = tcam[stage]
+    matcher = None if matchers is None else matchers[stage]
+    matches = lookup(table, batch, active, state, matcher)
+    for rule in numpy.unique(matches):
+      if rule < 0:
+        continue  # No actions
+      rows = active[matches == rule]
+      actions = table[rule][1]
+      try:
+        ctx = StageContext(batch, matrix, lengths, rows, state)
+        failed = apply_group(batch, ctx, rows, actions, state)
+      except Unsupported:
+        failed = rows
+      apply_scalar(batch, failed, actions, state)
+    erred = numpy.array([batch.errors[i] is not None for i in active], bool)
+    active = active[~erred]
+    batch.stage[active] += 1
+    if stage_times is not None:
+      stage_times[stage] += time.perf_counter() - start
+  return batch
@@ -0,0 +1,184 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the lockstep batch interpreter."""
+
+import random
+import unittest
+from interpreter import config_parser
+from interpreter import interp
+from interpreter import ir_parser
+from interpreter import lockstep
+from interpreter import matchers
+from interpreter import test_util
+import interpreter.datatypes as d
+
+IR_FILE = "interpreter/test_files/simple_ip_parser.json"
+CONFIG_FILE = "interpreter/test_files/simple_ip_config.json"
+
+CONFIG = {
+    "data stores": [
+        test_util.store("state", 8),
+        test_util.store("a", 16, masked=True),
+        test_util.store("b", 64),
+        test_util.store("ro", 8, write=False),
+        test_util.store("out", 8, persistent=True),
+    ],
+    "keys": ["state[0:7]"],
+}
+
+
+def extract(name: str, loc: str) -> d.Action:
+  return ir_parser.parse_action(
+      {"type": "ExtractHeader", "id": name, "loc": loc}
+  )
+
+
+def pattern(p: str) -> list[d.Pattern]:
+  return [ir_parser.parse_pattern(p)]
+
+
+TCAM = [
+    [(
+        pattern("0x**"),
+        {
+            test_util.copy("packet[0:7]", "state[0:7]"),
+            test_util.copy("packet[8:15]", "a[4:11]"),
+            extract("h0", "packet[0:15]"),
+            test_util.move("8"),
+        },
+    )],
+    [
+        (
+            pattern("0x0*"),
+            {
+                test_util.copy("(w16)packet[0:7] + a[0:15]", "a[0:15]"),
+                test_util.copy("packet[0:63]", "b[0:63]"),
+                test_util.move("(w32)packet[0:3]"),
+            },
+        ),
+        (
+            pattern("0x1*"),
+            {
+                test_util.copy("a[0:15] >> packet[0:3]", "a[0:15]"),
+                test_util.copy("a[0:15] << packet[4:7]", "b[48:63]"),
+                test_util.move("8"),
+                test_util.move("16"),
+            },
+        ),
+        # The store isn't writeable
+        (pattern("0x2*"), {test_util.copy("packet[0:7]", "ro[0:7]")}),
+        # A location with dynamic bounds
+        (
+            pattern("0x3*"),
+            {
+                test_util.copy(
+                    "packet[(w32)a[12:15]:(w32)a[12:15]+7]", "state[0:7]"
+                )
+            },
+        ),
+        # The header was already extracted
+        (pattern("0x4*"), {extract("h0", "packet[0:7]")}),
+        (pattern("0x5*"), {test_util.move("1000")}),
+        (pattern("0x6*"), {test_util.copy("packet[0:63]", "b[0:63]")}),
+    ],
+    [(
+        pattern("0x**"),
+        {
+            test_util.copy("b[0:7] - 1w8", "out[0:7]"),
+            extract("h1", "packet[0:7]"),
+        },
+    )],
+]
+
+
+class LockstepTest(unittest.TestCase):
+
+  def assert_same_results(
+      self,
+      tcam: d.TCAM,
+      state: d.MachineState,
+      packets: list[d.Data],
+      **kwargs,
+  ) -> None:
+    batch = lockstep.interp_batch(tcam, state, packets, **kwargs)
+    self.assertEqual(len(batch), len(packets))
+    for i, packet in enumerate(packets):
+      with self.subTest(packet=packet):
+        expected = interp.copy_state(state)
+        error = None
+        try:
+          interp.interp_tcam(tcam, expected, packet)
+        except RuntimeError as e:
+          error = str(e)
+        self.assertEqual(batch.errors[i], error)
+        self.assertEqual(batch.state(i, state), expected)
+
+  def random_packets(self, count: int, max_bits: int) -> list[d.Data]:
+    rng = random.Random(0)
+    packets = []
+    for _ in range(count):
+      num_bits = rng.randrange(8, max_bits)
+      packets.append(d.Data(uint=rng.getrandbits(num_bits), length=num_bits))
+    return packets
+
+  def test_simple_ip(self):
+    tcam = ir_parser.parse_ir(IR_FILE, True)
+    state = config_parser.parse(CONFIG_FILE, True)
+    packets = [
+        d.Data("0x" + "ff" * 12 + "0800" + "45000000" * 3 + "0a000001" * 2),
+        d.Data("0x" + "ff" * 12 + "86dd" + "00" * 40),
+        d.Data("0x" + "ff" * 12 + "0800"),
+    ] + self.random_packets(50, 400)
+    self.assert_same_results(tcam, state, packets)
+    self.assert_same_results(
+        tcam, state, packets, matchers=matchers.build_matchers(tcam)
+    )
+
+  def test_actions(self):
+    state = config_parser.parse_config(CONFIG)
+    packets = self.random_packets(300, 200)
+    batch = lockstep.interp_batch(TCAM, state, packets)
+    # Every kind of rule is exercised
+    errors = [e for e in batch.errors if e is not None]
+    self.assertTrue(any("not writeable" in e for e in errors))
+    self.assertTrue(any("already extracted" in e for e in errors))
+    self.assertTrue(any("beyond end of packet" in e for e in errors))
+    self.assertLess(len(errors), len(packets))
+    self.assert_same_results(TCAM, state, packets)
+
+  def test_wide_stores(self):
+    config = dict(CONFIG)
+    config["data stores"] = CONFIG["data stores"] + [
+        test_util.store("wide", 65)
+    ]
+    state = config_parser.parse_config(config)
+    tcam = [
+        TCAM[0],
+        TCAM[1]
+        + [(
+            pattern("0x**"),
+            {test_util.copy("packet[0:64]", "wide[0:64]")},
+        )],
+    ]
+    self.assert_same_results(tcam, state, self.random_packets(50, 200))
+
+  def test_empty(self):
+    state = config_parser.parse_config(CONFIG)
+    batch = lockstep.interp_batch(TCAM, state, [])
+    self.assertEqual(len(batch), 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,259 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Table lookup algorithms, as alternatives to scanning every rule.
+
+Each matcher is built from a table, and implements interp.Matcher: given the
+current key values, it returns the index of the first matching rule. A list of
+matchers (one per table) can be passed to interp.interp_tcam.
+
+Matchers also implement control_plane.TableListener, so a matcher built on a
+RuntimeTable stays up to date as rules are inserted, deleted and modified;
+build_matchers registers them automatically.
+
+As in the optimizer, the keys (and the patterns of each rule) are concatenated
+into a single int, with the first key in the most significant bits.
+"""
+
+import bisect
+from collections.abc import Callable
+
+from interpreter import control_plane
+from interpreter import interp
+from interpreter import optimizer
+import interpreter.datatypes as d
+
+
+def pack_keys(keys: list[int], shape: list[int]) -> int:
+  packed = 0
+  for key, width in zip(keys, shape):
+    packed = (packed << width) | key
+  return packed
+
+
+def rule_ternary(rule: d.Rule) -> optimizer.Ternary:
+  return optimizer.to_ternary(rule[0])
+
+
+class BitVectorMatcher:
+  """A bit-vector classifier, in the style of Lakshman and Stiliadis.
+
+  The concatenated key is split into chunks of chunk_bits bits. For each chunk
+  and each possible value of that chunk, we precompute the set of rules that
+  match it, as an int with bit i set iff rule i matches. A lookup ANDs together
+  the sets for each chunk of the key; the lowest set bit of the result is the
+  highest-priority matching rule.
+
+  The cost of a lookup depends only on the key width, not on the number of
+  rules or how many wildcards they have. The index uses
+  (key width / chunk_bits) * 2**chunk_bits bitsets.
+  """
+
+  def __init__(
+      self,
+      table: d.Table,
+      chunk_bits: int = 8,
+      shape: list[int] | None = None,
+  ):
+    if chunk_bits <= 0:
+      raise ValueError("chunk_bits must be positive, not %s." % chunk_bits)
+    self._chunk_bits = chunk_bits
+    self._num_rules = 0
+    self.shape: list[int] | None = None
+    # For each chunk, its shift within the packed key, its mask (after
+    # shifting), and the set of rules matching each of its values.
+    self._chunks: list[tuple[int, int, list[int]]] = []
+    if shape is None and table:
+      shape = control_plane.rule_shape(table[0])
+    if shape is not None:
+      self._init_chunks(shape)
+    for i, rule in enumerate(table):
+      self.rule_inserted(i, rule)
+
+  def _init_chunks(self, shape: list[int]) -> None:
+    self.shape = shape
+    width = sum(shape)
+    for end in range(width, 0, -self._chunk_bits):
+      size = min(self._chunk_bits, end)
+      self._chunks.append((end - size, (1 << size) - 1, [0] * (1 << size)))
+
+  def lookup(self, keys: list[int]) -> int | None:
+    if self._num_rules == 0:
+      return None
+    key = pack_keys(keys, self.shape)
+    matches = (1 << self._num_rules) - 1
+    for shift, mask, rule_sets in self._chunks:
+      matches &= rule_sets[(key >> shift) & mask]
+      if not matches:
+        return None
+    return (matches & -matches).bit_length() - 1
+
+  def _set_rule(self, index: int, rule: d.Rule) -> None:
+    """Set bit index of each bitset according to whether the rule matches."""
+    value, rule_mask = rule_ternary(rule)
+    bit = 1 << index
+    for shift, mask, rule_sets in self._chunks:
+      chunk_value = (value >> shift) & mask
+      chunk_mask = (rule_mask >> shift) & mask
+      for v in range(len(rule_sets)):
+        if (v ^ chunk_value) & chunk_mask:
+          rule_sets[v] &= ~bit
+        else:
+          rule_sets[v] |= bit
+
+  # TableListener methods
+
+  def rule_inserted(self, index: int, rule: d.Rule) -> None:
+    if self.shape is None:
+      self._init_chunks(control_plane.rule_shape(rule))
+    low = (1 << index) - 1
+    for _, _, rule_sets in self._chunks:
+      for v, rules in enumerate(rule_sets):
+        # Make room for the new rule by moving the later rules up a bit
+        rule_sets[v] = (rules & low) | ((rules & ~low) << 1)
+    self._num_rules += 1
+    self._set_rule(index, rule)
+
+  def rule_deleted(self, index: int, rule: d.Rule) -> None:
+    del rule  # Unused
+    low = (1 << index) - 1
+    for _, _, rule_sets in self._chunks:
+      for v, rules in enumerate(rule_sets):
+        rule_sets[v] = (rules & low) | ((rules >> 1) & ~low)
+    self._num_rules -= 1
+
+  def rule_modified(self, index: int, old: d.Rule, new: d.Rule) -> None:
+    if old[0] != new[0]:
+      self._set_rule(index, new)
+
+
+class TupleSpaceMatcher:
+  """A tuple-space search classifier, in the style of Srinivasan et al.
+
+  Rules are grouped by their (concatenated) mask. Each group holds a dict from
+  masked value to the indices of the rules in the group with that value, in
+  priority order, so a lookup is one dict lookup per distinct mask. Groups are
+  searched in order of their highest-priority rule, so the search can stop as
+  soon as no remaining group can contain a better match.
+
+  Updates only change the group of the rule being updated, although inserting
+  or deleting a rule also renumbers the rules after it in every group.
+  """
+
+  def __init__(self, table: d.Table, shape: list[int] | None = None):
+    self.shape = shape
+    if self.shape is None and table:
+      self.shape = control_plane.rule_shape(table[0])
+    # Map from mask to the map from masked value to rule indices
+    self._groups: dict[int, dict[int, list[int]]] = {}
+    # The index of the highest-priority rule of each group
+    self._firsts: dict[int, int] = {}
+    for i, rule in enumerate(table):
+      value, mask = rule_ternary(rule)
+      self._groups.setdefault(mask, {}).setdefault(value, []).append(i)
+      self._firsts.setdefault(mask, i)
+    self._sort()
+
+  def _sort(self) -> None:
+    # (first rule, mask, values) for each group, in order of the first rule
+    self._tuples = sorted(
+        (first, mask, self._groups[mask])
+        for mask, first in self._firsts.items()
+    )
+
+  def _add(self, index: int, rule: d.Rule) -> None:
+    value, mask = rule_ternary(rule)
+    indices = self._groups.setdefault(mask, {}).setdefault(value, [])
+    bisect.insort(indices, index)
+    self._firsts[mask] = min(self._firsts.get(mask, index), index)
+
+  def _remove(self, index: int, rule: d.Rule) -> None:
+    value, mask = rule_ternary(rule)
+    values = self._groups[mask]
+    values[value].remove(index)
+    if not values[value]:
+      del values[value]
+    if not values:
+      del self._groups[mask]
+      del self._firsts[mask]
+    elif self._firsts[mask] == index:
+      self._firsts[mask] = min(indices[0] for indices in values.values())
+
+  def _renumber(self, start: int, delta: int) -> None:
+    """Add delta to the index of every rule from start onwards."""
+    for values in self._groups.values():
+      for indices in values.values():
+        for i, idx in enumerate(indices):
+          if idx >= start:
+            indices[i] = idx + delta
+    for mask, first in self._firsts.items():
+      if first >= start:
+        self._firsts[mask] = first + delta
+
+  @property
+  def num_tuples(self) -> int:
+    """The number of distinct masks, i.e. dict lookups per worst-case search."""
+    return len(self._tuples)
+
+  def lookup(self, keys: list[int]) -> int | None:
+    if not self._tuples:
+      return None
+    key = pack_keys(keys, self.shape)
+    best = None
+    for first, mask, values in self._tuples:
+      if best is not None and first >= best:
+        break
+      indices = values.get(key & mask)
+      if indices is not None and (best is None or indices[0] < best):
+        best = indices[0]
+    return best
+
+  # TableListener methods
+
+  def rule_inserted(self, index: int, rule: d.Rule) -> None:
+    if self.shape is None:
+      self.shape = control_plane.rule_shape(rule)
+    self._renumber(index, 1)
+    self._add(index, rule)
+    self._sort()
+
+  def rule_deleted(self, index: int, rule: d.Rule) -> None:
+    self._remove(index, rule)
+    self._renumber(index + 1, -1)
+    self._sort()
+
+  def rule_modified(self, index: int, old: d.Rule, new: d.Rule) -> None:
+    if old[0] != new[0]:
+      self._remove(index, old)
+      self._add(index, new)
+      self._sort()
+
+
+def build_matchers(
+    tcam: d.TCAM,
+    factory: Callable[[d.Table], interp.Matcher] = BitVectorMatcher,
+) -> list[interp.Matcher]:
+  """Build a matcher for each table of a TCAM.
+
+  Matchers built on RuntimeTables are registered as listeners, so that they
+  stay up to date as the tables change.
+  """
+  matchers = []
+  for table in tcam:
+    matcher = factory(table)
+    if isinstance(table, control_plane.RuntimeTable):
+      table.add_listener(matcher)
+    matchers.append(matcher)
+  return matchers
+
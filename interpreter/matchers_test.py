@@ -0,0 +1,138 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the table lookup algorithms."""
+
+import random
+import unittest
+from interpreter import config_parser
+from interpreter import control_plane
+from interpreter import interp
+from interpreter import ir_parser
+from interpreter import matchers
+from interpreter import test_util
+import interpreter.datatypes as d
+
+IR_FILE = "interpreter/test_files/simple_ip_parser.json"
+CONFIG_FILE = "interpreter/test_files/simple_ip_config.json"
+
+SHAPE = [4, 7]  # Not a multiple of the chunk size, to test the last chunk
+
+MATCHERS = {
+    "bit vector": matchers.BitVectorMatcher,
+    "bit vector (small chunks)": lambda t: matchers.BitVectorMatcher(t, 3),
+    "tuple space": matchers.TupleSpaceMatcher,
+}
+
+
+def random_rule(rng: random.Random) -> d.Rule:
+  patterns = [test_util.random_pattern(rng, width) for width in SHAPE]
+  move = ir_parser.parse_action(
+      {"type": "MoveCursor", "numbits": str(rng.randrange(100))}
+  )
+  return (patterns, {move})
+
+
+def all_keys() -> list[list[int]]:
+  return [[a, b] for a in range(2 ** SHAPE[0]) for b in range(2 ** SHAPE[1])]
+
+
+class MatchersTest(unittest.TestCase):
+
+  def assert_same_lookups(self, matcher, table: d.Table) -> None:
+    for keys in all_keys():
+      self.assertEqual(
+          matcher.lookup(keys), interp.scan_table(table, keys), msg=keys
+      )
+
+  def test_random_tables(self):
+    rng = random.Random(0)
+    for name, factory in MATCHERS.items():
+      with self.subTest(name):
+        for num_rules in [0, 1, 5, 40]:
+          table = [random_rule(rng) for _ in range(num_rules)]
+          self.assert_same_lookups(factory(table), table)
+
+  def test_tuple_space_groups(self):
+    def rule(first: str, second: str) -> d.Rule:
+      return (
+          [ir_parser.parse_pattern(first), ir_parser.parse_pattern(second)],
+          set(),
+      )
+
+    table = [
+        rule("0b1***", "0b*******"),
+        rule("0b0***", "0b*******"),
+        rule("0b1***", "0b0000001"),
+        rule("0b****", "0b*******"),
+    ]
+    matcher = matchers.TupleSpaceMatcher(table)
+    self.assertEqual(matcher.num_tuples, 3)
+    self.assertEqual(matcher.lookup([0b1000, 1]), 0)
+    self.assertEqual(matcher.lookup([0b0000, 1]), 1)
+    self.assert_same_lookups(matcher, table)
+
+    # Updates keep the groups in step with the table
+    matcher.rule_deleted(3, table.pop(3))
+    self.assertEqual(matcher.num_tuples, 2)
+    self.assert_same_lookups(matcher, table)
+    new = rule("0b****", "0b0000001")
+    matcher.rule_modified(0, table[0], new)
+    table[0] = new
+    self.assertEqual(matcher.lookup([0b1000, 1]), 0)
+    self.assert_same_lookups(matcher, table)
+    new = rule("0b0***", "0b*******")
+    matcher.rule_inserted(0, new)
+    table.insert(0, new)
+    self.assertEqual(matcher.num_tuples, 3)
+    self.assert_same_lookups(matcher, table)
+
+  def test_updates(self):
+    rng = random.Random(1)
+    for name, factory in MATCHERS.items():
+      with self.subTest(name):
+        table = control_plane.RuntimeTable([], shape=SHAPE)
+        (matcher,) = matchers.build_matchers([table], factory)
+        for _ in range(30):
+          op = rng.randrange(4)
+          if op < 2 or not table:
+            rule = random_rule(rng)
+            table.insert(rng.randrange(len(table) + 1), *rule)
+          elif op == 2:
+            table.delete(rng.randrange(len(table)))
+          else:
+            table.modify_actions(rng.randrange(len(table)), set())
+          self.assert_same_lookups(matcher, table)
+
+  def test_interp(self):
+    tcam = ir_parser.parse_ir(IR_FILE, True)
+    initial = config_parser.parse(CONFIG_FILE, True)
+    packets = [
+        "0x" + "ff" * 12 + "0800" + "00" * 12 + "7f000001" + "00" * 4,
+        "0x" + "ff" * 12 + "0800" + "00" * 20,
+        "0x" + "ff" * 12 + "86dd" + "00" * 40,
+    ]
+    for name, factory in MATCHERS.items():
+      with self.subTest(name):
+        table_matchers = matchers.build_matchers(tcam, factory)
+        for packet in packets:
+          expected = interp.copy_state(initial)
+          interp.interp_tcam(tcam, expected, d.Data(packet))
+          state = interp.copy_state(initial)
+          interp.interp_tcam(tcam, state, d.Data(packet), table_matchers)
+          self.assertEqual(state, expected)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,223 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""IR-to-IR optimizations that reduce the number of rules in each table.
+
+Every pass here preserves the behavior of each table: for every key, the
+optimized table executes the same actions as the original. The passes are:
+
+- Shadowed rules: a rule whose patterns are fully covered by higher-priority
+  rules can never match, so it is removed.
+- Redundant rules: a rule is removed if every key it matches would otherwise
+  fall through to a lower-priority rule with the same actions (or, for rules
+  with no actions, to no rule at all).
+- Merging: adjacent rules with the same actions whose patterns differ in a
+  single cared-about bit are merged into one rule that wildcards that bit.
+
+For these checks, the patterns of a rule are concatenated into a single ternary
+value, represented as a (value, mask) pair of ints so that subset and overlap
+tests are a handful of bitwise operations.
+"""
+
+import dataclasses
+
+from interpreter import ir_parser
+from interpreter import ir_writer
+import interpreter.datatypes as d
+
+# (value, mask) pair. Value bits where the mask is 0 are always 0.
+Ternary = tuple[int, int]
+
+# Upper bound on the number of splits done when checking if a rule is covered
+# by the union of several other rules. If it's exceeded, we conservatively
+# assume that it isn't covered.
+COVER_BUDGET = 4096
+
+
+def to_ternary(patterns: list[d.Pattern]) -> Ternary:
+  """Concatenate a rule's patterns into a single ternary value."""
+  value = 0
+  mask = 0
+  for pat in patterns:
+    value = (value << pat.value.length) | (pat.value.uint & pat.mask.uint)
+    mask = (mask << pat.mask.length) | pat.mask.uint
+  return (value, mask)
+
+
+def from_ternary(ternary: Ternary, shape: list[int]) -> list[d.Pattern]:
+  """Split a ternary value back into patterns of the given widths."""
+  value, mask = ternary
+  patterns = []
+  for width in reversed(shape):
+    low = (1 << width) - 1
+    patterns.append(
+        d.Pattern(
+            d.Data(uint=value & low, length=width),
+            d.Data(uint=mask & low, length=width),
+        )
+    )
+    value >>= width
+    mask >>= width
+  return patterns[::-1]
+
+
+def covers(a: Ternary, b: Ternary) -> bool:
+  """Return true iff every key matched by b is also matched by a."""
+  return a[1] & ~b[1] == 0 and b[0] & a[1] == a[0]
+
+
+def overlaps(a: Ternary, b: Ternary) -> bool:
+  """Return true iff some key is matched by both a and b."""
+  return (a[0] ^ b[0]) & a[1] & b[1] == 0
+
+
+def is_covered(rule: Ternary, others: list[Ternary]) -> bool:
+  """Return true iff every key matched by rule is matched by one of others.
+
+  May return false negatives for rules that need to be split more than
+  COVER_BUDGET times to decide.
+  """
+  budget = [COVER_BUDGET]
+
+  def check(rule: Ternary, others: list[Ternary]) -> bool:
+    value, mask = rule
+    for i, other in enumerate(others):
+      if not overlaps(other, rule):
+        continue
+      if covers(other, rule):
+        return True
+      # Split the rule on a bit that the other rule cares about, and check
+      # both halves. The rules we've already skipped don't overlap either half.
+      budget[0] -= 1
+      if budget[0] < 0:
+        return False
+      free = other[1] & ~mask
+      bit = free & -free
+      rest = others[i:]
+      return check((value, mask | bit), rest) and check(
+          (value | bit, mask | bit), rest
+      )
+    return False
+
+  return check(rule, [o for o in others if overlaps(o, rule)])
+
+
+@dataclasses.dataclass
+class Stats:
+  """The number of rules removed or merged by each pass."""
+
+  shadowed: int = 0
+  redundant: int = 0
+  merged: int = 0
+
+  def __iadd__(self, other: "Stats") -> "Stats":
+    self.shadowed += other.shadowed
+    self.redundant += other.redundant
+    self.merged += other.merged
+    return self
+
+
+TernaryRule = tuple[Ternary, set[d.Action]]
+
+
+def remove_shadowed(
+    rules: list[TernaryRule], stats: Stats
+) -> list[TernaryRule]:
+  kept = []
+  for rule in rules:
+    if is_covered(rule[0], [r[0] for r in kept]):
+      stats.shadowed += 1
+    else:
+      kept.append(rule)
+  return kept
+
+
+def is_redundant(idx: int, rules: list[TernaryRule]) -> bool:
+  ternary, actions = rules[idx]
+  # Keys that match no rule get no actions, as if there were a final rule
+  # with no actions that matches everything.
+  for other, other_actions in rules[idx + 1 :] + [((0, 0), set())]:
+    if not overlaps(other, ternary):
+      continue
+    if other_actions != actions:
+      return False
+    if covers(other, ternary):
+      return True
+  return False
+
+
+def remove_redundant(
+    rules: list[TernaryRule], stats: Stats
+) -> list[TernaryRule]:
+  # Go from the end, so that each check sees the final version of the rules
+  # after it. We always keep one rule, since other tools infer the shape of
+  # the keys from the rules (and a lone rule with no actions is harmless).
+  rules = list(rules)
+  for idx in reversed(range(len(rules))):
+    if len(rules) > 1 and is_redundant(idx, rules):
+      del rules[idx]
+      stats.redundant += 1
+  return rules
+
+
+def merge_adjacent(
+    rules: list[TernaryRule], stats: Stats
+) -> list[TernaryRule]:
+  merged = []
+  for rule in rules:
+    if merged:
+      (value, mask), actions = merged[-1]
+      (other_value, other_mask), other_actions = rule
+      diff = value ^ other_value
+      # Same mask, and values that differ in exactly one bit
+      if (
+          actions == other_actions
+          and mask == other_mask
+          and diff & (diff - 1) == 0
+      ):
+        merged[-1] = ((value & ~diff, mask & ~diff), actions)
+        stats.merged += 1
+        continue
+    merged.append(rule)
+  return merged
+
+
+def optimize_table(table: d.Table, stats: Stats | None = None) -> d.Table:
+  """Return a table with the same behavior and (hopefully) fewer rules."""
+  if stats is None:
+    stats = Stats()
+  if not table:
+    return []
+  shape = [p.value.length for p in table[0][0]]
+  rules = [(to_ternary(patterns), actions) for patterns, actions in table]
+  while True:
+    num_rules = len(rules)
+    rules = remove_shadowed(rules, stats)
+    rules = remove_redundant(rules, stats)
+    rules = merge_adjacent(rules, stats)
+    if len(rules) == num_rules:
+      break
+  return [(from_ternary(t, shape), actions) for t, actions in rules]
+
+
+def optimize_tcam(tcam: d.TCAM, stats: Stats | None = None) -> d.TCAM:
+  return [optimize_table(table, stats) for table in tcam]
+
+
+def optimize_ir(in_path: str, out_path: str) -> Stats:
+  """Optimize a json IR file, writing the result to out_path."""
+  stats = Stats()
+  tcam = optimize_tcam(ir_parser.parse_ir(in_path, True), stats)
+  ir_writer.write_ir(tcam, out_path)
+  return stats
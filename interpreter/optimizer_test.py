@@ -0,0 +1,141 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the IR optimizer."""
+
+import os
+import random
+import tempfile
+import unittest
+from interpreter import interp
+from interpreter import ir_parser
+from interpreter import optimizer
+import interpreter.datatypes as d
+
+
+def move(n: int) -> set[d.Action]:
+  return {ir_parser.parse_action({"type": "MoveCursor", "numbits": str(n)})}
+
+
+def mk_table(rules: list[tuple[list[str], set[d.Action]]]) -> d.Table:
+  return [
+      ([ir_parser.parse_pattern(p) for p in patterns], actions)
+      for patterns, actions in rules
+  ]
+
+
+def first_match(table: d.Table, keys: list[d.Data]) -> set[d.Action]:
+  for patterns, actions in table:
+    if all(interp.match_pattern(p, k) for p, k in zip(patterns, keys)):
+      return actions
+  return set()
+
+
+class OptimizerTest(unittest.TestCase):
+
+  def assert_equivalent(self, table: d.Table, optimized: d.Table) -> None:
+    """Check every possible key against both tables."""
+    shape = [p.value.length for p in table[0][0]]
+    for key in range(2 ** sum(shape)):
+      keys = []
+      for width in reversed(shape):
+        keys.insert(0, d.Data(uint=key % 2**width, length=width))
+        key >>= width
+      self.assertEqual(first_match(table, keys), first_match(optimized, keys))
+
+  def test_ternary(self):
+    self.assertTrue(optimizer.covers((0b1000, 0b1000), (0b1010, 0b1110)))
+    self.assertFalse(optimizer.covers((0b1010, 0b1110), (0b1000, 0b1000)))
+    self.assertTrue(optimizer.overlaps((0b1000, 0b1000), (0b0010, 0b0010)))
+    self.assertFalse(optimizer.overlaps((0b1000, 0b1100), (0b0100, 0b0100)))
+    # Covered by the union of two rules, but not by either one alone
+    self.assertTrue(
+        optimizer.is_covered((0b0, 0b0), [(0b1, 0b1), (0b0, 0b1)])
+    )
+    self.assertFalse(
+        optimizer.is_covered((0b00, 0b00), [(0b01, 0b11), (0b00, 0b01)])
+    )
+
+  def test_shadowed(self):
+    table = mk_table([
+        (["0b1*", "0b0"], move(1)),
+        (["0b0*", "0b0"], move(2)),
+        (["0b10", "0b0"], move(3)),  # Shadowed by the first rule
+        (["0b**", "0b0"], move(4)),  # Shadowed by the first two together
+        (["0b**", "0b*"], move(5)),
+    ])
+    stats = optimizer.Stats()
+    optimized = optimizer.optimize_table(table, stats)
+    self.assertEqual(optimized, [table[0], table[1], table[4]])
+    self.assertEqual(stats, optimizer.Stats(shadowed=2))
+    self.assert_equivalent(table, optimized)
+
+  def test_redundant_and_merge(self):
+    table = mk_table([
+        (["0b00", "0b1"], move(1)),  # Redundant, since rule 3 covers it
+        (["0b1*", "0b1"], move(2)),
+        (["0b0*", "0b1"], move(1)),
+        (["0b00", "0b0"], move(6)),  # These four merge into one rule
+        (["0b01", "0b0"], move(6)),
+        (["0b10", "0b0"], move(6)),
+        (["0b11", "0b0"], move(6)),
+        (["0b**", "0b*"], set()),  # Shadowed by the union of the others
+    ])
+    stats = optimizer.Stats()
+    optimized = optimizer.optimize_table(table, stats)
+    self.assertEqual(
+        optimized,
+        mk_table([
+            (["0b1*", "0b1"], move(2)),
+            (["0b0*", "0b1"], move(1)),
+            (["0b**", "0b0"], move(6)),
+        ]),
+    )
+    self.assertEqual(
+        stats, optimizer.Stats(shadowed=1, redundant=1, merged=3)
+    )
+    self.assert_equivalent(table, optimized)
+
+    # A rule with no actions is the same as not matching at all, but tables
+    # are never emptied completely
+    table = mk_table([(["0b*0", "0b*"], set()), (["0b1*", "0b*"], set())])
+    self.assertEqual(optimizer.optimize_table(table), table[:1])
+
+  def test_random(self):
+    rng = random.Random(1234)
+    for _ in range(50):
+      rules = []
+      for _ in range(rng.randrange(1, 12)):
+        patterns = [
+            "0b" + "".join(rng.choice("01**") for _ in range(width))
+            for width in [3, 2]
+        ]
+        rules.append((patterns, move(rng.randrange(3))))
+      table = mk_table(rules)
+      self.assert_equivalent(table, optimizer.optimize_table(table))
+
+  def test_optimize_ir(self):
+    fd, path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    self.addCleanup(os.remove, path)
+    ir_file = "interpreter/test_files/simple_ip_parser.json"
+    stats = optimizer.optimize_ir(ir_file, path)
+    # The last two rules of the final table both accept
+    self.assertEqual(stats, optimizer.Stats(merged=1))
+    tcam = ir_parser.parse_ir(path, True)
+    self.assertEqual([len(table) for table in tcam], [1, 2, 2])
+
+
+if __name__ == "__main__":
+  unittest.main()
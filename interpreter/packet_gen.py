@@ -0,0 +1,436 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Generate a small set of packets that makes every reachable rule fire.
+
+We search the paths through the TCAM symbolically. Along a path, each bit of
+each store is either a constant or a reference to a bit of the packet, and the
+packet is described by the bits the path has constrained so far. To take a
+rule, we constrain the key bits its patterns care about, and then rule out each
+higher-priority rule by fixing one packet bit it cares about to the opposite
+value. Values that can't be tracked bit by bit (arithmetic, and dynamic
+offsets) are made concrete by fixing the packet bits they read. If only a few
+of those bits are still free, we try each of their values; otherwise we set
+them to 0.
+
+This is incomplete: the choices made to rule out higher-priority rules, and to
+make values concrete, can make some rules look unreachable. Every generated
+packet is checked by running it through the interpreter, so the reported
+coverage is exact, and a greedy set cover picks a small subset of them.
+
+Run with e.g.
+  python -m interpreter.packet_gen --ir prog.json --config config.json \
+      --corpus packets.corpus
+"""
+
+import argparse
+import dataclasses
+import sys
+
+from interpreter import config_parser
+from interpreter import corpus
+from interpreter import interp
+from interpreter import ir_parser
+from interpreter import optimizer
+import interpreter.datatypes as d
+
+# Upper bound on the number of (partial) paths explored
+DEFAULT_BUDGET = 100000
+
+# When a stage's actions need the value of at most this many free packet bits
+# (e.g. for a variable-length header), we try every value of those bits rather
+# than setting them to 0.
+MAX_ENUMERATED_BITS = 4
+
+
+@dataclasses.dataclass(frozen=True)
+class PacketBit:
+  """A symbolic bit, equal to the bit at a given position of the packet."""
+
+  pos: int
+
+
+# A symbolic bit: either a constant (0 or 1), or a bit of the packet
+Bit = int | PacketBit
+
+
+class Unsatisfiable(Exception):
+  """Raised when a path can't be extended as requested."""
+
+
+@dataclasses.dataclass
+class Path:
+  """A partial path through the TCAM, and the packets that can follow it."""
+
+  stage: int
+  cursor: int
+  stores: dict[str, list[Bit]]
+  # Constraints on the packet: map from bit position to value
+  packet: dict[int, int]
+  # The smallest number of bits the packet can have
+  min_length: int
+  headers: frozenset[str]
+  # The (stage, rule) pairs taken so far
+  rules: tuple[tuple[int, int], ...]
+  # The free packet bits that were set to 0 to make a value concrete
+  defaulted: list[int] = dataclasses.field(default_factory=list)
+
+  def copy(self) -> "Path":
+    return dataclasses.replace(
+        self,
+        stores={name: list(bits) for name, bits in self.stores.items()},
+        packet=dict(self.packet),
+        defaulted=[],
+    )
+
+  def constrain(self, bit: Bit, value: int) -> None:
+    """Require a symbolic bit to have the given value."""
+    if isinstance(bit, PacketBit):
+      if self.packet.setdefault(bit.pos, value) != value:
+        raise Unsatisfiable()
+    elif bit != value:
+      raise Unsatisfiable()
+
+  def concrete(self, bit: Bit) -> int:
+    """Fix the value of a symbolic bit, using 0 if it's unconstrained."""
+    if isinstance(bit, PacketBit):
+      if bit.pos not in self.packet:
+        self.packet[bit.pos] = 0
+        self.defaulted.append(bit.pos)
+      return self.packet[bit.pos]
+    return bit
+
+
+def initial_path(state: d.MachineState) -> Path:
+  return Path(
+      stage=state.stage,
+      cursor=state.cursor,
+      stores={
+          name: [
+              (store.value >> (store.width - 1 - i)) & 1
+              for i in range(store.width)
+          ]
+          for name, store in state.stores.items()
+      },
+      packet={},
+      min_length=state.cursor,
+      headers=frozenset(state.headers),
+      rules=(),
+  )
+
+
+def to_int(bits: list[int]) -> int:
+  value = 0
+  for bit in bits:
+    value = (value << 1) | bit
+  return value
+
+
+def to_packet(path: Path) -> d.Data:
+  """The packet satisfying a path's constraints, with free bits set to 0.
+
+  Packets are padded to a whole number of bytes.
+  """
+  length = max(8, (path.min_length + 7) // 8 * 8)
+  value = 0
+  for pos, bit in path.packet.items():
+    if pos < length:
+      value |= bit << (length - 1 - pos)
+  return d.Data(uint=value, length=length)
+
+
+class PathSearch:
+  """Symbolic execution of a TCAM, mirroring the semantics in interp.py."""
+
+  def __init__(self, tcam: d.TCAM, state: d.MachineState):
+    self.tcam = tcam
+    self.state = state
+    self.rules = [[optimizer.to_ternary(r[0]) for r in t] for t in tcam]
+    self.key_width = sum(loc.length for loc in state.keys)
+
+  def read_bits(self, loc: d.Location, path: Path) -> list[Bit]:
+    if loc.name == "packet":
+      path.min_length = max(path.min_length, path.cursor + loc.end + 1)
+      start = path.cursor + loc.start
+      return [PacketBit(pos) for pos in range(start, start + loc.length)]
+    if not self.state.stores[loc.name].read:
+      raise Unsatisfiable()
+    bits = path.stores[loc.name]
+    if loc.end >= len(bits):
+      raise Unsatisfiable()
+    return bits[loc.start : loc.end + 1]
+
+  def eval_location(self, locexp: d.LocationExp, path: Path) -> d.Location:
+    start = self.eval_concrete(locexp.start, path).value
+    end = self.eval_concrete(locexp.end, path).value
+    if start > end:
+      raise Unsatisfiable()
+    return d.Location(locexp.name, start, end)
+
+  def eval_symbolic(self, exp: d.IntExp, path: Path) -> list[Bit]:
+    """Evaluate an expression to a list of symbolic bits."""
+    e = exp.exp
+    if isinstance(e, d.LocationExp):
+      return self.read_bits(self.eval_location(e, path), path)
+    value = self.eval_concrete(exp, path)
+    return [
+        (value.value >> (value.width - 1 - i)) & 1 for i in range(value.width)
+    ]
+
+  def eval_concrete(self, exp: d.IntExp, path: Path) -> d.SizedInt:
+    """Evaluate an expression to a value, fixing the packet bits it reads."""
+    e = exp.exp
+    if isinstance(e, d.SizedInt):
+      return e
+    if isinstance(e, d.LocationExp):
+      bits = self.eval_symbolic(exp, path)
+      return d.SizedInt(to_int([path.concrete(b) for b in bits]), len(bits))
+    left = self.eval_concrete(e.left, path)
+    right = self.eval_concrete(e.right, path)
+    if e.op == d.ArithOp.CAST:
+      return d.SizedInt(right.value, left.value)
+    elif e.op == d.ArithOp.PLUS:
+      return left + right
+    elif e.op == d.ArithOp.MINUS:
+      return left - right
+    elif e.op == d.ArithOp.LSHIFT:
+      return left << right
+    else:
+      return left >> right
+
+  def key_bits(self, path: Path) -> list[Bit]:
+    bits = []
+    for loc in self.state.keys:
+      bits += path.stores[loc.name][loc.start : loc.end + 1]
+    return bits
+
+  def take_rule(self, path: Path, rule: int | None) -> None:
+    """Constrain the path so that the given rule (or no rule) matches."""
+    keys = self.key_bits(path)
+    rules = self.rules[path.stage]
+    higher = rules if rule is None else rules[:rule]
+    if rule is not None:
+      value, mask = rules[rule]
+      for i, bit in enumerate(keys):
+        shift = self.key_width - 1 - i
+        if (mask >> shift) & 1:
+          path.constrain(bit, (value >> shift) & 1)
+    for value, mask in higher:
+      self.rule_out(path, keys, value, mask)
+
+  def rule_out(
+      self, path: Path, keys: list[Bit], value: int, mask: int
+  ) -> None:
+    """Constrain the path so that a rule doesn't match."""
+    free = None
+    for i, bit in enumerate(keys):
+      shift = self.key_width - 1 - i
+      if not (mask >> shift) & 1:
+        continue
+      wanted = (value >> shift) & 1
+      if isinstance(bit, PacketBit):
+        if bit.pos not in path.packet:
+          free = free or (bit, wanted)
+          continue
+        bit = path.packet[bit.pos]
+      if bit != wanted:
+        return  # Already ruled out
+    if free is None:
+      raise Unsatisfiable()
+    path.constrain(free[0], 1 - free[1])
+
+  def apply_actions(self, path: Path, actions: set[d.Action]) -> None:
+    # As in the interpreter, moves happen after the other actions, and all
+    # reads see the stores from before the stage, so copies are written last.
+    writes = []
+    for action in sorted(
+        actions, key=lambda a: a.action_type == d.ActionType.MOVECURSOR
+    ):
+      if action.action_type == d.ActionType.EXTRACTHEADER:
+        name, locexp = action.action_args
+        if locexp.name != "packet" or name in path.headers:
+          raise Unsatisfiable()
+        self.read_bits(self.eval_location(locexp, path), path)
+        path.headers |= {name}
+      elif action.action_type == d.ActionType.COPYDATA:
+        src, dstexp = action.action_args
+        bits = self.eval_symbolic(src, path)
+        dst = self.eval_location(dstexp, path)
+        store = self.state.stores.get(dst.name)
+        if (
+            store is None
+            or not store.write
+            or len(bits) != dst.length
+            or dst.end >= store.width
+        ):
+          raise Unsatisfiable()
+        writes.append((store, dst, bits))
+      else:
+        path.cursor += self.eval_concrete(action.action_args, path).value
+        path.min_length = max(path.min_length, path.cursor)
+    for store, dst, bits in writes:
+      if not store.masked_writes:
+        path.stores[dst.name] = [0] * store.width
+      path.stores[dst.name][dst.start : dst.end + 1] = bits
+
+  def run_actions(self, path: Path, rule: int | None) -> bool:
+    """Apply a rule's actions to a path. Returns false if they'd fail."""
+    actions = set() if rule is None else self.tcam[path.stage][rule][1]
+    try:
+      self.apply_actions(path, actions)
+    except (Unsatisfiable, RuntimeError):
+      return False
+    if rule is not None:
+      path.rules += ((path.stage, rule),)
+    path.stage += 1
+    return True
+
+  def step(self, path: Path, rule: int | None) -> list[Path]:
+    """Extend a path through its current stage, in all the ways we can find."""
+    path = path.copy()
+    try:
+      self.take_rule(path, rule)
+    except Unsatisfiable:
+      return []
+    trial = path.copy()
+    if self.run_actions(trial, rule) and not trial.defaulted:
+      return [trial]
+    free = trial.defaulted
+    if not free or len(free) > MAX_ENUMERATED_BITS:
+      return [trial] if trial.stage > path.stage else []
+    # The actions depend on free bits of the packet, so try each value
+    extended = []
+    for value in range(2 ** len(free)):
+      branch = path.copy()
+      for i, pos in enumerate(free):
+        branch.packet[pos] = (value >> (len(free) - 1 - i)) & 1
+      if self.run_actions(branch, rule):
+        extended.append(branch)
+    return extended
+
+  def paths(self, budget: int = DEFAULT_BUDGET) -> list[Path]:
+    """Search for complete paths, preferring ones that take new rules."""
+    complete = []
+    covered = set()
+    stack = [initial_path(self.state)]
+    while stack and budget > 0:
+      budget -= 1
+      path = stack.pop()
+      if path.stage >= len(self.tcam):
+        if not covered.issuperset(path.rules):
+          covered.update(path.rules)
+          complete.append(path)
+        continue
+      options = list(range(len(self.tcam[path.stage]))) + [None]
+      # The stack is last-in first-out, so push uncovered rules last.
+      options.sort(key=lambda r: (path.stage, r) not in covered)
+      for rule in options:
+        stack += self.step(path, rule)
+    return complete
+
+
+class FiredTracer:
+  """Collects the (stage, rule) pairs that fired. Implements interp.Tracer."""
+
+  def __init__(self):
+    self.fired: set[tuple[int, int]] = set()
+
+  def start_packet(self) -> bool:
+    self.fired = set()
+    return True
+
+  def record(
+      self,
+      stage: int,
+      rule: int | None,
+      actions: set[d.Action],
+      cursor_before: int,
+      cursor_after: int,
+      failed: bool = False,
+  ) -> None:
+    del actions, cursor_before, cursor_after, failed  # Unused
+    if rule is not None:
+      self.fired.add((stage, rule))
+
+
+def rules_fired(
+    tcam: d.TCAM, state: d.MachineState, packet: d.Data
+) -> set[tuple[int, int]] | None:
+  """Run a packet, returning the (stage, rule) pairs that fired.
+
+  Returns None if the packet raises an error.
+  """
+  tracer = FiredTracer()
+  try:
+    interp.interp_tcam(tcam, interp.copy_state(state), packet, tracer=tracer)
+  except RuntimeError:
+    return None
+  return tracer.fired
+
+
+def generate(
+    tcam: d.TCAM, state: d.MachineState, budget: int = DEFAULT_BUDGET
+) -> tuple[list[d.Data], set[tuple[int, int]]]:
+  """Generate packets that together fire as many rules as possible.
+
+  Returns the packets, and the (stage, rule) pairs that they fire.
+  """
+  candidates = []
+  for path in PathSearch(tcam, state).paths(budget):
+    packet = to_packet(path)
+    fired = rules_fired(tcam, state, packet)
+    if fired:
+      candidates.append((packet, fired))
+  # Greedy set cover
+  packets = []
+  covered = set()
+  while True:
+    best = max(candidates, key=lambda c: len(c[1] - covered), default=None)
+    if best is None or not best[1] - covered:
+      break
+    packets.append(best[0])
+    covered |= best[1]
+  return packets, covered
+
+
+def to_hex(packet: d.Data) -> str:
+  return "0x" + packet.hex
+
+
+def main(argv: list[str] | None = None) -> None:
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument("--ir", required=True, help="IR program")
+  parser.add_argument("--config", required=True, help="Configuration file")
+  parser.add_argument("--corpus", help="Also write the packets to a corpus")
+  parser.add_argument("--budget", type=int, default=DEFAULT_BUDGET)
+  args = parser.parse_args(argv)
+  tcam = ir_parser.parse_ir(args.ir, True)
+  state = config_parser.parse(args.config, True)
+  interp.validate_keys_patterns(tcam, state)
+  packets, covered = generate(tcam, state, args.budget)
+  for packet in packets:
+    print(to_hex(packet))
+  if args.corpus:
+    with corpus.CorpusWriter(args.corpus) as writer:
+      for packet in packets:
+        writer.add(packet)
+  total = sum(len(table) for table in tcam)
+  print(
+      "%s packets fire %s of %s rules." % (len(packets), len(covered), total),
+      file=sys.stderr,
+  )
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,164 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for coverage-directed packet generation."""
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from interpreter import config_parser
+from interpreter import corpus
+from interpreter import ir_parser
+from interpreter import packet_gen
+from interpreter import test_util
+import interpreter.datatypes as d
+
+IR_FILE = "interpreter/test_files/simple_ip_parser.json"
+CONFIG_FILE = "interpreter/test_files/simple_ip_config.json"
+
+
+def mk_rule(patterns: list[str], actions: list[dict[str, str]]) -> d.Rule:
+  return (
+      [ir_parser.parse_pattern(p) for p in patterns],
+      {ir_parser.parse_action(a) for a in actions},
+  )
+
+
+class PacketGenTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tcam = ir_parser.parse_ir(IR_FILE, True)
+    self.state = config_parser.parse(CONFIG_FILE, True)
+
+  def test_simple_ip(self):
+    packets, covered = packet_gen.generate(self.tcam, self.state)
+    all_rules = {
+        (i, j) for i, table in enumerate(self.tcam) for j in range(len(table))
+    }
+    self.assertEqual(covered, all_rules)
+    # One packet per rule in the last stage is the best we can do
+    self.assertEqual(len(packets), 3)
+    fired = set()
+    for packet in packets:
+      self.assertEqual(packet.length % 8, 0)
+      fired |= packet_gen.rules_fired(self.tcam, self.state, packet)
+    self.assertEqual(fired, all_rules)
+
+  def test_dynamic_offsets(self):
+    # The first stage skips a variable-length header, whose length (in bytes)
+    # is in its first 4 bits. The second stage matches the byte after it.
+    tcam = [
+        [
+            mk_rule(
+                ["0x********", "0x********"],
+                [
+                    {
+                        "type": "MoveCursor",
+                        "numbits": "((w32) packet[0:3]) << 3w32",
+                    },
+                    {"type": "CopyData", "src": "1w32", "dst": "state[0:31]"},
+                ],
+            )
+        ],
+        [
+            mk_rule(
+                ["0x00000001", "0x********"],
+                [{
+                    "type": "CopyData",
+                    "src": "packet[0:31]",
+                    "dst": "r1[0:31]",
+                }],
+            )
+        ],
+        [
+            mk_rule(["0x********", "0xabcd****"], []),
+            # Shadowed by the rule above, so it can never fire
+            mk_rule(["0x********", "0xabcdef**"], []),
+            mk_rule(["0x********", "0x********"], []),
+        ],
+    ]
+    packets, covered = packet_gen.generate(tcam, self.state)
+    self.assertEqual(covered, {(0, 0), (1, 0), (2, 0), (2, 2)})
+    self.assertEqual(len(packets), 2)
+
+  def test_stage_reads(self):
+    # The second stage swaps r0 and r1: both copies read the stores from
+    # before the stage, as in the interpreter.
+    state = config_parser.parse_config({
+        "data stores": [
+            test_util.store("r0", 16, masked=True),
+            test_util.store("r1", 16, masked=True),
+        ],
+        "keys": ["r0[0:15]", "r1[0:15]"],
+    })
+    tcam = [
+        [
+            mk_rule(
+                ["0x****", "0x****"],
+                [
+                    {
+                        "type": "CopyData",
+                        "src": "packet[0:15]",
+                        "dst": "r0[0:15]",
+                    },
+                    {
+                        "type": "CopyData",
+                        "src": "packet[16:31]",
+                        "dst": "r1[0:15]",
+                    },
+                ],
+            )
+        ],
+        [
+            mk_rule(
+                ["0x****", "0x****"],
+                [
+                    {"type": "CopyData", "src": "r1[0:15]", "dst": "r0[0:15]"},
+                    {"type": "CopyData", "src": "r0[0:15]", "dst": "r1[0:15]"},
+                ],
+            )
+        ],
+        [mk_rule(["0x1234", "0xabcd"], []), mk_rule(["0x****", "0x****"], [])],
+    ]
+    packets, covered = packet_gen.generate(tcam, state)
+    self.assertIn((2, 0), covered)
+    matched = [
+        p for p in packets if (2, 0) in packet_gen.rules_fired(tcam, state, p)
+    ]
+    self.assertEqual(matched[0].uint >> (matched[0].length - 32), 0xABCD1234)
+
+  def test_main(self):
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    self.addCleanup(os.remove, path)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(
+        io.StringIO()
+    ):
+      packet_gen.main(
+          ["--ir", IR_FILE, "--config", CONFIG_FILE, "--corpus", path]
+      )
+    hex_packets = out.getvalue().split()
+    self.assertEqual(len(hex_packets), 3)
+    with corpus.Corpus(path) as packets:
+      self.assertEqual(
+          list(packets.packets()), [d.Data(p) for p in hex_packets]
+      )
+
+
+if __name__ == "__main__":
+  unittest.main()
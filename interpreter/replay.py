@@ -0,0 +1,684 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Replay a set of packets through a program, and report how fast it ran.
+
+Packets can be read from a corpus file, a pcap file, or a text file of "0x..."
+or "0b..." strings (one per line, ignoring blank lines and lines starting with
+#). pcap and text files are first converted to a temporary corpus, so that
+worker processes can read their packets straight from the mapped file.
+
+The packets are split into batches, which are interpreted by a pool of worker
+processes (or in this process, with --jobs 0). Results are written in packet
+order, either as JSON Lines (one object per packet) or as a NumPy structured
+array (see columnar.py, and --header to record where headers beyond those of
+the first table lie). At the end, a summary is printed to stderr: the
+throughput, the time spent in each stage, and percentiles of the latency of
+each packet (or of each batch, with --lockstep).
+
+Long replays can be checkpointed with --checkpoint: every few batches, the
+outputs are flushed and a small json file records how far the replay got, the
+statistics so far, and the length of the JSON Lines output. The checkpoint also
+records the size and SHA-256 hash of the corpus, so that it isn't resumed
+against different packets. Rerunning the same
+command resumes from the last checkpoint, truncating any results written after
+it, so that each packet's result is written exactly once. Large corpora can
+also be split across machines with --shard and --num-shards.
+
+Run with e.g.
+  python -m interpreter.replay --ir prog.json --config config.json \\
+      --pcap capture.pcap --jobs 8 --jsonl results.jsonl
+"""
+
+import argparse
+import collections
+from collections.abc import Iterator, Sequence
+import concurrent.futures
+import dataclasses
+import hashlib
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from typing import IO
+
+from interpreter import corpus
+from interpreter import cost_model
+from interpreter import interp
+from interpreter import server
+import interpreter.datatypes as d
+
+DEFAULT_BATCH_SIZE = 1024
+
+
+@dataclasses.dataclass
+class PacketResult:
+  """The parts of a packet's final state that are visible after parsing."""
+
+  error: str | None
+  cursor: int
+  stage: int
+  stores: dict[str, int]  # The value of each persistent store
+  headers: dict[str, tuple[int, int]]  # The (offset, length) of each header
+
+  def to_json(self, idx: int) -> str:
+    return json.dumps({
+        "packet": idx,
+        "error": self.error,
+        "cursor": self.cursor,
+        "stage": self.stage,
+        "stores": {name: hex(value) for name, value in self.stores.items()},
+        "headers": {name: list(ref) for name, ref in self.headers.items()},
+    })
+
+
+@dataclasses.dataclass
+class BatchResult:
+  results: list[PacketResult]
+  stage_seconds: list[float]
+  # Per packet, or a single entry for the whole batch with lockstep
+  latencies: list[float]
+
+
+def persistent_values(state: d.MachineState) -> dict[str, int]:
+  return {
+      name: store.value
+      for name, store in state.stores.items()
+      if store.persistent
+  }
+
+
+class StageTimer:
+  """Adds the time each stage of a packet takes to stage_seconds.
+
+  Implements interp.Tracer. A stage's time runs from the end of the previous
+  stage (or the start of the packet) to the end of its actions, so it
+  includes the table lookup.
+  """
+
+  def __init__(self, stage_seconds: list[float]):
+    self.stage_seconds = stage_seconds
+    self._start = 0.0
+
+  def start_packet(self) -> bool:
+    self._start = time.perf_counter()
+    return True
+
+  def record(
+      self,
+      stage: int,
+      rule: int | None,
+      actions: set[d.Action],
+      cursor_before: int,
+      cursor_after: int,
+      failed: bool = False,
+  ) -> None:
+    del rule, actions, cursor_before, cursor_after, failed  # Unused
+    now = time.perf_counter()
+    self.stage_seconds[stage] += now - self._start
+    self._start = now
+
+
+def run_packet(
+    tcam: d.TCAM,
+    state: d.MachineState,
+    packet: d.Data,
+    stage_seconds: list[float],
+) -> PacketResult:
+  """Interpret a packet, adding the time each stage takes to stage_seconds."""
+  error = None
+  try:
+    interp.interp_tcam(tcam, state, packet, tracer=StageTimer(stage_seconds))
+  except RuntimeError as e:
+    error = str(e)
+  return PacketResult(
+      error,
+      state.cursor,
+      state.stage,
+      persistent_values(state),
+      state.headers.refs(),
+  )
+
+
+def run_lockstep(
+    tcam: d.TCAM,
+    state: d.MachineState,
+    packets: list[d.Data],
+    stage_seconds: list[float],
+) -> list[PacketResult]:
+  # lockstep needs numpy, which replays without --lockstep don't
+  from interpreter import lockstep  # pylint: disable=import-outside-toplevel
+
+  batch = lockstep.interp_batch(tcam, state, packets, stage_times=stage_seconds)
+  results = []
+  for i, error in enumerate(batch.errors):
+    results.append(
+        PacketResult(
+            error,
+            int(batch.cursor[i]),
+            int(batch.stage[i]),
+            {
+                name: int(batch.stores[name][i])
+                for name, store in state.stores.items()
+                if store.persistent
+            },
+            {
+                name: (int(offsets[i]), int(lengths[i]))
+                for name, (offsets, lengths) in batch.headers.items()
+                if offsets[i] >= 0
+            },
+        )
+    )
+  return results
+
+
+@dataclasses.dataclass
+class Worker:
+  tcam: d.TCAM
+  state: d.MachineState
+  packets: corpus.Corpus
+  lockstep: bool
+
+
+# State of each worker process, set up once by init_worker.
+worker: Worker | None = None
+
+
+def init_worker(
+    ir_file: str, config_file: str, corpus_file: str, lockstep: bool
+) -> None:
+  global worker
+  tcam, state = server.load_program(ir_file, config_file)
+  worker = Worker(tcam, state, corpus.Corpus(corpus_file), lockstep)
+
+
+def run_batch(start: int, end: int) -> BatchResult:
+  """Interpret packets [start, end) of the corpus in a worker."""
+  tcam, state = worker.tcam, worker.state
+  packets = list(worker.packets.packets(range(start, end)))
+  stage_seconds = [0.0] * len(tcam)
+  if worker.lockstep:
+    batch_start = time.perf_counter()
+    results = run_lockstep(tcam, state, packets, stage_seconds)
+    latencies = [time.perf_counter() - batch_start]
+  else:
+    results = []
+    latencies = []
+    for packet in packets:
+      packet_start = time.perf_counter()
+      results.append(
+          run_packet(tcam, interp.copy_state(state), packet, stage_seconds)
+      )
+      latencies.append(time.perf_counter() - packet_start)
+  return BatchResult(results, stage_seconds, latencies)
+
+
+def batch_ranges(
+    packets: range, batch_size: int
+) -> Iterator[tuple[int, int]]:
+  for start in range(packets.start, packets.stop, batch_size):
+    yield (start, min(start + batch_size, packets.stop))
+
+
+# Latencies are counted in buckets growing by LATENCY_RATIO, so that the
+# statistics of arbitrarily long replays take constant space. Bucket i holds
+# latencies in (LATENCY_BASE * LATENCY_RATIO**(i-1), LATENCY_BASE *
+# LATENCY_RATIO**i], and percentiles are reported as the bucket's upper bound.
+LATENCY_BASE = 1e-7
+LATENCY_RATIO = 1.05
+
+
+def latency_bucket(seconds: float) -> int:
+  if seconds <= LATENCY_BASE:
+    return 0
+  return math.ceil(math.log(seconds / LATENCY_BASE, LATENCY_RATIO))
+
+
+@dataclasses.dataclass
+class Report:
+  """A summary of a replay."""
+
+  packets: int = 0
+  errors: int = 0
+  seconds: float = 0.0  # Wall-clock time
+  stage_seconds: list[float] = dataclasses.field(default_factory=list)
+  # The number of latencies in each bucket
+  latencies: dict[int, int] = dataclasses.field(default_factory=dict)
+  lockstep: bool = False
+
+  def add(self, batch: BatchResult) -> None:
+    self.packets += len(batch.results)
+    self.errors += sum(r.error is not None for r in batch.results)
+    if not self.stage_seconds:
+      self.stage_seconds = [0.0] * len(batch.stage_seconds)
+    for stage, seconds in enumerate(batch.stage_seconds):
+      self.stage_seconds[stage] += seconds
+    for seconds in batch.latencies:
+      bucket = latency_bucket(seconds)
+      self.latencies[bucket] = self.latencies.get(bucket, 0) + 1
+
+  def latency_percentile(self, p: float) -> float:
+    """The nearest-rank percentile latency, in seconds, rounded up."""
+    rank = max(1, math.ceil(p / 100 * sum(self.latencies.values())))
+    for bucket in sorted(self.latencies):
+      rank -= self.latencies[bucket]
+      if rank <= 0:
+        return LATENCY_BASE * LATENCY_RATIO**bucket
+    raise ValueError("No latencies have been recorded.")
+
+  def to_json(self) -> dict:
+    return dataclasses.asdict(self)
+
+  @classmethod
+  def from_json(cls, jsn: dict) -> "Report":
+    report = cls(**jsn)
+    # json turns the bucket numbers into strings
+    report.latencies = {int(k): v for k, v in report.latencies.items()}
+    return report
+
+  @property
+  def packets_per_second(self) -> float:
+    return self.packets / self.seconds if self.seconds else 0.0
+
+  def lines(self) -> Iterator[str]:
+    yield "%s packets (%s errors) in %.3fs: %.1f packets/s" % (
+        self.packets,
+        self.errors,
+        self.seconds,
+        self.packets_per_second,
+    )
+    if self.latencies:
+      yield "%s latency (us): %s" % (
+          "batch" if self.lockstep else "packet",
+          ", ".join(
+              "p%s %.1f" % (p, self.latency_percentile(p) * 1e6)
+              for p in cost_model.PERCENTILES
+          ),
+      )
+    total = sum(self.stage_seconds)
+    for stage, seconds in enumerate(self.stage_seconds):
+      yield "stage %s: %.3fs (%.1f%%)" % (
+          stage,
+          seconds,
+          100 * seconds / total if total else 0.0,
+      )
+
+
+class Output:
+  """Writes the results of each batch, in order, to JSON Lines or .npy.
+
+  Row i of the .npy output holds the result of packets[i].
+  """
+
+  def __init__(
+      self,
+      packets: range,
+      state: d.MachineState,
+      tcam: d.TCAM,
+      jsonl: str | None = None,
+      npy: str | None = None,
+      resume_offset: int | None = None,
+      headers: Sequence[str] | None = None,
+  ):
+    """Open the outputs.
+
+    headers names the headers recorded in the .npy output, by default those
+    of columnar.header_names. If resume_offset is given, the outputs are
+    reopened instead of being created, and the JSON Lines output is truncated
+    to resume_offset bytes.
+    """
+    self._first = packets.start
+    self._jsonl: IO[str] | None = None
+    self._sink = None
+    if jsonl:
+      if resume_offset is None:
+        self._jsonl = open(jsonl, "w")
+      else:
+        self._jsonl = open(jsonl, "r+")
+        self._jsonl.truncate(resume_offset)
+        self._jsonl.seek(resume_offset)
+    if npy:
+      # columnar needs numpy, which replays without --npy don't
+      # pylint: disable-next=import-outside-toplevel
+      from interpreter import columnar
+
+      if headers is None:
+        headers = columnar.header_names(tcam)
+      self._sink = columnar.ResultSink(
+          npy,
+          len(packets),
+          state,
+          headers,
+          resume=resume_offset is not None,
+      )
+
+  def write(self, start: int, results: list[PacketResult]) -> None:
+    for i, result in enumerate(results, start):
+      if self._jsonl is not None:
+        self._jsonl.write(result.to_json(i) + "\n")
+      if self._sink is not None:
+        self._sink.write_values(
+            i - self._first,
+            result.error is not None,
+            result.cursor,
+            result.stage,
+            result.stores,
+            result.headers,
+        )
+
+  def flush(self) -> int:
+    """Flush the outputs to disk. Returns the size of the JSON Lines output."""
+    offset = 0
+    if self._jsonl is not None:
+      self._jsonl.flush()
+      os.fsync(self._jsonl.fileno())
+      offset = self._jsonl.tell()
+    if self._sink is not None:
+      self._sink.flush()
+    return offset
+
+  def close(self) -> None:
+    if self._jsonl is not None:
+      self._jsonl.close()
+    if self._sink is not None:
+      self._sink.flush()
+
+
+CHECKPOINT_VERSION = 2
+
+
+@dataclasses.dataclass
+class Checkpoint:
+  """How far a replay got. Written as json."""
+
+  # Identify the replay, so that a checkpoint isn't resumed by another one
+  ir_file: str
+  config_file: str
+  num_packets: int
+  shard: int
+  num_shards: int
+  jsonl: str | None
+  npy: str | None
+  corpus_size: int
+  corpus_sha256: str
+  # The first packet of the shard whose result hasn't been written
+  next_packet: int = 0
+  # The size of the JSON Lines output, up to next_packet
+  jsonl_offset: int = 0
+  report: Report = dataclasses.field(default_factory=Report)
+
+  def same_replay(self, other: "Checkpoint") -> bool:
+    fields = (
+        "ir_file",
+        "config_file",
+        "num_packets",
+        "shard",
+        "num_shards",
+        "jsonl",
+        "npy",
+        "corpus_size",
+        "corpus_sha256",
+    )
+    return all(getattr(self, f) == getattr(other, f) for f in fields)
+
+  def save(self, path: str) -> None:
+    """Atomically replace the checkpoint file."""
+    jsn = dataclasses.asdict(self)
+    jsn["version"] = CHECKPOINT_VERSION
+    jsn["report"] = self.report.to_json()
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+      json.dump(jsn, f)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def file_sha256(path: str) -> str:
+  sha = hashlib.sha256()
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+      sha.update(chunk)
+  return sha.hexdigest()
+
+
+def load_checkpoint(path: str) -> Checkpoint | None:
+  """Read a checkpoint file, or return None if there isn't one."""
+  try:
+    with open(path) as f:
+      jsn = json.load(f)
+  except FileNotFoundError:
+    return None
+  version = jsn.pop("version", None)
+  if version != CHECKPOINT_VERSION:
+    raise ValueError(
+        "%s has checkpoint version %s, but only version %s is supported."
+        % (path, version, CHECKPOINT_VERSION)
+    )
+  jsn["report"] = Report.from_json(jsn["report"])
+  return Checkpoint(**jsn)
+
+
+def run_ordered(
+    executor: concurrent.futures.Executor | None,
+    ranges: Iterator[tuple[int, int]],
+    window: int,
+) -> Iterator[tuple[int, BatchResult]]:
+  """Run batches, yielding their results in order.
+
+  At most window batches are submitted at a time, so that replays of huge
+  corpora don't queue up every batch at once. Without an executor, the batches
+  are run in this process.
+  """
+  if executor is None:
+    for start, end in ranges:
+      yield start, run_batch(start, end)
+    return
+  pending = collections.deque()
+  for start, end in ranges:
+    pending.append((start, executor.submit(run_batch, start, end)))
+    if len(pending) >= window:
+      first, future = pending.popleft()
+      yield first, future.result()
+  while pending:
+    first, future = pending.popleft()
+    yield first, future.result()
+
+
+def replay(
+    ir_file: str,
+    config_file: str,
+    corpus_file: str,
+    jobs: int = 1,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    lockstep: bool = False,
+    jsonl: str | None = None,
+    npy: str | None = None,
+    shard: int = 0,
+    num_shards: int = 1,
+    checkpoint: str | None = None,
+    checkpoint_every: int = 100,
+    headers: Sequence[str] | None = None,
+) -> Report:
+  """Replay the packets of a corpus, writing results to jsonl and/or npy.
+
+  Args:
+    ir_file: path to the IR program, in json or binary format
+    config_file: path to a json file holding the hardware configuration
+    corpus_file: path to a corpus file (see corpus.py)
+    jobs: the number of worker processes. If 0, packets are interpreted in
+      this process instead.
+    batch_size: the number of packets in each unit of work
+    lockstep: if True, interpret each batch with lockstep.interp_batch
+    jsonl: if given, the path to write JSON Lines results to
+    npy: if given, the path to write columnar results to
+    shard: which of num_shards equal parts of the corpus to replay
+    num_shards: the number of parts the corpus is split into
+    checkpoint: if given, the path of a checkpoint file. If the file exists,
+      the replay resumes from it.
+    checkpoint_every: how often (in batches) to write the checkpoint
+    headers: the headers to record in the npy output, by default those
+      extracted by the first table (see columnar.header_names)
+
+  Returns:
+    A summary of the replay (including any part replayed before resuming).
+  """
+  if batch_size <= 0:
+    raise ValueError("batch_size must be positive, not %s." % batch_size)
+  # Load here too, so that errors in the program are reported immediately
+  tcam, state = server.load_program(ir_file, config_file)
+  with corpus.Corpus(corpus_file) as packets:
+    shard_packets = packets.shard(shard, num_shards)
+    progress = Checkpoint(
+        ir_file,
+        config_file,
+        len(packets),
+        shard,
+        num_shards,
+        jsonl,
+        npy,
+        os.path.getsize(corpus_file),
+        # Only checkpoints need the hash, which costs a pass over the corpus
+        "" if checkpoint is None else file_sha256(corpus_file),
+    )
+  progress.next_packet = shard_packets.start
+  progress.report = Report(stage_seconds=[0.0] * len(tcam), lockstep=lockstep)
+  resume_offset = None
+  if checkpoint is not None:
+    saved = load_checkpoint(checkpoint)
+    if saved is not None:
+      if not saved.same_replay(progress):
+        raise ValueError(
+            "Checkpoint %s was written by a different replay." % checkpoint
+        )
+      progress = saved
+      progress.report.lockstep = lockstep
+      resume_offset = progress.jsonl_offset
+  report = progress.report
+  ranges = batch_ranges(
+      range(progress.next_packet, shard_packets.stop), batch_size
+  )
+
+  output = Output(
+      shard_packets, state, tcam, jsonl, npy, resume_offset, headers
+  )
+  start = time.perf_counter()
+  initargs = (ir_file, config_file, corpus_file, lockstep)
+  executor = None
+  try:
+    if jobs == 0:
+      init_worker(*initargs)
+    else:
+      executor = concurrent.futures.ProcessPoolExecutor(
+          max_workers=jobs, initializer=init_worker, initargs=initargs
+      )
+    for i, (first, batch) in enumerate(
+        run_ordered(executor, ranges, 2 * max(jobs, 1)), 1
+    ):
+      output.write(first, batch.results)
+      report.add(batch)
+      progress.next_packet = first + len(batch.results)
+      if checkpoint is not None and i % checkpoint_every == 0:
+        now = time.perf_counter()
+        report.seconds += now - start
+        start = now
+        progress.jsonl_offset = output.flush()
+        progress.save(checkpoint)
+    report.seconds += time.perf_counter() - start
+    if checkpoint is not None:
+      progress.jsonl_offset = output.flush()
+      progress.save(checkpoint)
+  finally:
+    if jobs == 0 and worker is not None:
+      worker.packets.close()
+    elif executor is not None:
+      executor.shutdown(cancel_futures=True)
+    output.close()
+  return report
+
+
+def read_hex(path: str) -> Iterator[str]:
+  with open(path) as f:
+    for line in f:
+      line = line.strip()
+      if line and not line.startswith("#"):
+        yield line
+
+
+def main(argv: list[str] | None = None) -> None:
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument("--ir", required=True, help="IR program (json or binary)")
+  parser.add_argument("--config", required=True, help="Configuration file")
+  source = parser.add_mutually_exclusive_group(required=True)
+  source.add_argument("--corpus", help="Corpus file")
+  source.add_argument("--pcap", help="pcap file")
+  source.add_argument("--hex", help="Text file of packets, one per line")
+  parser.add_argument("--jobs", type=int, default=1, help="Worker processes")
+  parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+  parser.add_argument(
+      "--lockstep",
+      action="store_true",
+      help="Interpret each batch with the lockstep interpreter (needs numpy)",
+  )
+  parser.add_argument("--jsonl", help="Write results as JSON Lines")
+  parser.add_argument("--npy", help="Write results as a .npy array")
+  parser.add_argument(
+      "--header",
+      action="append",
+      help="A header to record in the .npy array (may be repeated)",
+  )
+  parser.add_argument("--shard", type=int, default=0)
+  parser.add_argument("--num-shards", type=int, default=1)
+  parser.add_argument(
+      "--checkpoint", help="Checkpoint file, resumed from if it exists"
+  )
+  parser.add_argument(
+      "--checkpoint-every",
+      type=int,
+      default=100,
+      help="Batches between checkpoints",
+  )
+  args = parser.parse_args(argv)
+
+  with tempfile.TemporaryDirectory() as tmp:
+    corpus_file = args.corpus
+    if args.pcap:
+      corpus_file = os.path.join(tmp, "packets.corpus")
+      corpus.from_pcap(args.pcap, corpus_file)
+    elif args.hex:
+      corpus_file = os.path.join(tmp, "packets.corpus")
+      corpus.from_hex(read_hex(args.hex), corpus_file)
+    report = replay(
+        args.ir,
+        args.config,
+        corpus_file,
+        jobs=args.jobs,
+        batch_size=args.batch_size,
+        lockstep=args.lockstep,
+        jsonl=args.jsonl,
+        npy=args.npy,
+        shard=args.shard,
+        num_shards=args.num_shards,
+        checkpoint=args.checkpoint,
+        checkpoint_every=args.checkpoint_every,
+        headers=args.header,
+    )
+  for line in report.lines():
+    print(line, file=sys.stderr)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,270 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the replay tool."""
+
+import contextlib
+import io
+import itertools
+import json
+import os
+import struct
+import tempfile
+import unittest
+from unittest import mock
+from interpreter import columnar
+from interpreter import config_parser
+from interpreter import corpus
+from interpreter import interp
+from interpreter import ir_parser
+from interpreter import replay
+import interpreter.datatypes as d
+
+IR_FILE = "interpreter/test_files/simple_ip_parser.json"
+CONFIG_FILE = "interpreter/test_files/simple_ip_config.json"
+
+ETH_IPV4 = "0x123456654321abcdeffedcba0800"
+IPV4 = "05112233445566778899aabb%sccddeeff"
+PACKETS = [
+    ETH_IPV4 + IPV4 % "76543210",
+    ETH_IPV4 + IPV4 % "7f000001",
+    "0x123456654321abcdeffedcba86dd" + "00" * 40,
+    ETH_IPV4 + "0511",  # Too short to hold the IPv4 header
+] * 5
+
+
+class ReplayTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tmp.cleanup)
+    self.corpus = self.path("packets.corpus")
+    corpus.from_hex(PACKETS, self.corpus)
+
+  def path(self, name: str) -> str:
+    return os.path.join(self.tmp.name, name)
+
+  def read_jsonl(self, path: str) -> list[dict]:
+    with open(path) as f:
+      return [json.loads(line) for line in f]
+
+  def check_results(self, results: list[dict]) -> None:
+    self.assertEqual([r["packet"] for r in results], list(range(len(PACKETS))))
+    for packet, result in zip(PACKETS, results):
+      try:
+        expected = interp.interp(IR_FILE, CONFIG_FILE, packet)
+      except RuntimeError as e:
+        self.assertEqual(result["error"], str(e))
+        continue
+      self.assertIsNone(result["error"])
+      self.assertEqual(result["cursor"], expected.cursor)
+      self.assertEqual(result["stage"], expected.stage)
+      self.assertEqual(
+          result["stores"], {"state": hex(expected.stores["state"].value)}
+      )
+      self.assertEqual(
+          result["headers"],
+          {name: list(ref) for name, ref in expected.headers.refs().items()},
+      )
+
+  def test_run_packet(self):
+    tcam = ir_parser.parse_ir(IR_FILE, True)
+    state = config_parser.parse(CONFIG_FILE, True)
+    for packet, expected in ((PACKETS[0], [1, 1, 1]), (PACKETS[3], [1, 1, 0])):
+      stage_seconds = [0.0] * len(tcam)
+      # Each call to the clock advances it by a second
+      with mock.patch.object(
+          replay.time, "perf_counter", side_effect=itertools.count()
+      ):
+        result = replay.run_packet(
+            tcam, interp.copy_state(state), d.Data(packet), stage_seconds
+        )
+      self.assertEqual(stage_seconds, expected)
+      self.assertEqual(result.error is None, packet == PACKETS[0])
+
+  def test_in_process(self):
+    jsonl = self.path("results.jsonl")
+    npy = self.path("results.npy")
+    report = replay.replay(
+        IR_FILE,
+        CONFIG_FILE,
+        self.corpus,
+        jobs=0,
+        batch_size=3,
+        jsonl=jsonl,
+        npy=npy,
+        headers=["hdr.ethernet", "hdr.ipv4"],
+    )
+    self.assertEqual(report.packets, len(PACKETS))
+    self.assertEqual(report.errors, 5)
+    self.assertEqual(sum(report.latencies.values()), len(PACKETS))
+    self.assertEqual(len(report.stage_seconds), 3)
+    self.assertGreater(report.packets_per_second, 0)
+    results = self.read_jsonl(jsonl)
+    self.check_results(results)
+    columns = columnar.load(npy)
+    self.assertEqual(
+        list(columns["error"]), [int(r["error"] is not None) for r in results]
+    )
+    self.assertEqual(list(columns["cursor"]), [r["cursor"] for r in results])
+    self.assertEqual(
+        list(columns["header.hdr.ipv4.length"]),
+        [r["headers"].get("hdr.ipv4", [-1, -1])[1] for r in results],
+    )
+
+  def test_workers(self):
+    expected = self.path("expected.jsonl")
+    replay.replay(IR_FILE, CONFIG_FILE, self.corpus, jobs=0, jsonl=expected)
+    for lockstep in (False, True):
+      jsonl = self.path("results.jsonl")
+      report = replay.replay(
+          IR_FILE,
+          CONFIG_FILE,
+          self.corpus,
+          jobs=2,
+          batch_size=4,
+          lockstep=lockstep,
+          jsonl=jsonl,
+      )
+      self.assertEqual(report.packets, len(PACKETS))
+      self.assertEqual(self.read_jsonl(jsonl), self.read_jsonl(expected))
+
+  def test_resume(self):
+    expected = self.path("expected.jsonl")
+    replay.replay(IR_FILE, CONFIG_FILE, self.corpus, jobs=0, jsonl=expected)
+    jsonl = self.path("results.jsonl")
+    npy = self.path("results.npy")
+    checkpoint = self.path("checkpoint.json")
+    kwargs = dict(
+        jobs=0,
+        batch_size=3,
+        jsonl=jsonl,
+        npy=npy,
+        checkpoint=checkpoint,
+        checkpoint_every=2,
+    )
+    run_batch = replay.run_batch
+    calls = 0
+
+    def crash_after_five_batches(start, end):
+      nonlocal calls
+      calls += 1
+      if calls > 5:
+        raise KeyboardInterrupt()
+      return run_batch(start, end)
+
+    with mock.patch.object(replay, "run_batch", crash_after_five_batches):
+      self.assertRaises(
+          KeyboardInterrupt,
+          replay.replay,
+          IR_FILE,
+          CONFIG_FILE,
+          self.corpus,
+          **kwargs,
+      )
+    # The results of the fifth batch were written after the last checkpoint
+    saved = replay.load_checkpoint(checkpoint)
+    self.assertEqual(saved.next_packet, 12)
+    self.assertEqual(saved.report.packets, 12)
+    self.assertEqual(len(self.read_jsonl(jsonl)), 15)
+
+    report = replay.replay(IR_FILE, CONFIG_FILE, self.corpus, **kwargs)
+    self.assertEqual(report.packets, len(PACKETS))
+    self.assertEqual(report.errors, 5)
+    self.assertEqual(sum(report.latencies.values()), len(PACKETS))
+    self.assertEqual(self.read_jsonl(jsonl), self.read_jsonl(expected))
+    self.check_results(self.read_jsonl(jsonl))
+    columns = columnar.load(npy)
+    self.assertEqual(
+        list(columns["cursor"]), [r["cursor"] for r in self.read_jsonl(jsonl)]
+    )
+    # Resuming a finished replay does nothing
+    report = replay.replay(IR_FILE, CONFIG_FILE, self.corpus, **kwargs)
+    self.assertEqual(report.packets, len(PACKETS))
+    self.assertEqual(self.read_jsonl(jsonl), self.read_jsonl(expected))
+
+    # Checkpoints can't be resumed by a different replay
+    self.assertRaises(
+        ValueError,
+        replay.replay,
+        IR_FILE,
+        CONFIG_FILE,
+        self.corpus,
+        **kwargs,
+        num_shards=2,
+    )
+    # ... nor against a different corpus, even one of the same length
+    other = self.path("other.corpus")
+    corpus.from_hex(PACKETS[1:] + PACKETS[:1], other)
+    with self.assertRaisesRegex(ValueError, "different replay"):
+      replay.replay(IR_FILE, CONFIG_FILE, other, **kwargs)
+
+  def test_shards(self):
+    expected = self.path("expected.jsonl")
+    replay.replay(IR_FILE, CONFIG_FILE, self.corpus, jobs=0, jsonl=expected)
+    results = []
+    for shard in range(3):
+      jsonl = self.path("shard%s.jsonl" % shard)
+      replay.replay(
+          IR_FILE,
+          CONFIG_FILE,
+          self.corpus,
+          jobs=0,
+          jsonl=jsonl,
+          shard=shard,
+          num_shards=3,
+      )
+      results += self.read_jsonl(jsonl)
+    self.assertEqual(results, self.read_jsonl(expected))
+
+  def test_latency_percentile(self):
+    report = replay.Report()
+    report.add(replay.BatchResult([], [], [1e-6] * 9 + [1e-3]))
+    self.assertAlmostEqual(report.latency_percentile(50), 1e-6, delta=5e-8)
+    self.assertAlmostEqual(report.latency_percentile(100), 1e-3, delta=5e-5)
+    self.assertEqual(
+        replay.Report.from_json(json.loads(json.dumps(report.to_json()))),
+        report,
+    )
+
+  def test_main(self):
+    hex_file = self.path("packets.txt")
+    with open(hex_file, "w") as f:
+      f.write("# A comment\n\n" + "\n".join(PACKETS) + "\n")
+    pcap_file = self.path("packets.pcap")
+    with open(pcap_file, "wb") as f:
+      f.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 1500, 1))
+      for packet in PACKETS:
+        data = bytes.fromhex(packet[2:])
+        f.write(struct.pack("<IIII", 0, 0, len(data), len(data)))
+        f.write(data)
+    for source in (["--hex", hex_file], ["--pcap", pcap_file]):
+      jsonl = self.path("results.jsonl")
+      stderr = io.StringIO()
+      with contextlib.redirect_stderr(stderr):
+        replay.main(
+            ["--ir", IR_FILE, "--config", CONFIG_FILE, "--jobs", "0"]
+            + source
+            + ["--jsonl", jsonl]
+        )
+      self.check_results(self.read_jsonl(jsonl))
+      summary = stderr.getvalue()
+      self.assertIn("%s packets (5 errors)" % len(PACKETS), summary)
+      self.assertIn("packet latency (us): p50", summary)
+      self.assertIn("stage 2:", summary)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,382 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A long-running local service that parses packets with a preloaded program.
+
+The server loads an IR program and configuration once, then listens on a Unix
+socket or a loopback TCP port. Clients send packets and receive the final
+machine state for each. Packets that arrive close together (from one or many
+connections) are grouped into micro-batches, which are handed to a pool of
+worker processes.
+
+Requests are a u32 packet length in bits, followed by the packet's bits padded
+to a whole number of bytes. Each response is a u32 length followed by:
+
+  status:  u8, 0 if the packet was parsed and 1 if the interpreter raised an
+           error
+  on error: the error message
+  otherwise:
+    cursor, stage: u32 each
+    headers: u16 count, then for each header its name and its value
+    stores: u16 count, then for each persistent store its name and its value
+
+where names are a u16 length followed by utf-8 bytes, and values are a u32
+length in bits followed by the bits padded to a whole number of bytes. All
+integers are little-endian, and responses on a connection are sent in the same
+order as its requests.
+
+Run with e.g.
+  python -m interpreter.server --ir prog.json --config config.json \
+      --unix /tmp/cairn.sock
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import dataclasses
+import struct
+
+from interpreter import binary_ir
+from interpreter import config_parser
+from interpreter import interp
+from interpreter import ir_parser
+import interpreter.datatypes as d
+
+u8 = struct.Struct("<B")
+u16 = struct.Struct("<H")
+u32 = struct.Struct("<I")
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+
+def load_program(
+    ir_file: str, config_file: str
+) -> tuple[d.TCAM, d.MachineState]:
+  """Load a program (json or binary IR) and the initial state for its config."""
+  state = config_parser.parse(config_file, True)
+  if binary_ir.is_binary_ir(ir_file):
+    # Rules are decoded (and planned) on first use
+    tcam = binary_ir.read_binary(ir_file)
+  else:
+    tcam = ir_parser.parse_ir(ir_file, True)
+    interp.plan_rules(tcam)
+  interp.validate_keys_patterns(tcam, state)
+  return tcam, state
+
+
+def encode_name(name: str) -> bytes:
+  encoded = name.encode("utf-8")
+  return u16.pack(len(encoded)) + encoded
+
+
+def encode_data(data: d.Data) -> bytes:
+  return u32.pack(data.length) + data.tobytes()
+
+
+def encode_state(state: d.MachineState) -> bytes:
+  """Encode the parts of a final state that are visible after parsing."""
+  parts = [u8.pack(STATUS_OK), u32.pack(state.cursor), u32.pack(state.stage)]
+  parts.append(u16.pack(len(state.headers)))
+  for name, value in state.headers.items():
+    parts.append(encode_name(name) + encode_data(value))
+  persistent = [
+      (name, store) for name, store in state.stores.items() if store.persistent
+  ]
+  parts.append(u16.pack(len(persistent)))
+  for name, store in persistent:
+    parts.append(encode_name(name) + encode_data(store.data()))
+  body = b"".join(parts)
+  return u32.pack(len(body)) + body
+
+
+def encode_error(message: str) -> bytes:
+  encoded = message.encode("utf-8")
+  body = u8.pack(STATUS_ERROR) + u32.pack(len(encoded)) + encoded
+  return u32.pack(len(body)) + body
+
+
+@dataclasses.dataclass
+class Response:
+  """A decoded response. If error is set, the other fields are meaningless."""
+
+  error: str | None = None
+  cursor: int = 0
+  stage: int = 0
+  headers: dict[str, d.Data] = dataclasses.field(default_factory=dict)
+  stores: dict[str, d.Data] = dataclasses.field(default_factory=dict)
+
+
+def decode_response(body: bytes) -> Response:
+  """Decode a response body (i.e. without its length prefix)."""
+  pos = 0
+
+  def read(s: struct.Struct) -> int:
+    nonlocal pos
+    (value,) = s.unpack_from(body, pos)
+    pos += s.size
+    return value
+
+  def read_bytes(n: int) -> bytes:
+    nonlocal pos
+    pos += n
+    return body[pos - n : pos]
+
+  def read_entries() -> dict[str, d.Data]:
+    entries = {}
+    for _ in range(read(u16)):
+      name = read_bytes(read(u16)).decode("utf-8")
+      num_bits = read(u32)
+      value = read_bytes((num_bits + 7) // 8)
+      entries[name] = d.Data(bytes=value, length=num_bits)
+    return entries
+
+  if read(u8) == STATUS_ERROR:
+    return Response(error=read_bytes(read(u32)).decode("utf-8"))
+  response = Response(cursor=read(u32), stage=read(u32))
+  response.headers = read_entries()
+  response.stores = read_entries()
+  return response
+
+
+def encode_packet(packet: d.Data) -> bytes:
+  return encode_data(packet)
+
+
+# State of each worker process, set up once by init_worker.
+worker_program: tuple[d.TCAM, d.MachineState] | None = None
+
+
+def init_worker(ir_file: str, config_file: str) -> None:
+  global worker_program
+  worker_program = load_program(ir_file, config_file)
+
+
+def run_batch(packets: list[tuple[bytes, int]]) -> list[bytes]:
+  """Interpret a batch of packets in a worker, returning encoded responses."""
+  tcam, initial_state = worker_program
+  responses = []
+  for packet_bytes, num_bits in packets:
+    state = interp.copy_state(initial_state)
+    try:
+      interp.interp_tcam(
+          tcam, state, d.Data(bytes=packet_bytes, length=num_bits)
+      )
+    except RuntimeError as e:
+      responses.append(encode_error(str(e)))
+    except Exception as e:  # pylint: disable=broad-except
+      # Only this packet failed, so the rest of the batch still gets answers.
+      responses.append(
+          encode_error("Internal error: %s: %s" % (type(e).__name__, e))
+      )
+    else:
+      responses.append(encode_state(state))
+  return responses
+
+
+class Batcher:
+  """Groups submitted packets into batches and runs them on an executor.
+
+  A batch is dispatched when it reaches max_batch packets, or max_delay
+  seconds after its first packet arrived, whichever comes first.
+  """
+
+  def __init__(
+      self,
+      executor: concurrent.futures.Executor,
+      max_batch: int,
+      max_delay: float,
+  ):
+    self._executor = executor
+    self._max_batch = max_batch
+    self._max_delay = max_delay
+    self._pending: list[tuple[tuple[bytes, int], asyncio.Future]] = []
+    self._timer: asyncio.TimerHandle | None = None
+    # The event loop only keeps weak references to tasks, so we hold on to
+    # the running batches ourselves.
+    self._running: set[asyncio.Task] = set()
+
+  def submit(self, packet: bytes, num_bits: int) -> asyncio.Future:
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    self._pending.append(((packet, num_bits), future))
+    if len(self._pending) >= self._max_batch:
+      self._flush()
+    elif self._timer is None:
+      self._timer = loop.call_later(self._max_delay, self._flush)
+    return future
+
+  def _flush(self) -> None:
+    if self._timer is not None:
+      self._timer.cancel()
+      self._timer = None
+    batch, self._pending = self._pending, []
+    if batch:
+      task = asyncio.create_task(self._run(batch))
+      self._running.add(task)
+      task.add_done_callback(self._running.discard)
+
+  async def _run(self, batch) -> None:
+    loop = asyncio.get_running_loop()
+    try:
+      responses = await loop.run_in_executor(
+          self._executor, run_batch, [packet for packet, _ in batch]
+      )
+    except Exception as e:  # pylint: disable=broad-except
+      for _, future in batch:
+        if not future.done():
+          future.set_exception(e)
+      return
+    for (_, future), response in zip(batch, responses):
+      if not future.done():
+        future.set_result(response)
+
+
+class Server:
+  """Accepts connections and forwards their packets to a Batcher."""
+
+  def __init__(
+      self,
+      ir_file: str,
+      config_file: str,
+      jobs: int = 1,
+      max_batch: int = 64,
+      max_delay: float = 0.001,
+  ):
+    """Load the program, and start the worker processes.
+
+    Args:
+      ir_file: path to the IR program, in json or binary format
+      config_file: path to a json file holding the hardware configuration
+      jobs: the number of worker processes. If 0, packets are interpreted in a
+        thread of this process instead.
+      max_batch: the largest number of packets in one batch
+      max_delay: how long (in seconds) to wait for a batch to fill up
+    """
+    if jobs == 0:
+      init_worker(ir_file, config_file)
+      self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    else:
+      # Load once here so that errors in the program are reported immediately
+      tcam, _ = load_program(ir_file, config_file)
+      if isinstance(tcam, binary_ir.BinaryTCAM):
+        tcam.close()
+      self._executor = concurrent.futures.ProcessPoolExecutor(
+          max_workers=jobs,
+          initializer=init_worker,
+          initargs=(ir_file, config_file),
+      )
+    self._batcher = Batcher(self._executor, max_batch, max_delay)
+    self._server: asyncio.AbstractServer | None = None
+
+  async def start_unix(self, path: str) -> None:
+    self._server = await asyncio.start_unix_server(self._handle, path=path)
+
+  async def start_tcp(self, port: int = 0) -> int:
+    """Listen on the loopback interface. Returns the port being used."""
+    self._server = await asyncio.start_server(
+        self._handle, host="127.0.0.1", port=port
+    )
+    return self._server.sockets[0].getsockname()[1]
+
+  async def serve_forever(self) -> None:
+    await self._server.serve_forever()
+
+  async def close(self) -> None:
+    if self._server is not None:
+      self._server.close()
+      await self._server.wait_closed()
+    # Waiting for the workers to finish blocks, so keep it off the event loop
+    await asyncio.get_running_loop().run_in_executor(
+        None, self._executor.shutdown
+    )
+
+  async def _handle(
+      self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+  ) -> None:
+    # Requests are read and submitted as fast as they arrive, while responses
+    # are written in request order by a separate task.
+    responses: asyncio.Queue[asyncio.Future | None] = asyncio.Queue()
+
+    async def respond():
+      while (future := await responses.get()) is not None:
+        try:
+          writer.write(await future)
+        except Exception as e:  # pylint: disable=broad-except
+          writer.write(encode_error("Internal error: %s" % e))
+        await writer.drain()
+
+    responder = asyncio.create_task(respond())
+    try:
+      while True:
+        (num_bits,) = u32.unpack(await reader.readexactly(u32.size))
+        packet = await reader.readexactly((num_bits + 7) // 8)
+        responses.put_nowait(self._batcher.submit(packet, num_bits))
+    except (asyncio.IncompleteReadError, ConnectionError):
+      pass  # The client closed the connection
+    finally:
+      responses.put_nowait(None)
+      try:
+        await responder
+      except ConnectionError:
+        pass
+      writer.close()
+
+
+async def request(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    packet: d.Data,
+) -> Response:
+  """Client helper: send one packet and wait for its response."""
+  writer.write(encode_packet(packet))
+  await writer.drain()
+  (length,) = u32.unpack(await reader.readexactly(u32.size))
+  return decode_response(await reader.readexactly(length))
+
+
+async def serve(args: argparse.Namespace) -> None:
+  server = Server(
+      args.ir,
+      args.config,
+      jobs=args.jobs,
+      max_batch=args.max_batch,
+      max_delay=args.max_delay_ms / 1000,
+  )
+  if args.unix:
+    await server.start_unix(args.unix)
+  else:
+    port = await server.start_tcp(args.port)
+    print("Listening on 127.0.0.1:%s" % port, flush=True)
+  try:
+    await server.serve_forever()
+  finally:
+    await server.close()
+
+
+def main(argv: list[str] | None = None) -> None:
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument("--ir", required=True, help="IR program (json or binary)")
+  parser.add_argument("--config", required=True, help="Configuration file")
+  listen = parser.add_mutually_exclusive_group(required=True)
+  listen.add_argument("--unix", help="Path of a Unix socket to listen on")
+  listen.add_argument("--port", type=int, help="Loopback TCP port to listen on")
+  parser.add_argument("--jobs", type=int, default=1, help="Worker processes")
+  parser.add_argument("--max-batch", type=int, default=64)
+  parser.add_argument("--max-delay-ms", type=float, default=1.0)
+  asyncio.run(serve(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,144 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the packet-parsing service."""
+
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+from interpreter import binary_ir
+from interpreter import interp
+from interpreter import ir_parser
+from interpreter import server
+import interpreter.datatypes as d
+
+IR_FILE = "interpreter/test_files/simple_ip_parser.json"
+CONFIG_FILE = "interpreter/test_files/simple_ip_config.json"
+
+ETH_IPV4 = "0x123456654321abcdeffedcba0800"
+IPV4 = "05112233445566778899aabb%sccddeeff"
+PACKETS = [
+    ETH_IPV4 + IPV4 % "76543210",
+    ETH_IPV4 + IPV4 % "7f000001",
+    "0x123456654321abcdeffedcba86dd" + "00" * 40,
+    ETH_IPV4 + "0511",  # Too short to hold the IPv4 header
+]
+
+
+class ServerTest(unittest.IsolatedAsyncioTestCase):
+
+  def check_response(self, packet: str, response: server.Response) -> None:
+    try:
+      expected = interp.interp(IR_FILE, CONFIG_FILE, packet)
+    except RuntimeError as e:
+      self.assertEqual(response.error, str(e))
+      return
+    self.assertIsNone(response.error)
+    self.assertEqual(response.cursor, expected.cursor)
+    self.assertEqual(response.stage, expected.stage)
+    self.assertEqual(response.headers, expected.headers)
+    self.assertEqual(
+        response.stores, {"state": expected.stores["state"].data()}
+    )
+
+  async def run_clients(self, connect, num_clients: int) -> None:
+    async def client():
+      reader, writer = await connect()
+      # Pipeline all the requests, then read the responses in order
+      for packet in PACKETS:
+        writer.write(server.encode_packet(d.Data(packet)))
+      for packet in PACKETS:
+        length = int.from_bytes(await reader.readexactly(4), "little")
+        body = await reader.readexactly(length)
+        self.check_response(packet, server.decode_response(body))
+      response = await server.request(reader, writer, d.Data(PACKETS[0]))
+      self.check_response(PACKETS[0], response)
+      writer.close()
+      await writer.wait_closed()
+
+    await asyncio.gather(*[client() for _ in range(num_clients)])
+
+  async def test_tcp_in_process(self):
+    srv = server.Server(IR_FILE, CONFIG_FILE, jobs=0, max_batch=3)
+    port = await srv.start_tcp()
+    try:
+      await self.run_clients(
+          lambda: asyncio.open_connection("127.0.0.1", port), 4
+      )
+    finally:
+      await srv.close()
+
+  async def test_unix_workers(self):
+    path = os.path.join(tempfile.mkdtemp(), "cairn.sock")
+    srv = server.Server(IR_FILE, CONFIG_FILE, jobs=2, max_delay=0.01)
+    await srv.start_unix(path)
+    try:
+      await self.run_clients(lambda: asyncio.open_unix_connection(path), 3)
+    finally:
+      await srv.close()
+      os.remove(path)
+
+  async def test_workers_binary_ir(self):
+    binary_file = os.path.join(tempfile.mkdtemp(), "prog.bin")
+    binary_ir.convert(IR_FILE, binary_file)
+    self.addCleanup(os.remove, binary_file)
+    close = binary_ir.BinaryTCAM.close
+    with mock.patch.object(
+        binary_ir.BinaryTCAM, "close", autospec=True, side_effect=close
+    ) as mock_close:
+      srv = server.Server(binary_file, CONFIG_FILE, jobs=1)
+    # The program loaded to check it for errors isn't left open
+    mock_close.assert_called_once()
+    port = await srv.start_tcp()
+    try:
+      reader, writer = await asyncio.open_connection("127.0.0.1", port)
+      response = await server.request(reader, writer, d.Data(PACKETS[0]))
+      self.check_response(PACKETS[0], response)
+      writer.close()
+      await writer.wait_closed()
+    finally:
+      await srv.close()
+
+  def test_run_batch_errors(self):
+    tcam, state = server.load_program(IR_FILE, CONFIG_FILE)
+    # Copying to a store that doesn't exist raises a KeyError
+    bad_rule = (
+        tcam[2][0][0],
+        {
+            ir_parser.parse_action(
+                {"type": "CopyData", "src": "1w32", "dst": "missing[0:31]"}
+            )
+        },
+    )
+    tcam[2] = [bad_rule] + tcam[2][1:]
+    server.worker_program = (tcam, state)
+    try:
+      responses = server.run_batch(
+          [(d.Data(p).tobytes(), d.Data(p).length) for p in PACKETS]
+      )
+    finally:
+      server.worker_program = None
+    self.assertEqual(len(responses), len(PACKETS))
+    decoded = [server.decode_response(r[4:]) for r in responses]
+    # Only the packet that reaches the rule fails
+    self.assertEqual(decoded[1].error, "Internal error: KeyError: 'missing'")
+    self.check_response(PACKETS[0], decoded[0])
+    self.check_response(PACKETS[2], decoded[2])
+    self.check_response(PACKETS[3], decoded[3])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,302 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compute how much of each packet a program can read: its minimum snaplen.
+
+The reach of a program is the furthest packet bit that any read, extraction or
+move can touch, counted from the start of the packet. A packet truncated to the
+reach gives exactly the same final state as the full packet (or the same
+error): every read lies within the truncated packet, so it sees the same bits.
+Capturing more than the reach is wasted.
+
+The analysis is static and ignores which rules can actually match, so it is an
+upper bound. Along a path, the cursor and each rule's reads are bounded from
+above. Values read at run time (e.g. a header length field used as a dynamic
+offset, or as the number of bits to move) are bounded by their widths, and by
+how the arithmetic on them can wrap around.
+
+A parse path is the sequence of rules taken through the stages. Rules that
+neither read the packet nor move the cursor don't change the reach, so they are
+left out of paths, and rules of a stage with the same effect on the reach are
+represented by the first of them.
+
+Run with e.g.
+  python -m interpreter.snaplen --ir prog.json --config config.json \\
+      --truncate full.corpus truncated.corpus
+"""
+
+import argparse
+import dataclasses
+import sys
+
+from interpreter import config_parser
+from interpreter import corpus
+from interpreter import interp
+from interpreter import ir_parser
+import interpreter.datatypes as d
+
+# Upper bound on the number of parse paths listed
+DEFAULT_MAX_PATHS = 1000
+# The largest snaplen libpcap accepts, in bytes. A program that can read
+# further than this needs full packets.
+MAX_SNAPLEN = 262144
+
+# An upper bound on a value, and on its width in bits
+Bound = tuple[int, int]
+
+
+def value_bound(exp: d.IntExp) -> Bound:
+  """Bound the value (and width) an expression can evaluate to."""
+  e = exp.exp
+  if isinstance(e, d.SizedInt):
+    return e.value, e.width
+  if isinstance(e, d.LocationExp):
+    loc = interp.constant_location(e)
+    if loc is not None:
+      width = loc.length
+    else:
+      start = e.start.exp.value if isinstance(e.start.exp, d.SizedInt) else 0
+      # A read that ends past MAX_SNAPLEN already needs full packets, so
+      # there is no need for a tighter bound.
+      end = min(value_bound(e.end)[0], 8 * MAX_SNAPLEN)
+      width = max(1, end - start + 1)
+    return (1 << width) - 1, width
+  left, left_width = value_bound(e.left)
+  right, right_width = value_bound(e.right)
+  if e.op == d.ArithOp.CAST:
+    # The width of a cast is its (constant) left operand
+    return min(right, (1 << left) - 1), left
+  # Wrapping around can only make the value smaller, but it is always less
+  # than 2^width.
+  limit = (1 << left_width) - 1
+  if e.op == d.ArithOp.PLUS:
+    return min(left + right, limit), left_width
+  if e.op == d.ArithOp.MINUS:
+    return limit, left_width
+  if e.op == d.ArithOp.LSHIFT:
+    if right >= left_width:
+      # Don't compute the shift: a dynamic shift amount can be huge
+      return limit, left_width
+    return min(left << right, limit), left_width
+  del right_width  # Unused: the result has the width of the left operand
+  return left, left_width
+
+
+def location_reach(locexp: d.LocationExp) -> int:
+  """Bound how many packet bits past the cursor a location can end at."""
+  return value_bound(locexp.end)[0] + 1
+
+
+def exp_reach(exp: d.IntExp | d.LocationExp, read: bool = True) -> int:
+  """Bound how many packet bits past the cursor an expression can read.
+
+  If read is False, a location expression is written rather than read (so
+  only its bounds are evaluated).
+  """
+  if isinstance(exp, d.LocationExp):
+    reach = max(exp_reach(exp.start), exp_reach(exp.end))
+    if read and exp.name == "packet":
+      reach = max(reach, location_reach(exp))
+    return reach
+  e = exp.exp
+  if isinstance(e, d.SizedInt):
+    return 0
+  if isinstance(e, d.LocationExp):
+    return exp_reach(e)
+  return max(exp_reach(e.left), exp_reach(e.right))
+
+
+@dataclasses.dataclass(frozen=True)
+class Effect:
+  """How a rule's actions use the packet, relative to the cursor."""
+
+  reach: int  # Bits past the cursor that the actions can read
+  move: int  # The most bits the actions can move the cursor by
+
+
+def rule_effect(actions: set[d.Action]) -> Effect:
+  reach = 0
+  move = 0
+  moves = 0
+  move_reach = 0
+  for action in actions:
+    if action.action_type == d.ActionType.MOVECURSOR:
+      moves += 1
+      move += value_bound(action.action_args)[0]
+      move_reach = max(move_reach, exp_reach(action.action_args))
+    elif action.action_type == d.ActionType.EXTRACTHEADER:
+      reach = max(reach, exp_reach(action.action_args[1]))
+    elif action.action_type == d.ActionType.COPYDATA:
+      value_exp, dstloc = action.action_args
+      reach = max(reach, exp_reach(value_exp), exp_reach(dstloc, read=False))
+  if moves > 1:
+    # Moves happen one after another, so each one may read from a cursor that
+    # the others have already moved.
+    move_reach += move
+  reach = max(reach, move_reach)
+  # The cursor can end up at the end of the packet
+  return Effect(max(reach, move), move)
+
+
+def always_matches(rule: d.Rule) -> bool:
+  return all(not p.mask_int for p in rule[0])
+
+
+def stage_options(table: d.Table) -> list[tuple[int | None, Effect]]:
+  """The distinct effects of a stage's rules, each with the first rule.
+
+  The rule is None when no rule matches.
+  """
+  options: dict[Effect, int | None] = {}
+  for idx, rule in enumerate(table):
+    options.setdefault(rule_effect(rule[1]), idx)
+    if always_matches(rule):
+      break  # The rules below it never match
+  else:
+    options.setdefault(Effect(0, 0), None)
+  return [(idx, effect) for effect, idx in options.items()]
+
+
+@dataclasses.dataclass(frozen=True)
+class PathReach:
+  """The reach of one parse path."""
+
+  # The (stage, rule) pairs of the path that read the packet or move the
+  # cursor, where rule is None when no rule matches
+  rules: tuple[tuple[int, int | None], ...]
+  reach: int  # In bits, from the start of the packet
+
+
+@dataclasses.dataclass
+class Analysis:
+  """The reach of a program, overall and along each parse path."""
+
+  reach: int  # In bits, from the start of the packet
+  paths: list[PathReach]  # In decreasing order of reach
+  complete: bool  # False if there were too many paths to list them all
+
+  @property
+  def snaplen(self) -> int:
+    """The recommended snaplen, in bytes."""
+    return min((self.reach + 7) // 8, MAX_SNAPLEN)
+
+
+def analyze(
+    tcam: d.TCAM, state: d.MachineState, max_paths: int = DEFAULT_MAX_PATHS
+) -> Analysis:
+  """Compute the reach of a program from the initial state."""
+  options = [
+      stage_options(tcam[stage]) for stage in range(state.stage, len(tcam))
+  ]
+  # The reach of the program is the largest reach of any path. Every rule's
+  # reach grows with the cursor, so it's enough to follow the largest cursor
+  # into each stage.
+  cursor = state.cursor
+  reach = cursor
+  for stage in options:
+    reach = max([reach] + [cursor + effect.reach for _, effect in stage])
+    cursor += max(effect.move for _, effect in stage)
+
+  paths = []
+  complete = True
+  # Depth-first search of (stage, cursor, reach, rules)
+  stack = [(0, state.cursor, state.cursor, ())]
+  while stack:
+    i, cursor, path_reach, rules = stack.pop()
+    if i == len(options):
+      if len(paths) == max_paths:
+        complete = False
+        break
+      paths.append(PathReach(rules, path_reach))
+      continue
+    for idx, effect in reversed(options[i]):
+      taken = rules
+      if effect != Effect(0, 0):
+        taken += ((state.stage + i, idx),)
+      stack.append((
+          i + 1,
+          cursor + effect.move,
+          max(path_reach, cursor + effect.reach),
+          taken,
+      ))
+  paths.sort(key=lambda p: -p.reach)
+  return Analysis(reach, paths, complete)
+
+
+def truncate_corpus(in_path: str, out_path: str, num_bits: int) -> int:
+  """Write a copy of a corpus with each packet cut to at most num_bits.
+
+  Returns the number of packets that were shortened.
+  """
+  truncated = 0
+  with corpus.Corpus(in_path) as packets, corpus.CorpusWriter(
+      out_path
+  ) as writer:
+    for idx in range(len(packets)):
+      length = packets.bit_length(idx)
+      if length > num_bits:
+        truncated += 1
+        length = num_bits
+      view = packets[idx]
+      writer.add(bytes(view[: (length + 7) // 8]), length)
+      view.release()
+  return truncated
+
+
+def format_rules(rules: tuple[tuple[int, int | None], ...]) -> str:
+  if not rules:
+    return "(no packet reads)"
+  return " -> ".join(
+      "stage %s %s" % (stage, "no match" if idx is None else "rule %s" % idx)
+      for stage, idx in rules
+  )
+
+
+def main(argv: list[str] | None = None) -> None:
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument("--ir", required=True, help="IR program")
+  parser.add_argument("--config", required=True, help="Configuration file")
+  parser.add_argument("--max-paths", type=int, default=DEFAULT_MAX_PATHS)
+  parser.add_argument(
+      "--truncate",
+      nargs=2,
+      metavar=("IN", "OUT"),
+      help="Truncate the packets of corpus IN to the snaplen, writing OUT",
+  )
+  args = parser.parse_args(argv)
+  tcam = ir_parser.parse_ir(args.ir, True)
+  state = config_parser.parse(args.config, True)
+  interp.validate_keys_patterns(tcam, state)
+  analysis = analyze(tcam, state, args.max_paths)
+  for path in analysis.paths:
+    print("%s bits: %s" % (path.reach, format_rules(path.rules)))
+  if not analysis.complete:
+    print("(only the first %s paths are listed)" % len(analysis.paths))
+  if analysis.snaplen == MAX_SNAPLEN:
+    print("The program can read past any snaplen: capture full packets.")
+  else:
+    print(
+        "Recommended snaplen: %s bytes (the program reads at most %s bits)."
+        % (analysis.snaplen, analysis.reach)
+    )
+  if args.truncate:
+    in_path, out_path = args.truncate
+    truncated = truncate_corpus(in_path, out_path, 8 * analysis.snaplen)
+    print(
+        "Truncated %s packets of %s." % (truncated, in_path), file=sys.stderr
+    )
+
+
+if __name__ == "__main__":
+  main()
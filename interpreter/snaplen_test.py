@@ -0,0 +1,166 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the snaplen analysis."""
+
+import contextlib
+import io
+import os
+import random
+import tempfile
+import unittest
+from interpreter import config_parser
+from interpreter import corpus
+from interpreter import interp
+from interpreter import ir_parser
+from interpreter import snaplen
+from interpreter import test_util
+import interpreter.datatypes as d
+
+IR_FILE = "interpreter/test_files/simple_ip_parser.json"
+CONFIG_FILE = "interpreter/test_files/simple_ip_config.json"
+
+CONFIG = {
+    "data stores": [test_util.store("state", 8, persistent=True)],
+    "keys": ["state[0:7]"],
+}
+
+
+# Reads a type byte, then skips a header whose length (in 32-bit words) is in
+# its second nibble.
+TCAM = [
+    [
+        test_util.rule(
+            "0x**",
+            {
+                test_util.copy("packet[0:7]", "state[0:7]"),
+                test_util.move("8"),
+            },
+        )
+    ],
+    [
+        test_util.rule(
+            "0x01",
+            {
+                ir_parser.parse_action(
+                    {"type": "ExtractHeader", "id": "h", "loc": "packet[0:31]"}
+                ),
+                test_util.move("(w16) packet[4:7] << 5"),
+            },
+        ),
+        test_util.rule("0x02", {test_util.move("16")}),
+        test_util.rule("0x03", {test_util.copy("1w8", "state[0:7]")}),
+    ],
+    [test_util.rule("0x**", {test_util.copy("packet[0:7]", "state[0:7]")})],
+]
+
+
+class SnaplenTest(unittest.TestCase):
+
+  def test_simple_ip(self):
+    tcam = ir_parser.parse_ir(IR_FILE, True)
+    state = config_parser.parse(CONFIG_FILE, True)
+    analysis = snaplen.analyze(tcam, state)
+    # Ethernet followed by IPv6
+    self.assertEqual(analysis.reach, 112 + 320)
+    self.assertEqual(analysis.snaplen, 54)
+    self.assertTrue(analysis.complete)
+    self.assertEqual(
+        [(p.rules, p.reach) for p in analysis.paths],
+        [
+            (((0, 0), (1, 1)), 432),
+            (((0, 0), (1, 0)), 272),
+            (((0, 0),), 112),
+        ],
+    )
+
+  def test_dynamic(self):
+    state = config_parser.parse_config(CONFIG)
+    analysis = snaplen.analyze(TCAM, state)
+    # The header can be 15 words long, and the last stage reads a byte after
+    # it
+    self.assertEqual(analysis.reach, 8 + 15 * 32 + 8)
+    self.assertEqual(
+        [(p.rules, p.reach) for p in analysis.paths],
+        [
+            (((0, 0), (1, 0), (2, 0)), 496),
+            (((0, 0), (1, 1), (2, 0)), 32),
+            # Rule 2 and no match have the same effect
+            (((0, 0), (2, 0)), 16),
+        ],
+    )
+    analysis = snaplen.analyze(TCAM, state, max_paths=2)
+    self.assertFalse(analysis.complete)
+    self.assertEqual(len(analysis.paths), 2)
+
+  def test_dynamic_shift(self):
+    # The shift amount can be up to 2^64 - 1 bits
+    move = test_util.move("(w32) packet[0:7] << packet[8:71]")
+    self.assertEqual(
+        snaplen.rule_effect({move}), snaplen.Effect(2**32 - 1, 2**32 - 1)
+    )
+    move = test_util.move("(w32) packet[0:7] << packet[8:10]")
+    self.assertEqual(
+        snaplen.rule_effect({move}), snaplen.Effect(255 << 7, 255 << 7)
+    )
+
+  def test_truncation_preserves_results(self):
+    state = config_parser.parse_config(CONFIG)
+    analysis = snaplen.analyze(TCAM, state)
+    rng = random.Random(0)
+    packets = []
+    for _ in range(200):
+      # Start with a type byte that a rule of stage 1 matches
+      packet = d.Data(uint=rng.randrange(1, 4), length=8)
+      num_bits = rng.randrange(1, 1024)
+      packet.append(d.Data(uint=rng.getrandbits(num_bits), length=num_bits))
+      packets.append(packet)
+    with tempfile.TemporaryDirectory() as tmp:
+      full = os.path.join(tmp, "full.corpus")
+      cut = os.path.join(tmp, "cut.corpus")
+      with corpus.CorpusWriter(full) as writer:
+        for packet in packets:
+          writer.add(packet)
+      num_bits = 8 * analysis.snaplen
+      truncated = snaplen.truncate_corpus(full, cut, num_bits)
+      self.assertEqual(truncated, sum(p.length > num_bits for p in packets))
+      with corpus.Corpus(cut) as cut_packets:
+        for packet, cut_packet in zip(packets, cut_packets.packets()):
+          self.assertEqual(cut_packet, packet[:num_bits])
+          results = []
+          for p in (packet, cut_packet):
+            final = interp.copy_state(state)
+            try:
+              interp.interp_tcam(TCAM, final, p)
+              error = None
+            except RuntimeError as e:
+              error = str(e)
+            results.append((
+                error,
+                final.cursor,
+                final.stores["state"].value,
+                final.headers.refs(),
+            ))
+          self.assertEqual(results[0], results[1])
+
+  def test_main(self):
+    stdout = io.StringIO()
+    with contextlib.redirect_stdout(stdout):
+      snaplen.main(["--ir", IR_FILE, "--config", CONFIG_FILE])
+    self.assertIn("stage 0 rule 0 -> stage 1 rule 1", stdout.getvalue())
+    self.assertIn("Recommended snaplen: 54 bytes", stdout.getvalue())
+
+
+if __name__ == "__main__":
+  unittest.main()
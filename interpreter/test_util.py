@@ -0,0 +1,55 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helpers for building test configurations and programs."""
+
+import random
+from interpreter import ir_parser
+import interpreter.datatypes as d
+
+
+def store(
+    name: str, width: int, persistent=False, masked=False, write=True
+) -> dict:
+  """A data store of a json configuration."""
+  return {
+      "name": name,
+      "width": width,
+      "read": True,
+      "write": write,
+      "persistent": persistent,
+      "masked-writes": masked,
+  }
+
+
+def rule(pattern: str, actions: set[d.Action]) -> d.Rule:
+  """A rule matching a single key, e.g. rule("0x0*", {...})."""
+  return ([ir_parser.parse_pattern(pattern)], actions)
+
+
+def copy(src: str, dst: str) -> d.Action:
+  return ir_parser.parse_action({"type": "CopyData", "src": src, "dst": dst})
+
+
+def move(numbits: str) -> d.Action:
+  return ir_parser.parse_action({"type": "MoveCursor", "numbits": numbits})
+
+
+def random_pattern(rng: random.Random, width: int) -> d.Pattern:
+  value = rng.getrandbits(width)
+  # Mostly wildcards, so that many rules match each key
+  mask = rng.getrandbits(width) & rng.getrandbits(width)
+  return d.Pattern(
+      d.Data(uint=value, length=width), d.Data(uint=mask, length=width)
+  )
@@ -0,0 +1,266 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A compact recorder of which rule fired in each stage of each packet.
+
+A TraceRecorder can be passed to interp.interp_tcam. For each stage of each
+traced packet, it writes a binary record into a ring buffer of bounded size,
+so that it can be left on during long replays: once the buffer is full, the
+oldest records are overwritten. Packets can be sampled, so that only one in
+every N is traced.
+
+Each record holds, as little-endian ints (a u64 for the packet, so that long
+replays can't overflow it, and u32s for the rest):
+
+  packet:  the number of the packet (counting every packet, traced or not)
+  stage
+  rule:    the index of the rule that matched, or NO_MATCH
+  cursor:  the cursor before and after the stage's actions
+  flags:   FAILED if the stage's actions raised an error
+  stores:  a bitmask of the stores the rule writes to, with bit i set for the
+           i-th store of the configuration. It takes one byte per 8 stores, so
+           all the records of a trace have the same size.
+
+Traces can be saved to a file, and rendered against the IR they were recorded
+with.
+"""
+
+from collections.abc import Iterator
+import dataclasses
+import struct
+
+from interpreter import ir_writer
+import interpreter.datatypes as d
+import interpreter.expression_parser as eparser
+
+ParseError = eparser.ParseError
+
+MAGIC = b"CAIRNTRC"
+VERSION = 1
+
+header_struct = struct.Struct("<8sHIQ")
+# A record without its stores bitmask
+record_struct = struct.Struct("<QIIIII")
+name_struct = struct.Struct("<H")
+
+NO_MATCH = 0xFFFFFFFF
+FAILED = 1
+
+
+@dataclasses.dataclass(frozen=True)
+class Record:
+  packet: int
+  stage: int
+  rule: int | None
+  cursor_before: int
+  cursor_after: int
+  stores: int
+  failed: bool
+
+
+def mask_size(num_stores: int) -> int:
+  """The number of bytes of a record's stores bitmask."""
+  return (num_stores + 7) // 8
+
+
+def record_size(num_stores: int) -> int:
+  return record_struct.size + mask_size(num_stores)
+
+
+def decode_record(
+    buf: bytes | memoryview, offset: int, num_stores: int
+) -> Record:
+  packet, stage, rule, before, after, flags = record_struct.unpack_from(
+      buf, offset
+  )
+  start = offset + record_struct.size
+  stores = int.from_bytes(buf[start : start + mask_size(num_stores)], "little")
+  return Record(
+      packet=packet,
+      stage=stage,
+      rule=None if rule == NO_MATCH else rule,
+      cursor_before=before,
+      cursor_after=after,
+      stores=stores,
+      failed=bool(flags & FAILED),
+  )
+
+
+class TraceRecorder:
+  """Records interpreter steps into a ring buffer. Implements interp.Tracer."""
+
+  def __init__(
+      self,
+      store_names: list[str],
+      capacity: int = 1 << 16,
+      sample_every: int = 1,
+  ):
+    """Create an empty recorder.
+
+    Args:
+      store_names: the names of the configuration's stores, in order (e.g.
+        list(state.stores))
+      capacity: the number of records kept
+      sample_every: trace one packet out of every sample_every
+    """
+    if capacity <= 0 or sample_every <= 0:
+      raise ValueError("capacity and sample_every must be positive.")
+    self.store_names = list(store_names)
+    self._store_bits = {name: 1 << i for i, name in enumerate(store_names)}
+    self._mask_size = mask_size(len(store_names))
+    self.record_size = record_size(len(store_names))
+    self.capacity = capacity
+    self.sample_every = sample_every
+    self._buf = bytearray(capacity * self.record_size)
+    # The total number of records written, including overwritten ones
+    self.num_recorded = 0
+    # The number of the current packet
+    self._packet = -1
+
+  def start_packet(self) -> bool:
+    self._packet += 1
+    return self._packet % self.sample_every == 0
+
+  def record(
+      self,
+      stage: int,
+      rule: int | None,
+      actions: set[d.Action],
+      cursor_before: int,
+      cursor_after: int,
+      failed: bool = False,
+  ) -> None:
+    stores = 0
+    for action in actions:
+      if action.action_type == d.ActionType.COPYDATA:
+        stores |= self._store_bits.get(action.action_args[1].name, 0)
+    offset = (self.num_recorded % self.capacity) * self.record_size
+    record_struct.pack_into(
+        self._buf,
+        offset,
+        self._packet,
+        stage,
+        NO_MATCH if rule is None else rule,
+        cursor_before,
+        cursor_after,
+        FAILED if failed else 0,
+    )
+    offset += record_struct.size
+    self._buf[offset : offset + self._mask_size] = stores.to_bytes(
+        self._mask_size, "little"
+    )
+    self.num_recorded += 1
+
+  def __len__(self) -> int:
+    """The number of records currently held."""
+    return min(self.num_recorded, self.capacity)
+
+  def _ordered(self) -> bytes:
+    """The held records, oldest first."""
+    if self.num_recorded <= self.capacity:
+      return bytes(self._buf[: self.num_recorded * self.record_size])
+    split = (self.num_recorded % self.capacity) * self.record_size
+    return bytes(self._buf[split:] + self._buf[:split])
+
+  def records(self) -> list[Record]:
+    """The held records, oldest first."""
+    buf = self._ordered()
+    return [
+        decode_record(buf, offset, len(self.store_names))
+        for offset in range(0, len(buf), self.record_size)
+    ]
+
+  def clear(self) -> None:
+    self.num_recorded = 0
+
+  def save(self, path: str) -> None:
+    """Write the held records to a file, which can be read by load."""
+    with open(path, "wb") as f:
+      f.write(
+          header_struct.pack(MAGIC, VERSION, len(self.store_names), len(self))
+      )
+      for name in self.store_names:
+        encoded = name.encode("utf-8")
+        f.write(name_struct.pack(len(encoded)) + encoded)
+      f.write(self._ordered())
+
+
+@dataclasses.dataclass
+class Trace:
+  """A trace read back from a file."""
+
+  store_names: list[str]
+  records: list[Record]
+
+
+def load(path: str) -> Trace:
+  with open(path, "rb") as f:
+    buf = f.read()
+  if len(buf) < header_struct.size or buf[:8] != MAGIC:
+    raise ParseError("%s is not a trace file." % path)
+  _, version, num_stores, num_records = header_struct.unpack_from(buf, 0)
+  if version != VERSION:
+    raise ParseError(
+        "%s has trace version %s, but only version %s is supported."
+        % (path, version, VERSION)
+    )
+  offset = header_struct.size
+  store_names = []
+  for _ in range(num_stores):
+    (length,) = name_struct.unpack_from(buf, offset)
+    offset += name_struct.size
+    store_names.append(buf[offset : offset + length].decode("utf-8"))
+    offset += length
+  size = record_size(num_stores)
+  if len(buf) != offset + num_records * size:
+    raise ParseError("%s is truncated or corrupt." % path)
+  records = [
+      decode_record(buf, offset + i * size, num_stores)
+      for i in range(num_records)
+  ]
+  return Trace(store_names, records)
+
+
+def render_record(
+    record: Record, tcam: d.TCAM, store_names: list[str]
+) -> str:
+  """Describe a record in terms of the IR's rules."""
+  line = "packet %s stage %s: " % (record.packet, record.stage)
+  if record.rule is None:
+    line += "no match"
+  elif record.stage < len(tcam) and record.rule < len(tcam[record.stage]):
+    patterns = tcam[record.stage][record.rule][0]
+    line += "rule %s [%s]" % (
+        record.rule,
+        ", ".join(ir_writer.format_pattern(p) for p in patterns),
+    )
+  else:
+    line += "rule %s (not in the IR)" % record.rule
+  line += ", cursor %s -> %s" % (record.cursor_before, record.cursor_after)
+  written = [
+      name for i, name in enumerate(store_names) if record.stores & (1 << i)
+  ]
+  if written:
+    line += ", wrote %s" % ", ".join(written)
+  if record.failed:
+    line += ", FAILED"
+  return line
+
+
+def render(
+    records: list[Record], tcam: d.TCAM, store_names: list[str]
+) -> Iterator[str]:
+  """Render records as lines of text, one per record."""
+  for record in records:
+    yield render_record(record, tcam, store_names)
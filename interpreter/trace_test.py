@@ -0,0 +1,124 @@
+# Copyright 2023 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the execution trace recorder."""
+
+import os
+import tempfile
+import unittest
+from interpreter import config_parser
+from interpreter import interp
+from interpreter import ir_parser
+from interpreter import trace
+import interpreter.datatypes as d
+
+IR_FILE = "interpreter/test_files/simple_ip_parser.json"
+CONFIG_FILE = "interpreter/test_files/simple_ip_config.json"
+
+IPV4_PACKET = "0x" + "ff" * 12 + "0800" + "00" * 12 + "7f000001" + "00" * 4
+IPV6_PACKET = "0x" + "ff" * 12 + "86dd" + "00" * 40
+SHORT_PACKET = "0x" + "ff" * 12 + "0800" + "00" * 4
+
+
+class TraceTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tcam = ir_parser.parse_ir(IR_FILE, True)
+    self.initial = config_parser.parse(CONFIG_FILE, True)
+
+  def run_packets(self, recorder: trace.TraceRecorder, packets: list[str]):
+    for packet in packets:
+      state = interp.copy_state(self.initial)
+      try:
+        interp.interp_tcam(self.tcam, state, d.Data(packet), tracer=recorder)
+      except RuntimeError:
+        pass
+
+  def test_record(self):
+    recorder = trace.TraceRecorder(list(self.initial.stores))
+    self.run_packets(recorder, [IPV4_PACKET, SHORT_PACKET])
+    self.assertEqual(
+        list(trace.render(recorder.records(), self.tcam, recorder.store_names)),
+        [
+            "packet 0 stage 0: rule 0 [0x********, 0x********], cursor 0 ->"
+            " 112, wrote r1, state",
+            "packet 0 stage 1: rule 0 [0x00000001, 0x0800****], cursor 112 ->"
+            " 272, wrote r1, state",
+            "packet 0 stage 2: rule 0 [0x00000002, 0x7f0000**], cursor 272 ->"
+            " 272, wrote state",
+            "packet 1 stage 0: rule 0 [0x********, 0x********], cursor 0 ->"
+            " 112, wrote r1, state",
+            # The rule's extract goes past the end of the packet
+            "packet 1 stage 1: rule 0 [0x00000001, 0x0800****], cursor 112 ->"
+            " 112, wrote r1, state, FAILED",
+        ],
+    )
+
+  def test_ring_buffer_and_sampling(self):
+    recorder = trace.TraceRecorder(
+        list(self.initial.stores), capacity=4, sample_every=2
+    )
+    self.run_packets(recorder, [IPV4_PACKET, IPV6_PACKET] * 3)
+    # Packets 0, 2 and 4 were traced, with 3 stages each
+    self.assertEqual(recorder.num_recorded, 9)
+    self.assertEqual(len(recorder), 4)
+    records = recorder.records()
+    self.assertEqual(
+        [(r.packet, r.stage) for r in records],
+        [(2, 2), (4, 0), (4, 1), (4, 2)],
+    )
+    self.assertFalse(any(r.failed for r in records))
+
+  def test_save_load(self):
+    recorder = trace.TraceRecorder(list(self.initial.stores), capacity=5)
+    self.run_packets(recorder, [IPV4_PACKET, IPV6_PACKET])
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    self.addCleanup(os.remove, path)
+    recorder.save(path)
+    loaded = trace.load(path)
+    self.assertEqual(loaded.store_names, recorder.store_names)
+    self.assertEqual(loaded.records, recorder.records())
+
+    with open(path, "r+b") as f:
+      f.truncate(os.path.getsize(path) - 1)
+    self.assertRaises(trace.ParseError, trace.load, path)
+
+  def test_packet_numbers_past_u32(self):
+    recorder = trace.TraceRecorder(list(self.initial.stores))
+    # Skip ahead, as if 2^32 packets had already been replayed
+    recorder._packet = 2**32 - 1  # pylint: disable=protected-access
+    self.run_packets(recorder, [IPV4_PACKET])
+    self.assertEqual({r.packet for r in recorder.records()}, {2**32})
+
+  def test_many_stores(self):
+    # The stores bitmask grows with the number of stores
+    names = ["s%s" % i for i in range(40)] + list(self.initial.stores)
+    recorder = trace.TraceRecorder(names, capacity=2)
+    self.assertEqual(recorder.record_size, trace.record_size(42))
+    self.run_packets(recorder, [IPV4_PACKET])
+    # r1 and state are the last two stores
+    self.assertEqual(
+        [r.stores for r in recorder.records()], [3 << 40, 1 << 41]
+    )
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    self.addCleanup(os.remove, path)
+    recorder.save(path)
+    self.assertEqual(trace.load(path).records, recorder.records())
+
+
+if __name__ == "__main__":
+  unittest.main()